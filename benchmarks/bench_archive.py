@@ -0,0 +1,70 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compression throughput (MB/s of input) of create_archive_with_ignore(), single-threaded vs. --jobs.
+
+    python benchmarks/bench_archive.py [--mb 512] [--formats zip tgz] [--jobs 1 4 8] [--source DIR]
+
+The generated source mixes text-like (compressible) and random (incompressible) files.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jh_cp.jh_cp import create_archive_with_ignore, host  # noqa: E402
+
+WORDS = [b"copy", b"archive", b"ignore", b"tree", b"rule", b"path", b"file", b"directory", b"pattern", b"walk"]
+
+
+def make_mixed_tree(root: Path, total_mb: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    written, index = 0, 0
+    while written < total_mb << 20:
+        size = rng.choice([4 << 10, 64 << 10, 1 << 20, 16 << 20])
+        if index % 4 == 3:
+            data = os.urandom(size)
+        else:
+            data = b" ".join(rng.choice(WORDS) for _ in range(size // 6))[:size]
+        directory = root / f"d{index % 16:02d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"f{index:05d}.dat").write_bytes(data)
+        written += len(data)
+        index += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mb", type=int, default=512, help="Size of the generated source in MiB")
+    parser.add_argument("--formats", nargs="+", default=["zip", "tgz"], help="Archive suffixes to compare")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, os.cpu_count() or 4], help="Worker counts")
+    parser.add_argument("--source", type=str, help="Existing source tree (skips generation)")
+    args = parser.parse_args()
+
+    host.mk_silent()
+    with tempfile.TemporaryDirectory() as scratch:
+        source = Path(args.source) if args.source else Path(scratch) / "src"
+        if not args.source:
+            make_mixed_tree(source, args.mb)
+        total = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(source) for f in files)
+
+        for archive_format in args.formats:
+            for jobs in args.jobs:
+                output = Path(scratch) / f"bench_j{jobs}.{archive_format}"
+                start = time.perf_counter()
+                create_archive_with_ignore(source, output, [], jobs=jobs)
+                elapsed = time.perf_counter() - start
+                ratio = output.stat().st_size / total
+                print(f"{archive_format:<4} jobs={jobs:<3d} {total / elapsed / 1e6:8.1f} MB/s  "
+                      f"({elapsed:6.2f} s, ratio {ratio:.3f})")
+                output.unlink()
+
+
+if __name__ == "__main__":
+    main()
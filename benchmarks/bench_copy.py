@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput of copytree_with_ignore() on a synthetic tree of many small files, sequential vs. --jobs.
+
+    python benchmarks/bench_copy.py [--files 100000] [--jobs 1 8 32] [--target /mnt/nfs/scratch]
+
+Point --target at the slow (NFS, USB) filesystem under test; the source tree is generated in a
+temporary directory unless --source names an existing one.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jh_cp.jh_cp import CP_IGNORE_DEFAULT, copytree_with_ignore, host, load_ignore_rules  # noqa: E402
+
+
+def make_small_file_tree(root: Path, files: int, per_dir: int = 100, size: int = 2048) -> None:
+    payload = os.urandom(size)
+    for i in range(files):
+        directory = root / f"d{i // per_dir // per_dir:03d}" / f"d{i // per_dir % per_dir:03d}"
+        if i % per_dir == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"f{i:07d}.dat").write_bytes(payload)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=100_000, help="Number of small files to generate")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 8, 32], help="Worker counts to compare")
+    parser.add_argument("--source", type=str, help="Existing source tree (skips generation)")
+    parser.add_argument("--target", type=str, help="Directory on the filesystem under test (default: temp dir)")
+    args = parser.parse_args()
+
+    rules = load_ignore_rules(Path(__file__).resolve().parent.parent / "jh_cp" / CP_IGNORE_DEFAULT)
+    host.mk_silent()
+    with tempfile.TemporaryDirectory() as scratch:
+        source = Path(args.source) if args.source else Path(scratch) / "src"
+        if not args.source:
+            make_small_file_tree(source, args.files)
+        count = sum(len(files) for _, _, files in os.walk(source))
+        target_root = Path(args.target) if args.target else Path(scratch)
+
+        for jobs in args.jobs:
+            target = target_root / f"jh_cp_bench_copy_j{jobs}"
+            shutil.rmtree(target, ignore_errors=True)
+            start = time.perf_counter()
+            copytree_with_ignore(source, target, list(rules), jobs=jobs)
+            elapsed = time.perf_counter() - start
+            print(f"jobs={jobs:<3d} {count} files in {elapsed:7.2f} s  ({count / elapsed:9.0f} files/s)")
+            shutil.rmtree(target, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput of each copytree_with_ignore() --copy-mode on a few large files.
+
+    python benchmarks/bench_copy_modes.py [--mb 2048] [--files 4] [--modes auto kernel buffered] [--dir /mnt/btrfs]
+
+Point --dir at a btrfs/xfs (CoW) filesystem to see reflink clones: source and copies are created
+there, so the copy stays on one filesystem. Modes that cannot run there are reported, not fatal.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jh_cp.jh_cp import COPY_MODES, copytree_with_ignore, host  # noqa: E402
+
+
+def make_large_files(root: Path, total_mb: int, files: int) -> None:
+    root.mkdir(parents=True, exist_ok=True)
+    block = os.urandom(1 << 20)
+    for i in range(files):
+        with open(root / f"blob{i:02d}.bin", "wb") as f:
+            for _ in range(max(total_mb // files, 1)):
+                f.write(block)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mb", type=int, default=2048, help="Total size of the generated files in MiB")
+    parser.add_argument("--files", type=int, default=4, help="Number of generated files")
+    parser.add_argument("--modes", nargs="+", choices=COPY_MODES, default=["reflink", "kernel", "buffered"],
+                        help="Copy modes to compare")
+    parser.add_argument("--dir", type=str, help="Scratch directory on the filesystem under test (default: temp)")
+    args = parser.parse_args()
+
+    host.mk_silent()
+    with tempfile.TemporaryDirectory(dir=args.dir) as scratch:
+        source = Path(scratch) / "src"
+        make_large_files(source, args.mb, args.files)
+        if hasattr(os, "sync"):
+            os.sync()  # keep dirty pages of the generated files out of the first measurement
+        total = sum(f.stat().st_size for f in source.iterdir())
+
+        for mode in args.modes:
+            target = Path(scratch) / f"copy_{mode}"
+            start = time.perf_counter()
+            stats = copytree_with_ignore(source, target, [], copy_mode=mode)
+            elapsed = time.perf_counter() - start
+            if stats is None or stats.errors:
+                print(f"{mode:<9} not supported on this filesystem")
+            else:
+                print(f"{mode:<9} {elapsed:8.3f} s  {total / elapsed / 1e9:8.2f} GB/s  {stats.backends}")
+            shutil.rmtree(target, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
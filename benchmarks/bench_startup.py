@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CLI start-up cost: the `-X importtime` breakdown of `import jh_cp` and the wall time of short commands.
+
+    python benchmarks/bench_startup.py [--runs 20] [--top 12]
+
+Every command runs in a fresh interpreter on a tiny generated tree, the way build scripts call jh_cp;
+the time of a bare `python -c pass` is shown for reference. The package is byte-compiled first so that
+a stale or missing .pyc (e.g. under PYTHONDONTWRITEBYTECODE) does not add the compile time to every run.
+"""
+
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def import_times() -> list[tuple[int, int, str]]:
+    """(self us, cumulative us, module) for every module imported by `import jh_cp`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import jh_cp"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return rows
+
+
+def wall_time(argv: list[str], runs: int, env: dict[str, str]) -> float:
+    """Median seconds of `runs` fresh interpreters running argv."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *argv], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20, help="Interpreter launches per command")
+    parser.add_argument("--top", type=int, default=12, help="Slowest imports listed")
+    args = parser.parse_args()
+
+    compileall.compile_dir(ROOT / "jh_cp", quiet=1)
+    rows = import_times()
+    package = next(cumulative for _, cumulative, name in rows if name == "jh_cp")
+    print(f"import jh_cp: {package / 1e3:.1f} ms cumulative, {len(rows)} modules")
+    for self_us, cumulative_us, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"  {self_us / 1e3:6.2f} ms self {cumulative_us / 1e3:7.2f} ms cumulative  {name}")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        source = Path(scratch) / "src"
+        for i in range(20):
+            directory = source / f"d{i % 4}"
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / f"f{i}.py").write_text("pass\n")
+        env = dict(os.environ, JH_CP_CACHE_DIR=str(Path(scratch) / "cache"))
+        cli = ["-c", "from jh_cp.jh_cp import jh_cp_main; jh_cp_main()"]  # what the console script runs
+        commands = {
+            "python -c pass": ["-c", "pass"],
+            "jh_cp tree": [*cli, "tree", str(source)],
+            "jh_cp plan": [*cli, "plan", str(source), "--summary-only"],
+            "jh_cp cp": [*cli, "cp", str(source), str(Path(scratch) / "dst"), "-q", "--sync"],
+            "jh_cp cp --exclude-*": [*cli, "cp", str(source), str(Path(scratch) / "dst"), "-q", "--sync",
+                                     "--exclude-zip", "--exclude-log", "--exclude-db"],
+        }
+        for label, argv in commands.items():
+            print(f"{label:<22} {wall_time(argv, args.runs, env) * 1e3:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark suite: every command on one synthetic tree, timed per phase, written as JSON.
+
+    python benchmarks/bench_suite.py [--depth 3] [--fanout 4] [--files 30] [--sizes 1k:70,16k:25,1m:5]
+                                     [--ignored 0.2] [--seed 0] [--commands cp archive_tar ...] [--runs 3]
+                                     [--jobs 1] [--source DIR] [--output result.json] [--compare base.json]
+
+The tree comes from synthetic.py and is filtered by DEFAULT_IGNORE_RULES, so its ignored share is known.
+Each command runs in a fresh interpreter (its peak RSS is that process's own) and reports its median
+wall time over --runs, files/s and MB/s of what it kept, and three phases:
+    walk  - listing the tree without any rule (os.scandir and the walk itself)
+    match - what the rules add to that walk
+    io    - the rest of the command: reading, writing, compressing, drawing
+Save a run with --output on one commit and pass it to --compare on another to see the deltas.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jh_cp.jh_cp import (RuleSet, classify, copytree_with_ignore, create_archive_with_ignore,  # noqa: E402
+                         draw_tree_with_ignore, host, load_ignore_rules, walk_with_ignore)
+from synthetic import add_tree_arguments, make_tree, tree_arguments  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+COMMANDS = ["rules", "walk", "tree", "cp", "cp_sync", "archive_tar", "archive_tgz", "archive_zip"]
+
+
+def _timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _peak_rss_kb() -> int | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KiB elsewhere
+
+
+def run_child(name: str, source: Path, scratch: Path, jobs: int) -> dict:
+    """Runs one command on source inside this process and returns its measurements."""
+    host.mk_silent()
+    rules = load_ignore_rules(scratch / "missing.cp_ignore")  # no ignore file: DEFAULT_IGNORE_RULES
+    listed, kept = [], []
+    walk = _timed(lambda: listed.extend(relpath + "/" if entry.is_dir() else relpath
+                                        for relpath, entry in walk_with_ignore(source, RuleSet([], nested=None))))
+    filtered = _timed(lambda: kept.extend(entry for _, entry in walk_with_ignore(source, rules)
+                                          if not entry.is_dir()))
+    files, size = len(kept), sum(entry.stat().st_size for entry in kept)
+
+    target = scratch / "dst"
+    archive = scratch / f"out.{name.partition('_')[2]}"
+    shutil.rmtree(target, ignore_errors=True)
+    if name == "rules":
+        seconds = _timed(lambda: classify(listed, rules))
+        phases = {"walk": 0.0, "match": seconds, "io": 0.0}
+        files, size = len(listed), 0
+    else:
+        if name == "cp_sync":
+            copytree_with_ignore(source, target, rules, jobs=jobs)
+        commands = {
+            "walk": lambda: sum(1 for _ in walk_with_ignore(source, rules)),
+            "tree": lambda: draw_tree_with_ignore(source, rules),
+            "cp": lambda: copytree_with_ignore(source, target, rules, jobs=jobs),
+            "cp_sync": lambda: copytree_with_ignore(source, target, rules, jobs=jobs, sync=True),
+        }
+        seconds = _timed(commands.get(name, lambda: create_archive_with_ignore(source, archive, rules, jobs=jobs)))
+        phases = {"walk": walk, "match": max(filtered - walk, 0.0), "io": max(seconds - filtered, 0.0)}
+    shutil.rmtree(target, ignore_errors=True)
+    if archive.exists():
+        archive.unlink()
+    return {"seconds": seconds, "phases": phases, "files": files, "bytes": size, "peak_rss_kb": _peak_rss_kb()}
+
+
+def measure(name: str, source: Path, scratch: Path, jobs: int, runs: int) -> dict:
+    """Median of `runs` fresh interpreters running one command."""
+    env = dict(os.environ, JH_CP_CACHE_DIR=str(scratch / "cache"))
+    samples = []
+    for _ in range(runs):
+        argv = [sys.executable, __file__, "--child", name, "--source", str(source), "--scratch", str(scratch),
+                "--jobs", str(jobs)]
+        result = subprocess.run(argv, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout))
+    seconds = statistics.median(sample["seconds"] for sample in samples)
+    files, size = samples[0]["files"], samples[0]["bytes"]
+    rss = [sample["peak_rss_kb"] for sample in samples if sample["peak_rss_kb"] is not None]
+    return {
+        "seconds": seconds,
+        "files_per_s": files / seconds if seconds else None,
+        "mb_per_s": size / seconds / 1e6 if seconds and size else None,
+        "peak_rss_kb": max(rss) if rss else None,
+        "phases": {phase: statistics.median(sample["phases"][phase] for sample in samples)
+                   for phase in ("walk", "match", "io")},
+        "files": files,
+        "bytes": size,
+    }
+
+
+def _commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                                text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def _print_results(results: dict, base: dict | None) -> None:
+    print(f"{'command':<12} {'seconds':>9} {'files/s':>10} {'MB/s':>8} {'RSS MiB':>8} "
+          f"{'walk':>7} {'match':>7} {'io':>7}" + ("  vs. base" if base else ""))
+    for name, result in results.items():
+        line = (f"{name:<12} {result['seconds']:9.3f} {result['files_per_s'] or 0:10.0f} "
+                f"{result['mb_per_s'] or 0:8.1f} {(result['peak_rss_kb'] or 0) / 1024:8.1f} "
+                + " ".join(f"{result['phases'][phase]:7.3f}" for phase in ("walk", "match", "io")))
+        previous = base and base.get(name)
+        if previous:
+            change = (result["seconds"] - previous["seconds"]) / previous["seconds"] * 100
+            line += f"  {change:+6.1f}% time"
+            if result["peak_rss_kb"] and previous.get("peak_rss_kb"):
+                line += f" {(result['peak_rss_kb'] - previous['peak_rss_kb']) / previous['peak_rss_kb'] * 100:+6.1f}% RSS"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_tree_arguments(parser)
+    parser.add_argument("--commands", nargs="+", default=COMMANDS, choices=COMMANDS, help="Commands to time")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per command (the median is reported)")
+    parser.add_argument("--jobs", type=int, default=1, help="Workers of cp and archive")
+    parser.add_argument("--source", type=str, help="Existing source tree (skips generation)")
+    parser.add_argument("--output", type=str, help="Write the results as JSON")
+    parser.add_argument("--compare", type=str, help="JSON of an earlier run to compare with")
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--scratch", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, Path(args.source), Path(args.scratch), args.jobs)))
+        return
+
+    base = json.loads(Path(args.compare).read_text())["results"] if args.compare else None
+    with tempfile.TemporaryDirectory() as scratch:
+        source = Path(args.source).resolve() if args.source else Path(scratch) / "src"
+        tree = tree_arguments(args) if not args.source else {"source": str(source)}
+        if not args.source:
+            tree.update(make_tree(source, **tree))
+        print(json.dumps(tree))
+        results = {name: measure(name, source, Path(scratch), args.jobs, args.runs) for name in args.commands}
+
+    _print_results(results, base)
+    if args.output:
+        report = {"commit": _commit(), "python": platform.python_version(), "platform": platform.platform(),
+                  "cpus": os.cpu_count(), "runs": args.runs, "jobs": args.jobs, "tree": tree, "results": results}
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic source trees for the benchmarks.
+
+    python benchmarks/synthetic.py DIR [--depth 3] [--fanout 4] [--files 30] [--sizes 1k:70,16k:25,1m:5]
+                                       [--ignored 0.2] [--seed 0]
+
+The same arguments and seed always write the same names, sizes and contents. A share of the files
+(--ignored) is excluded by DEFAULT_IGNORE_RULES: half of them by name (*.pyc, *.bak, ...), half by
+sitting in an ignored directory (__pycache__/, node_modules/, build/, dist/) next to the regular ones.
+"""
+
+import argparse
+import json
+import random
+from pathlib import Path
+
+DEFAULT_SIZES = "1k:70,16k:25,1m:5"
+KEPT_SUFFIXES = [".py", ".txt", ".json", ".c", ".h", ".md", ".dat"]
+IGNORED_SUFFIXES = [".pyc", ".pyo", ".bak", ".swp"]  # each matched by a rule of DEFAULT_IGNORE_RULES
+IGNORED_NAMES = ["Thumbs.db", ".DS_Store"]
+IGNORED_DIRS = ["__pycache__", "node_modules", "build", "dist"]
+WORDS = [b"copy", b"archive", b"ignore", b"tree", b"rule", b"path", b"file", b"directory", b"pattern", b"walk"]
+_UNITS = {"": 1, "b": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+
+def parse_sizes(text: str) -> list[tuple[int, float]]:
+    """'1k:70,16k:25,1m:5' -> [(1024, 70.0), (16384, 25.0), (1048576, 5.0)]: file sizes and their weights."""
+    sizes = []
+    for item in text.split(","):
+        size, _, weight = item.strip().lower().partition(":")
+        number, unit = (size[:-1], size[-1]) if size[-1:] in _UNITS else (size, "")
+        sizes.append((int(float(number) * _UNITS[unit]), float(weight or 1)))
+    return sizes
+
+
+def add_tree_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--depth", type=int, default=3, help="Directory levels below the root")
+    parser.add_argument("--fanout", type=int, default=4, help="Subdirectories of every directory above --depth")
+    parser.add_argument("--files", type=int, default=30, help="Files per directory")
+    parser.add_argument("--sizes", type=str, default=DEFAULT_SIZES,
+                        help=f"File sizes and their weights, SIZE:WEIGHT,... (default {DEFAULT_SIZES})")
+    parser.add_argument("--ignored", type=float, default=0.2,
+                        help="Share of the files excluded by DEFAULT_IGNORE_RULES (default 0.2)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+
+def tree_arguments(args: argparse.Namespace) -> dict:
+    return {"depth": args.depth, "fanout": args.fanout, "files": args.files, "sizes": args.sizes,
+            "ignored": args.ignored, "seed": args.seed}
+
+
+def make_tree(root: Path, depth: int = 3, fanout: int = 4, files: int = 30, sizes: str = DEFAULT_SIZES,
+              ignored: float = 0.2, seed: int = 0) -> dict:
+    """
+    Writes the tree under root and returns its counts: dirs, total_files and total_bytes of everything written,
+    and kept_files / kept_bytes of what DEFAULT_IGNORE_RULES leave.
+    Half of the files hold text (compressible), the other half random bytes.
+    """
+    rng = random.Random(seed)
+    choices, weights = zip(*parse_sizes(sizes))
+    largest = max(choices)
+    noise = rng.randbytes(largest)
+    text = b" ".join(rng.choice(WORDS) for _ in range(largest // 5 + 1))[:largest]
+    counts = {"dirs": 0, "total_files": 0, "total_bytes": 0, "kept_files": 0, "kept_bytes": 0}
+    serial = 0
+
+    stack = [(Path(root), 0)]
+    while stack:
+        directory, level = stack.pop()
+        directory.mkdir(parents=True, exist_ok=True)
+        counts["dirs"] += 1
+        for _ in range(files):
+            serial += 1
+            size = rng.choices(choices, weights)[0]
+            path = directory / f"f{serial:07d}{rng.choice(KEPT_SUFFIXES)}"
+            kept = rng.random() >= ignored
+            if not kept:
+                if rng.random() < 0.5:
+                    name = rng.choice(IGNORED_NAMES + [f"f{serial:07d}{suffix}" for suffix in IGNORED_SUFFIXES])
+                    path = directory / name
+                else:
+                    path = directory / rng.choice(IGNORED_DIRS) / path.name
+                    if not path.parent.exists():
+                        path.parent.mkdir()
+                        counts["dirs"] += 1
+            start = rng.randrange(largest - size + 1)
+            path.write_bytes((noise if rng.random() < 0.5 else text)[start:start + size])
+            counts["total_files"] += 1
+            counts["total_bytes"] += size
+            if kept:
+                counts["kept_files"] += 1
+                counts["kept_bytes"] += size
+        if level < depth:
+            stack.extend((directory / f"d{index:02d}", level + 1) for index in reversed(range(fanout)))
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root", type=str, help="Directory to create the tree in")
+    add_tree_arguments(parser)
+    args = parser.parse_args()
+    print(json.dumps(make_tree(Path(args.root), **tree_arguments(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Interrupts a `--resume` copy and a `--resume` .tar archive part-way and checks that each rerun continues.
+
+    python checks/check_resume.py [--files 30] [--stop-after 10]
+
+A pass/fail check, not a benchmark. The interruption is a KeyboardInterrupt raised from the progress
+callback, as Ctrl+C would raise it. Exits with an error message when a journal lost the finished files,
+was left behind by a complete run, or the copy or archive differs from the source.
+"""
+
+import argparse
+import os
+import sys
+import tarfile
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jh_cp.jh_cp import RESUME_PART_SUFFIX, copytree_with_ignore, create_archive_with_ignore, host  # noqa: E402
+
+
+def interrupted(run, stop_after: int) -> None:
+    """Runs run(progress) and stops it with a KeyboardInterrupt once stop_after files are done."""
+    def interrupt(stats) -> None:
+        if stats.files >= stop_after:
+            raise KeyboardInterrupt
+
+    try:
+        run(interrupt)
+        sys.exit("the first run was not interrupted")
+    except KeyboardInterrupt:
+        pass
+
+
+def check_journal(cache: Path, case: str, kept: bool) -> None:
+    if kept and not any(cache.glob("resume-*.jsonl")):
+        sys.exit(f"{case}: the interrupted run left no journal")
+    if not kept and any(cache.glob("resume-*.jsonl")):
+        sys.exit(f"{case}: the complete rerun left its journal behind")
+
+
+def check_copy(source: Path, scratch: Path, cache: Path, stop_after: int) -> str:
+    target = scratch / "copy"
+    interrupted(lambda progress: copytree_with_ignore(source, target, [], resume=True, progress=progress),
+                stop_after)
+    check_journal(cache, "cp", kept=True)
+
+    stats = copytree_with_ignore(source, target, [], resume=True)
+    # The file being copied when the run stopped may be copied again; the ones before it must not
+    if stats is None or stats.errors or stats.unchanged < stop_after - 1:
+        sys.exit(f"cp: the rerun kept {stats and stats.unchanged} of the {stop_after} copied files "
+                 f"({stats and stats.errors} errors)")
+    check_journal(cache, "cp", kept=False)
+    if any(path.name.endswith(RESUME_PART_SUFFIX) for path in target.iterdir()):
+        sys.exit("cp: the rerun left part files behind")
+    copied = {path.name: path.read_bytes() for path in target.iterdir()}
+    if copied != {path.name: path.read_bytes() for path in source.iterdir()}:
+        sys.exit("cp: the resumed copy does not hold the source files")
+    return f"cp: {stats.files} copied, {stats.unchanged} unchanged, {stats.errors} errors, journal removed"
+
+
+def check_archive(source: Path, scratch: Path, cache: Path, stop_after: int) -> str:
+    output = scratch / "out.tar"
+    interrupted(lambda progress: create_archive_with_ignore(source, output, [], resume=True, progress=progress),
+                stop_after)
+    if output.exists():
+        sys.exit("tar: an interrupted run left the finished archive name behind")
+    check_journal(cache, "tar", kept=True)
+
+    stats = create_archive_with_ignore(source, output, [], resume=True)
+    # The member being written when the run stopped may be archived again; the ones before it must not
+    if stats is None or stats.errors or stats.unchanged < stop_after - 1:
+        sys.exit(f"tar: the rerun kept {stats and stats.unchanged} of the {stop_after} archived members "
+                 f"({stats and stats.errors} errors)")
+    check_journal(cache, "tar", kept=False)
+    with tarfile.open(output) as tar_f:
+        archived = {member.name: tar_f.extractfile(member).read() for member in tar_f if member.isreg()}
+    if archived != {path.name: path.read_bytes() for path in source.iterdir()}:
+        sys.exit("tar: the resumed archive does not hold the source files")
+    return f"tar: {stats.files} archived, {stats.unchanged} unchanged, {stats.errors} errors, journal removed"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=30, help="Files in the source")
+    parser.add_argument("--stop-after", type=int, default=10, help="Files done before the interruption")
+    args = parser.parse_args()
+
+    host.mk_silent()
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch = Path(scratch)
+        cache = scratch / "cache"
+        os.environ["JH_CP_CACHE_DIR"] = str(cache)  # the journals live next to the caches
+        source = scratch / "src"
+        source.mkdir()
+        for index in range(args.files):
+            (source / f"f{index:03d}.dat").write_bytes(os.urandom(64 << 10))
+
+        for check in (check_copy, check_archive):
+            print(check(source, scratch, cache, args.stop_after))
+
+
+if __name__ == "__main__":
+    main()
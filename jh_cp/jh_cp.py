@@ -16,95 +16,253 @@
 # limitations under the License.
 
 
+from __future__ import annotations
+
 import os
-import shutil
-import argparse
+import contextlib
+import errno
+import stat
 import sys
 from pathlib import Path
-import platform
-import configparser
-import subprocess
-import zipfile
-import tarfile
+import threading
 import fnmatch
+import json
+import re
+import struct
+import time
+import zlib
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+# shutil, hashlib, argparse, configparser, zipfile, tarfile and concurrent.futures are imported by the
+# functions that use them: `jh_cp tree` and `jh_cp cp` run thousands of times from build scripts
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import argparse
+    import tarfile
+    import zipfile
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from typing import BinaryIO
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+__all__ = ['Host', 'host', 'RunStats', 'load_ignore_rules', 'load_exclude_rules', 'RuleSet', 'should_ignore', 'ScanCache',
+           'classify', 'walk_with_ignore', 'copytree_with_ignore', 'watch_with_ignore', 'create_archive_with_ignore',
+           'verify_manifest', 'extract_archive_with_ignore', 'list_archive_with_ignore', 'create_snapshot',
+           'restore_snapshot', 'plan_with_ignore', 'AsyncRun',
+           'async_copytree', 'async_archive', 'async_walk', 'handle_cp_ignore',
+           'draw_tree_with_ignore', 'jh_cp_main']
+
+
+def _enable_windows_ansi() -> bool:
+    """Turns on ANSI escape processing (virtual terminal mode) for the Windows console; False if unavailable."""
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        enabled = False
+        for handle_id in (-11, -12):  # STD_OUTPUT_HANDLE, STD_ERROR_HANDLE
+            handle = kernel32.GetStdHandle(handle_id)
+            mode = ctypes.c_uint32()
+            if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+                enabled |= bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))  # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        return enabled
+    except (ImportError, AttributeError, OSError):
+        return False
+
 
-__all__ = ['Host', 'host', 'load_ignore_rules', 'load_exclude_rules', 'should_ignore',
-           'copytree_with_ignore', 'create_archive_with_ignore', 'handle_cp_ignore', 'draw_tree_with_ignore',
-           'jh_cp_main']
+def _format_bytes(size: float) -> str:
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if size < 1000 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
 
 
 class Host:
-    shell_failed: bool = False
+    QUIET, NORMAL, VERBOSE = 0, 1, 2
+    PROGRESS_INTERVAL = 0.25  # seconds between two redraws of the progress line
 
     def __init__(self):
-        self.system = platform.system()
-
-        # Bind the correct print method based on the system type
-        if self.system == 'Windows':
-            self.print = Host._print_windows
-        else:
-            self.print = Host._print_unix
+        self.system = "Windows" if os.name == "nt" else os.uname().sysname  # as platform.system()
+        self.level = Host.NORMAL
+        self.silent = False
+        self.stream = None  # None: sys.stdout, looked up on every write so redirection keeps working
+        self.ansi = _enable_windows_ansi() if self.system == 'Windows' else True
+        self._lock = threading.Lock()
+        self._progress_at = 0.0
+        self._progress_shown = False
 
     def mk_silent(self):
-        def silent_print(*args, **kwargs):  # noqa
-            pass
+        self.silent = True
 
-        self.print = silent_print
+    def mk_stderr(self):
+        # Keeps stdout clean for data, e.g. an archive streamed to '-'
+        self.stream = sys.stderr
 
-    @staticmethod
-    def _print_unix(message: str, is_error: bool = False):
-        """
-        Prints the message with colors on Unix-like systems (via echo command).
+    def _colored(self, stream, message: str, color_code: str) -> str:
+        if self.ansi and not os.environ.get("NO_COLOR") and stream.isatty():
+            return f"\033[{color_code}m{message}\033[0m"
+        return message
 
-        :param message: The message to print
-        :param is_error: Whether the message is an error (default is False)
-        :return: None
-        """
-        if not Host.shell_failed:
-            try:
-                # Attempt to use the system's echo command for colored output
-                color_code = '91' if is_error else '93'  # Red -> 91, Yellow -> 93
-                subprocess.run(f"echo \"\033[{color_code}m{message}\033[0m\"", shell=True, check=True,
-                               encoding='utf-8')
-                return
-            except (subprocess.CalledProcessError, OSError, Exception) as e:
-                # If the shell command fails, catch the exception and fall back to normal print
-                print(f"Shell command failed: {e}", file=sys.stderr)
-            finally:
-                Host.shell_failed = True
-                # Catch the exception and fall back to normal printing
-        print(message, file=sys.stderr if is_error else sys.stdout)
+    def _write(self, stream, text: str) -> None:
+        with self._lock:
+            if self._progress_shown:
+                sys.stderr.write("\r\033[K")
+                self._progress_shown = False
+            if stream is sys.stderr and sys.stdout is not sys.stderr:
+                sys.stdout.flush()  # keep errors in order with the (buffered) output before them
+            stream.write(text)
+            if stream is sys.stderr:
+                stream.flush()
 
-    @staticmethod
-    def _print_windows(message: str, is_error: bool = False):
+    def print(self, message: str, is_error: bool = False):
         """
-        Prints the message with colors on Windows (via PowerShell or cmd).
+        Prints the message in yellow (red for errors) when the stream is a terminal.
 
         :param message: The message to print
         :param is_error: Whether the message is an error (default is False)
         :return: None
         """
-        if not Host.shell_failed:
-            try:
-                color_code = 'Red' if is_error else 'Yellow'
-                # Use PowerShell's Write-Host to print colored text
-                # Use UTF-8 encoding to ensure correct output of Chinese characters
-                subprocess.run(["powershell", "-Command",
-                                f"Write-Host \"{message}\" -ForegroundColor {color_code}"],
-                               check=True, encoding='utf-8')
-                return
-            except (subprocess.CalledProcessError, OSError, Exception) as e:
-                # If the PowerShell command fails
-                print(f"PowerShell command failed: {e}", file=sys.stderr)
-            finally:
-                Host.shell_failed = True
-                # Catch the exception and fall back to normal printing
-        print(message, file=sys.stderr if is_error else sys.stdout)
+        if self.silent or (self.level < Host.NORMAL and not is_error):
+            return
+        stream = sys.stderr if is_error else self.stream or sys.stdout
+        self._write(stream, self._colored(stream, message, '91' if is_error else '93') + "\n")
+
+    def debug(self, message: str):
+        """Prints the message only at the verbose level (per-file lines, effective rules)."""
+        if not self.silent and self.level >= Host.VERBOSE:
+            stream = self.stream or sys.stdout
+            self._write(stream, message + "\n")
+
+    def progress(self, stats: "RunStats"):
+        """Redraws the progress line on a terminal stderr, at most every PROGRESS_INTERVAL seconds."""
+        if self.silent or self.level != Host.NORMAL:
+            return
+        now = time.monotonic()
+        if now - max(self._progress_at, stats.started) < Host.PROGRESS_INTERVAL:
+            return
+        self._progress_at = now
+        if not sys.stderr.isatty():
+            return
+        with self._lock:
+            sys.stderr.write(f"\r\033[K{stats.progress_line()}")
+            sys.stderr.flush()
+            self._progress_shown = True
+
+    def end_progress(self):
+        with self._lock:
+            if self._progress_shown:
+                sys.stderr.write("\r\033[K")
+                sys.stderr.flush()
+                self._progress_shown = False
+
+    def summary(self, stats: "RunStats", stream=None):
+        """Writes the run summary as one JSON object, on stdout unless another stream is given."""
+        if not self.silent:
+            stream = stream or sys.stdout
+            self._write(stream, json.dumps(stats.as_dict()) + "\n")
+            stream.flush()
 
 
 # Initialize the host
 host = Host()
 
+
+class RunStats:
+    """
+    Counters of one cp or archive run, returned by copytree_with_ignore() and create_archive_with_ignore().
+    add() is safe to call from worker threads and drives host.progress().
+    """
+
+    def __init__(self, command: str, src: Path | str, target: Path | str | list[Path | str]):
+        self.command = command
+        self.src = str(src)
+        self.target: str | list[str] = [str(path) for path in target] if isinstance(target, list) else str(target)
+        self.files = 0  # files copied or archived
+        self.bytes = 0
+        self.unchanged = 0  # --sync: files already up to date
+        self.skipped = 0  # entries excluded by the rules; an excluded directory counts once
+        self.removed = 0  # --delete: stale target entries
+        self.errors = 0
+        self.failures: list[tuple[str, str]] = []  # (path, reason) of the errors recorded with fail()
+        self.output_bytes: int | None = None  # archive: size of the written archive
+        self.expected_files: int | None = None  # estimate for the ETA, e.g. from the previous run
+        self.backends: dict[str, int] = {}  # cp: files per copy backend ("reflink", "copy_file_range", ...)
+        self.target_errors: dict[str, int] | None = None  # cp to several targets: errors per target
+        self.digests: dict[str, str] | None = None  # --verify / --manifest: relpath -> digest of what was written
+        self.verified: int | None = None  # --verify: files read back and compared with their digest
+        self.mismatches: list[dict] = []  # --verify: one record per file that did not read back the same
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        # Called with self after every add() and fail(), from whichever thread made it
+        self.on_progress: Callable[[RunStats], None] | None = None
+        self._lock = threading.Lock()
+
+    def add(self, files: int = 0, nbytes: int = 0, unchanged: int = 0, backend: str | None = None,
+            skipped: int = 0) -> None:
+        with self._lock:
+            if backend is not None:
+                self.backends[backend] = self.backends.get(backend, 0) + files
+            self.files += files
+            self.bytes += nbytes
+            self.unchanged += unchanged
+            self.skipped += skipped
+            host.progress(self)
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def fail(self, path: str, reason: str) -> None:
+        """Counts an error and keeps its reason; printing it is left to the caller."""
+        with self._lock:
+            self.errors += 1
+            self.failures.append((str(path), reason))
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def finish(self) -> "RunStats":
+        if not self.elapsed:
+            self.elapsed = time.monotonic() - self.started
+        host.end_progress()
+        return self
+
+    def progress_line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        done = self.files + self.unchanged
+        line = (f"{done} files, {_format_bytes(self.bytes)}  "
+                f"({done / elapsed:.0f} files/s, {_format_bytes(self.bytes / elapsed)}/s")
+        if self.expected_files and 0 < done < self.expected_files:
+            line += f", ETA {_format_duration((self.expected_files - done) * elapsed / done)}"
+        return line + ")"
+
+    def as_dict(self) -> dict:
+        elapsed = self.elapsed or time.monotonic() - self.started
+        result = {"command": self.command, "src": self.src, "target": self.target, "ok": self.errors == 0,
+                  "files": self.files, "bytes": self.bytes, "unchanged": self.unchanged, "skipped": self.skipped,
+                  "removed": self.removed, "errors": self.errors, "seconds": round(elapsed, 3),
+                  "files_per_second": round(self.files / elapsed, 1) if elapsed else None,
+                  "bytes_per_second": round(self.bytes / elapsed) if elapsed else None}
+        if self.output_bytes is not None:
+            result["output_bytes"] = self.output_bytes
+        if self.backends:
+            result["backends"] = dict(self.backends)
+        if self.target_errors is not None:
+            result["target_errors"] = dict(self.target_errors)
+        if self.verified is not None:
+            result["verified"] = self.verified
+            result["mismatches"] = list(self.mismatches)
+        return result
+
+    def __str__(self) -> str:
+        return f"{self.files} files, {_format_bytes(self.bytes)} in {self.elapsed:.2f} s"
+
 CP_IGNORE_DEFAULT = "jh_cp_tools/.cp_ignore"
 DEFAULT_IGNORE_RULES = [
     # Python bytecode & metadata
@@ -119,6 +277,7 @@ DEFAULT_IGNORE_RULES = [
     ".vscode/", ".idea/", ".git/", ".svn/", ".tox/", ".coverage", "node_modules/",
 ]
 EXCLUDE_RULES_INI = "jh_cp_tools/exclude-rules.ini"
+NESTED_IGNORE_FILE = ".cp_ignore"  # per-directory ignore files a walk picks up (RuleSet(nested=...))
 
 
 def load_ignore_rules(ignore_path: Path, additional_patterns: list[str] = None) -> list[tuple[str, bool]]:
@@ -160,7 +319,345 @@ def load_ignore_rules(ignore_path: Path, additional_patterns: list[str] = None)
     return normalized
 
 
-def should_ignore(file_path: Path, rules: list[tuple[str, bool]], is_dir: bool = False) -> bool:
+_GLOB_MAGIC = frozenset("*?[")
+
+
+def _in_order(text: str, end: int, literals: tuple[str, ...]) -> bool:
+    # Star-only globs match iff their literal chunks occur in order; leftmost search is exact here
+    pos = 0
+    for literal in literals:
+        pos = text.find(literal, pos, end)
+        if pos < 0:
+            return False
+        pos += len(literal)
+    return True
+
+
+class _RuleTable:
+    """Lookup tables for one rule family (file rules or directory rules) of a RuleSet."""
+    __slots__ = ('exact', 'basenames', 'suffixes', 'residue', 'residue_top')
+
+    def __init__(self, entries: list[tuple[int, str]]):
+        self.exact: dict[str, int] = {}  # "Thumbs.db" -> rule index
+        self.basenames: dict[str, int] = {}  # "**/Thumbs.db" -> "Thumbs.db" -> rule index
+        suffixes: dict[int, dict[str, list[tuple[int, tuple[str, ...]]]]] = {}  # "*.pyc", "**/*.pyc"
+        residue: list[tuple[int, str]] = []  # everything else, e.g. "*.py[cod]", "*build*"
+
+        for index, pattern in entries:
+            if not _GLOB_MAGIC.intersection(pattern):
+                self.exact[pattern] = index
+                continue
+            if '?' in pattern or '[' in pattern or not pattern.startswith('*') or pattern.endswith('*'):
+                residue.append((index, pattern))
+                continue
+            chunks = [chunk for chunk in pattern.split('*') if chunk]
+            last, before = chunks[-1], tuple(chunks[:-1])
+            if not before and last.startswith('/') and '/' not in last[1:]:
+                self.basenames[last[1:]] = index
+            else:
+                suffixes.setdefault(len(last), {}).setdefault(last, []).append((index, before))
+
+        # Entries are visited in rule order, so each candidate list is sorted by index
+        self.suffixes = sorted(suffixes.items(), reverse=True)
+        if residue:
+            # Highest index first: the first alternative that matches is the last rule that matches
+            self.residue = re.compile('|'.join(
+                f"(?P<r{index}>{fnmatch.translate(pattern)})" for index, pattern in reversed(residue)))
+            self.residue_top = residue[-1][0]
+        else:
+            self.residue = None
+            self.residue_top = -1
+
+    def last_match(self, text: str) -> int:
+        """Index of the last rule matching `text`, or -1."""
+        best = self.exact.get(text, -1)
+        if self.basenames:
+            _, sep, name = text.rpartition('/')
+            if sep:
+                best = max(best, self.basenames.get(name, -1))
+        length = len(text)
+        for size, table in self.suffixes:
+            if size > length:
+                continue
+            candidates = table.get(text[length - size:])
+            if candidates:
+                for index, before in reversed(candidates):
+                    if index <= best:
+                        break
+                    if not before or _in_order(text, length - size, before):
+                        best = index
+                        break
+        if self.residue_top > best:
+            match = self.residue.match(text)
+            if match:
+                best = max(best, int(match.lastgroup[1:]))
+        return best
+
+
+class _Scope:
+    """
+    The rules of a RuleSet that can still match something below one directory prefix.
+    Rules anchored to a literal prefix that the directory has left behind are dropped.
+    """
+    __slots__ = ('indices', 'anchored', 'files', 'dirs', 'file_top', 'dir_top')
+
+    def __init__(self, file_entries: list[tuple[int, str]], dir_entries: list[tuple[int, str]]):
+        self.indices = tuple(sorted(index for index, _ in file_entries + dir_entries))
+        anchored = []
+        for index, pattern in file_entries + dir_entries:
+            magic = min((pos for pos, char in enumerate(pattern) if char in _GLOB_MAGIC), default=-1)
+            literal = pattern if magic < 0 else pattern[:magic]
+            if literal:
+                anchored.append((index, literal, magic < 0))
+        self.anchored: tuple[tuple[int, str, bool], ...] = tuple(sorted(anchored))
+        self.files = _RuleTable(file_entries)
+        self.dirs = _RuleTable(dir_entries)
+        # Last rule of each family, with its regex when it ends in '*' (it then matches all of a prefix it matches)
+        self.file_top = self._top(file_entries)
+        self.dir_top = self._top(dir_entries)
+
+    @staticmethod
+    def _top(entries: list[tuple[int, str]]) -> tuple[int, re.Pattern | None]:
+        if not entries:
+            return -1, None
+        index, pattern = entries[-1]
+        return index, re.compile(fnmatch.translate(pattern)) if pattern.endswith('*') else None
+
+
+class _Layer:
+    """The rules of one nested ignore file, matched against paths relative to the directory holding it."""
+    __slots__ = ('prefix', 'rules', 'source')
+
+    def __init__(self, prefix: str, rules: RuleSet, source: str):
+        self.prefix = prefix  # "rel/dir/" of that directory, "" for the root of the walk
+        self.rules = rules
+        self.source = source  # "rel/dir/.cp_ignore"
+
+
+class _Layers:
+    """
+    The scope of a directory below nested ignore files: the RuleSet's own _Scope, and each layer with its
+    rules narrowed to the directory, innermost first. `key` tells the layers apart in a ScanCache.
+    """
+    __slots__ = ('base', 'layers', 'key')
+
+    def __init__(self, base: _Scope, layers: tuple[tuple[_Layer, _Scope], ...], key: str):
+        self.base = base
+        self.layers = layers
+        self.key = key
+
+
+class RuleSet:
+    """
+    Compiled form of the (pattern, is_include) list returned by load_ignore_rules().
+    Built once, then answers should_ignore() questions without rescanning every rule.
+    Per directory it narrows to the rules that can still fire there (see prunes()).
+    Walks also pick up a `nested` ignore file in any directory they list, as a layer over these rules.
+    """
+    __slots__ = ('rules', 'nested', '_include', '_fold', '_entries', '_root', '_scopes', '_digest', '_layers')
+
+    def __init__(self, rules: "list[tuple[str, bool]] | RuleSet", nested: str | None = NESTED_IGNORE_FILE):
+        if isinstance(rules, RuleSet):
+            rules, nested = rules.rules, rules.nested
+        self.nested = nested
+        self.rules: tuple[tuple[str, bool], ...] = tuple((pattern, bool(is_include)) for pattern, is_include in rules)
+        self._include = tuple(is_include for _, is_include in self.rules)
+        # fnmatch.fnmatch() compares through os.path.normcase(), which folds case on Windows
+        self._fold = os.path.normcase("Aa") != "Aa"
+
+        self._entries: list[tuple[int, str, bool]] = []
+        for index, (pattern, _) in enumerate(self.rules):
+            if self._fold:
+                pattern = pattern.lower()
+            if pattern.endswith('/'):
+                # A directory is matched as "rel/dir/": strip the shared trailing slash on both sides
+                self._entries.append((index, pattern[:-1], True))
+            else:
+                # Paths of files never end with '/', so directory rules can never match them
+                self._entries.append((index, pattern, False))
+        self._root = self._build(tuple(range(len(self.rules))))
+        self._scopes: dict[tuple[int, ...], _Scope] = {}
+        self._digest = None
+        self._layers: dict[str, tuple[tuple[int, int, int], RuleSet | None]] = {}  # file -> (stat stamp, rules)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __repr__(self) -> str:
+        return f"RuleSet({len(self.rules)} rules)"
+
+    def __add__(self, other: list[tuple[str, bool]]) -> RuleSet:
+        """A RuleSet with `other` appended to the rules, like adding to the list it was built from."""
+        return RuleSet(list(self.rules) + list(other), self.nested)
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the rules; changes whenever .cp_ignore, the exclude groups or extra rules change."""
+        import hashlib
+        if self._digest is None:
+            self._digest = hashlib.sha256(repr((self._fold, self.rules, self.nested)).encode()).hexdigest()
+        return self._digest
+
+    def is_ignored(self, relpath: str, is_dir: bool = False) -> bool:
+        """Same answer as should_ignore() for a POSIX relative path without a trailing slash."""
+        if self._fold:
+            relpath = relpath.lower()
+        index = (self._root.dirs if is_dir else self._root.files).last_match(relpath)
+        return index >= 0 and not self._include[index]
+
+    def match(self, relpath: str, is_dir: bool = False) -> int:
+        """Index in self.rules of the rule deciding relpath (the last one matching), or -1 if none does."""
+        return self._match_index(self._root, relpath, is_dir)
+
+    def prunes(self, reldir: str) -> bool:
+        """
+        True when nothing below the directory `reldir` can pass the rules, so it need not be listed.
+        The directory itself is still judged by is_ignored(); pass "" for the root.
+        """
+        prefix = reldir.rstrip('/') + '/' if reldir else ""
+        _, files_ignored, dirs_ignored = self._view(prefix, self._scope(prefix))
+        return bool(files_ignored and dirs_ignored)
+
+    def _build(self, indices: tuple[int, ...]) -> _Scope:
+        kept = set(indices)
+        return _Scope([(index, pattern) for index, pattern, is_dir in self._entries if index in kept and not is_dir],
+                      [(index, pattern) for index, pattern, is_dir in self._entries if index in kept and is_dir])
+
+    def _scope(self, prefix: str, parent: _Scope | None = None) -> _Scope:
+        """Narrows `parent` (default: all rules) to the rules that can match a path starting with `prefix`."""
+        parent = parent or self._root
+        if not parent.anchored:
+            return parent
+        if self._fold:
+            prefix = prefix.lower()
+        dropped = {index for index, literal, exact in parent.anchored
+                   if not literal.startswith(prefix) and (exact or not prefix.startswith(literal))}
+        if not dropped:
+            return parent
+        kept = tuple(index for index in parent.indices if index not in dropped)
+        scope = self._scopes.get(kept)
+        if scope is None:
+            scope = self._scopes[kept] = self._build(kept)
+        return scope
+
+    def _enter(self, directory: str, prefix: str, parent: _Scope | _Layers | None = None) -> _Scope | _Layers:
+        """
+        _scope() of a directory about to be listed, with the nested ignore file found there pushed as a layer.
+        Subtrees without such files keep a plain _Scope and match exactly as before.
+        OSError when the nested file exists but cannot be read.
+        """
+        if isinstance(parent, _Layers):
+            base = self._scope(prefix, parent.base)
+            layers = tuple((layer, layer.rules._scope(prefix[len(layer.prefix):], scope))
+                           for layer, scope in parent.layers)
+            key = parent.key
+        else:
+            base, layers, key = self._scope(prefix, parent), (), ""
+        local = self._nested_rules(directory) if self.nested else None
+        if local is not None:
+            layers = ((_Layer(prefix, local, prefix + self.nested), local._root),) + layers
+            key = f"{key}{prefix}\0{local.digest[:16]}\0"
+        return _Layers(base, layers, key) if layers else base
+
+    def _nested_rules(self, directory: str) -> RuleSet | None:
+        """The compiled rules of the nested ignore file in directory, reparsed only when the file changes."""
+        path = os.path.join(directory, self.nested)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        known = self._layers.get(path)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        rules = RuleSet(load_ignore_rules(Path(path)), nested=None) or None  # no rules: nothing to layer
+        if time.time_ns() - st.st_mtime_ns >= _RACY_WINDOW_NS:
+            self._layers[path] = (stamp, rules)
+        return rules
+
+    def _view(self, prefix: str, scope: _Scope | _Layers) -> tuple[_Scope | _Layers, bool | None, bool | None]:
+        """
+        (scope, files, dirs) for the entries below `prefix`: files/dirs is the verdict shared by every
+        file/directory there, or None when each one has to be matched.
+        """
+        if self._fold:
+            prefix = prefix.lower()
+        if isinstance(scope, _Layers):
+            return scope, self._layered_verdict(scope, prefix, False)[0], self._layered_verdict(scope, prefix, True)[0]
+        return scope, self._verdict(scope.file_top, prefix), self._verdict(scope.dir_top, prefix)
+
+    def _verdicts(self, prefix: str, scope: _Scope | _Layers) -> tuple[bool | None, object, bool | None, object]:
+        """_view() verdicts of files and directories, each with the rule giving it (see _decide())."""
+        if self._fold:
+            prefix = prefix.lower()
+        if isinstance(scope, _Layers):
+            return (*self._layered_verdict(scope, prefix, False), *self._layered_verdict(scope, prefix, True))
+        file_index, dir_index = scope.file_top[0], scope.dir_top[0]
+        return (self._verdict(scope.file_top, prefix), file_index if file_index >= 0 else None,
+                self._verdict(scope.dir_top, prefix), dir_index if dir_index >= 0 else None)
+
+    def _layered_verdict(self, scope: _Layers, prefix: str, dirs: bool) -> tuple[bool | None, object]:
+        # The innermost layer that has a rule left here decides, or defers entry by entry (None)
+        for layer, layer_scope in scope.layers:
+            top = layer_scope.dir_top if dirs else layer_scope.file_top
+            if top[0] >= 0:
+                verdict = layer.rules._verdict(top, prefix[len(layer.prefix):])
+                return verdict, (layer.source, layer.rules, top[0]) if verdict is not None else None
+        top = scope.base.dir_top if dirs else scope.base.file_top
+        return self._verdict(top, prefix), top[0] if top[0] >= 0 else None
+
+    def _verdict(self, top: tuple[int, re.Pattern | None], prefix: str) -> bool | None:
+        index, universal = top
+        if index < 0:
+            return False  # no rule can fire: everything is kept
+        if universal is not None and universal.match(prefix):
+            # The last rule that can fire matches every path below prefix, so it decides them all
+            return not self._include[index]
+        return None
+
+    def _match(self, scope: _Scope, relpath: str, is_dir: bool) -> bool:
+        index = self._match_index(scope, relpath, is_dir)
+        return index >= 0 and not self._include[index]
+
+    def _layered_match(self, scope: _Layers, relpath: str, is_dir: bool) -> bool:
+        # Inner files come later in the rule order, so the first layer with a matching rule decides
+        for layer, layer_scope in scope.layers:
+            index = layer.rules._match_index(layer_scope, relpath[len(layer.prefix):], is_dir)
+            if index >= 0:
+                return not layer.rules._include[index]
+        return self._match(scope.base, relpath, is_dir)
+
+    def _ignored(self, scope: _Scope | _Layers, relpath: str, is_dir: bool) -> bool:
+        """is_ignored() for an entry of the directory `scope` came from (see _enter())."""
+        if isinstance(scope, _Layers):
+            return self._layered_match(scope, relpath, is_dir)
+        return self._match(scope, relpath, is_dir)
+
+    def _decide(self, scope: _Scope | _Layers, relpath: str, is_dir: bool) -> tuple[object, bool]:
+        """
+        (rule, ignored) for an entry: rule is the index in self.rules of the deciding rule, a
+        (source, RuleSet, index) triple for a rule of a nested ignore file, or None when no rule matches.
+        """
+        if isinstance(scope, _Layers):
+            for layer, layer_scope in scope.layers:
+                index = layer.rules._match_index(layer_scope, relpath[len(layer.prefix):], is_dir)
+                if index >= 0:
+                    return (layer.source, layer.rules, index), not layer.rules._include[index]
+            scope = scope.base
+        index = self._match_index(scope, relpath, is_dir)
+        return (index, not self._include[index]) if index >= 0 else (None, False)
+
+    def _match_index(self, scope: _Scope, relpath: str, is_dir: bool) -> int:
+        if self._fold:
+            relpath = relpath.lower()
+        return (scope.dirs if is_dir else scope.files).last_match(relpath)
+
+
+def should_ignore(file_path: Path, rules: list[tuple[str, bool]] | RuleSet, is_dir: bool = False) -> bool:
+    if isinstance(rules, RuleSet):
+        return rules.is_ignored(file_path.as_posix(), is_dir)
     # Convert to POSIX-like string to match patterns like **/release*/
     file_str = file_path.as_posix()
     if is_dir:
@@ -181,359 +678,4143 @@ def should_ignore(file_path: Path, rules: list[tuple[str, bool]], is_dir: bool =
     return False  # If no rules match, do not ignore the file
 
 
-def copytree_with_ignore(src: Path, target: Path, rules: list[tuple[str, bool]], create_subdir: bool = False) -> None:
-    src = Path(src).resolve()
-    target = Path(target).resolve()
-    if src.is_dir() and create_subdir:
-        target = target / src.name
+FILTER_READ_SIZE = 1 << 20  # bytes of stdin read at a time by `jh_cp filter`
 
-    if target.is_relative_to(src):
-        # If subdir, add the relative path to ignore_rules
-        relative_target_path = target.relative_to(src)
-        length = len(relative_target_path.parts)
 
-        for i in range(length):
-            subdir_path = Path(*relative_target_path.parts[:i + 1])
-            if not os.path.isdir(subdir_path):  # Check if the directory exists
-                rules.append((f"{subdir_path}/", False))  # Add the first non-existing directory to the rules
-                break
+class _Classifier:
+    """
+    classify() state: the scope and shared verdicts of every directory seen so far, so paths of the same
+    directory are only matched one by one when no rule decides the whole directory.
+    """
+    __slots__ = ('ruleset', 'dirs')
 
-    # Ensure the target directory exists if copying a directory
-    if not target.exists():
-        try:
-            os.makedirs(target)
-        except FileNotFoundError:
-            # This exception is raised if part of the path is a file instead of a directory
-            host.print(f"Some part of the Target Dir '{target}' is a File", True)
-            return  # Return or exit the function to avoid further operations
-        except PermissionError as e:
-            host.print(f"Permission Denied: {e.filename}", True)
-            return
-        except Exception as e:
-            host.print(f"Unexpected error: {str(e)}", True)
-            return
-    # === Handle the case where src is a file ===
-    if src.is_file():
-        # Ensure the target is a directory
-        if not target.is_dir():
-            raise ValueError(f"Target {target} must be a directory if copying a file.")
-        shutil.copy(src, target / src.name)
-        host.print(f"Copied file from {src} to {target / src.name}.")
-
-    # === Handle the case where src is a directory ===
-    # Ignore function
-    def ignore_func(_dir: str, files: list[str]) -> list[str]:
-        dir_path = Path(_dir)
-        rel_dir = dir_path.relative_to(src)
-
-        # If the directory itself should be ignored, return all files
-        if should_ignore(rel_dir, rules, is_dir=True):
-            return [file for file in files]
-
-        ignored = []
-        for file in files:
-            file_path = rel_dir / file
-            if (dir_path / file).is_dir():
-                if should_ignore(file_path, rules, is_dir=True):
-                    # Entire subdirectory is ignored: tell copytree to skip it completely
-                    ignored.append(file)
-            else:
-                if should_ignore(file_path, rules):
-                    ignored.append(file)
-        return ignored
+    def __init__(self, ruleset: RuleSet):
+        self.ruleset = ruleset
+        # "rel/dir/" -> _view() of it, or None when a walk never lists it (ignored, below one, or pruned)
+        self.dirs: dict[str, tuple[_Scope, bool | None, bool | None] | None] = {"": self._open("", None)}
 
-    try:
-        shutil.copytree(src, target, ignore=ignore_func, dirs_exist_ok=True)
-        host.print(f"Copied from {src} to {target}, skipping ignored files.")
-    except shutil.Error as e:
-        # Catch errors during copying
-        for _, dst_file, _ in e.args[0]:
-            host.print(f"Permission Denied: {dst_file}", True)
-    except PermissionError as e:
-        host.print(f"Permission Denied: {e.filename}", True)
-    except Exception as e:
-        host.print(f"Unexpected error: {str(e)}", True)
+    def _open(self, prefix: str, parent: _Scope | None) -> tuple[_Scope, bool | None, bool | None] | None:
+        scope, files_ignored, dirs_ignored = self.ruleset._view(prefix, self.ruleset._scope(prefix, parent))
+        return None if files_ignored and dirs_ignored else (scope, files_ignored, dirs_ignored)
 
+    def _directory(self, prefix: str) -> tuple[_Scope, bool | None, bool | None] | None:
+        dirs = self.dirs
+        if prefix in dirs:
+            return dirs[prefix]
+        # Walk up to the nearest directory already known, then back down
+        missing = [prefix]
+        head = prefix[:-1].rpartition('/')[0]
+        while (head + '/' if head else "") not in dirs:
+            missing.append(head + '/')
+            head = head.rpartition('/')[0]
+        view = dirs[head + '/' if head else ""]
+        for below in reversed(missing):
+            if view is not None:
+                scope, _, dirs_ignored = view
+                ignored = dirs_ignored
+                if ignored is None:
+                    ignored = self.ruleset._match(scope, below[:-1], True)
+                view = None if ignored else self._open(below, scope)
+            dirs[below] = view
+        return view
 
-def create_archive_with_ignore(src: Path, output: Path, rules: list[tuple[str, bool]]) -> None:
-    src = Path(src).resolve()
-    output = Path(output).resolve()
-
-    suffix = output.suffix.lower()
-    archive_format: str
-    if suffix == ".zip":
-        archive_format = "zip"
-    elif suffix == ".tar":
-        archive_format = "tar"
-    elif suffix in [".tgz", ".tar.gz"]:
-        archive_format = "tgz"
-    else:
-        host.print("Unsupported archive format. Use .zip, .tar, or .tar.gz/.tgz", True)
-        return
+    def ignored(self, relpath: str, is_dir: bool) -> bool:
+        head, sep, _ = relpath.rpartition('/')
+        view = self._directory(head + sep)
+        if view is None:
+            return True
+        scope, files_ignored, dirs_ignored = view
+        ignored = dirs_ignored if is_dir else files_ignored
+        return ignored if ignored is not None else self.ruleset._match(scope, relpath, is_dir)
 
-    if output.is_relative_to(src):
-        # If subdir, add the relative path to ignore_rules
-        relative_target_path = output.relative_to(src)
-        rules.append((str(relative_target_path), False))
 
-    # === Handle single file case (skip rules) ===
-    if src.is_file():
-        try:
-            arc_name = src.name
-            if archive_format == "zip":
-                with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_f:
-                    zip_f.write(src, arcname=arc_name)
-            else:
-                mode = 'w:gz' if archive_format == "tgz" else 'w'
-                with tarfile.open(output, mode) as tar_f:
-                    tar_f.add(src, arcname=arc_name)
-            host.print(f"Archived file {src} -> {output}")
-        except Exception as e:
-            host.print(f"Failed to archive file: {str(e)}", True)
-        return
+def _classify_path(path: str | os.PathLike) -> tuple[str, bool]:
+    """(relpath, is_dir) of a path given to classify(): POSIX separators, no './' or trailing slash."""
+    path = os.fspath(path)
+    if os.sep != '/':
+        path = path.replace(os.sep, '/')
+    while path.startswith('./'):
+        path = path[2:].lstrip('/')
+    is_dir = path.endswith('/')
+    path = path.rstrip('/')
+    return ("" if path == '.' else path), is_dir
 
-    # === Directory case with rules ===
-    if not src.is_dir():
-        host.print(f"Source {src} must be a directory or file.", True)
-        return
 
-    def archive_filter(filepath: Path) -> bool:
-        relpath = filepath.relative_to(src)
-        return not should_ignore(relpath, rules)
+def classify(paths: Iterable[str | os.PathLike], rules: list[tuple[str, bool]] | RuleSet) -> list[bool]:
+    ruleset = rules if isinstance(rules, RuleSet) else RuleSet(rules)
+    classifier = _Classifier(ruleset)
+    ignored = classifier.ignored
+    result = []
+    for path in paths:
+        relpath, is_dir = _classify_path(path)
+        result.append(ignored(relpath, is_dir) if relpath else False)
+    return result
 
-    try:
-        if archive_format == "zip":
-            with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_f:
-                for root, dirs, files in os.walk(src):
-                    root_path = Path(root)
-                    rel_root = root_path.relative_to(src)
-                    # pre-filter directories to ignore
-                    dirs[:] = [
-                        d for d in dirs
-                        if not should_ignore(rel_root / d, rules, is_dir=True)
-                    ]
-                    for file in files:
-                        full_path = Path(root) / file
-                        rel_path = full_path.relative_to(src)
-                        if archive_filter(full_path):
-                            zip_f.write(full_path, arcname=str(rel_path))
-            host.print(f"ZIP archive created at {output}")
-
-        elif archive_format in ["tar", "tgz"]:
-            mode = 'w:gz' if archive_format == "tgz" else 'w'
-            print(f"rules: {rules}")
-            with tarfile.open(output, mode) as tar_f:
-                for root, dirs, files in os.walk(src):
-                    root_path = Path(root)
-                    # pre-filter directories to ignore
-                    rel_root = root_path.relative_to(src)
-                    dirs[:] = [
-                        d for d in dirs
-                        if not should_ignore(rel_root / d, rules, is_dir=True)
-                    ]
-                    for file in files:
-                        full_path = Path(root) / file
-                        rel_path = full_path.relative_to(src)
-                        if archive_filter(full_path):
-                            tar_f.add(full_path, arcname=str(rel_path))
-                            print(full_path)
-            host.print(f"TAR archive created at {output}")
 
-    except Exception as e:
-        host.print(f"Failed to create archive: {str(e)}", True)
+def _filter_stream(source: BinaryIO, output: BinaryIO, ruleset: RuleSet, separator: bytes = b"\0",
+                   invert: bool = False) -> tuple[int, int]:
+    """
+    Copies the `separator`-terminated paths of source that classify() keeps (ignores, with invert) to output.
+    Paths are decoded with os.fsdecode(), so undecodable bytes survive; returns (read, written).
+    """
+    classifier = _Classifier(ruleset)
+    ignored = classifier.ignored
+    read = written = 0
+    rest = b""
+    while True:
+        data = source.read(FILTER_READ_SIZE)
+        if data:
+            data = rest + data
+            chunks = data.split(separator)
+            rest = chunks.pop()
+        else:
+            chunks = [rest] if rest else []
+        kept = []
+        for raw in chunks:
+            if not raw:
+                continue
+            read += 1
+            relpath, is_dir = _classify_path(os.fsdecode(raw))
+            if (ignored(relpath, is_dir) if relpath else False) == invert:
+                kept.append(raw)
+        if kept:
+            written += len(kept)
+            output.write(separator.join(kept) + separator)
+        if not data:
+            return read, written
 
 
-def handle_cp_ignore(args: argparse.Namespace) -> None:
-    """Handles the cp_ignore subcommand to manage the .cp_ignore file."""
-    cp_ignore_path = Path(os.path.dirname(os.path.abspath(__file__))) / CP_IGNORE_DEFAULT
+SYNC_MTIME_WINDOW = 2.0  # seconds; FAT and some network filesystems only keep 2 s timestamps
 
-    if args.register:
-        with open(cp_ignore_path, "a") as f:
-            for pattern in args.register:
-                f.write(f"!{pattern}\n")
-        host.print(f"Registered {[f'!{p}' for p in args.register]} in {cp_ignore_path}")
 
-    elif args.ignore:
-        with open(cp_ignore_path, "a") as f:
-            for pattern in args.ignore:
-                f.write(f"{pattern}\n")
-        host.print(f"Ignored {args.ignore} in {cp_ignore_path}")
+def _file_digest(path: str, algorithm: str = "sha256", chunk_size: int = 1 << 20) -> str:
+    import hashlib
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    elif args.export:
-        shutil.copy(cp_ignore_path, args.export)
-        host.print(f"Exported ignore rules to {args.export}")
 
-    elif args.reset:
-        with open(cp_ignore_path, "w") as f:
-            f.writelines(f"{rule}\n" for rule in DEFAULT_IGNORE_RULES)
-        host.print(f"Reset {cp_ignore_path} to default rules.")
+def _is_unchanged(src_file: str, dst_file: str, checksum: bool = False) -> bool:
+    """Whether dst_file already holds src_file: same size and mtime, or same content hash."""
+    try:
+        dst_stat = os.stat(dst_file)
+    except OSError:
+        return False
+    src_stat = os.stat(src_file)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if checksum:
+        return _file_digest(src_file) == _file_digest(dst_file)
+    return abs(src_stat.st_mtime - dst_stat.st_mtime) < SYNC_MTIME_WINDOW
 
-    elif args.nano:
-        # Check if Unix-like system (macOS, BSD, Linux, etc.)
-        if platform.system() in ['Darwin', 'FreeBSD', 'NetBSD', 'OpenBSD', 'Linux']:
-            os.system(f"nano {cp_ignore_path}")
-        else:
-            host.print(f"Nano might not be available on your system. "
-                       f"Please edit {cp_ignore_path} manually.")
+
+def _remove_path(path: str) -> None:
+    import shutil
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
     else:
-        host.print("No valid action specified for cp_ignore.")
+        os.unlink(path)
 
 
-def draw_tree_with_ignore(src: Path, rules: list[tuple[str, bool]], max_depth: int | None = None) -> None:
+def _prune_target(src: Path, target: Path, ruleset: RuleSet,
+                  keep_parts: bool = False) -> tuple[int, list[tuple[str, str, str]]]:
     """
-    Draws the directory tree structure while applying "ignore rules".
-    Matching logic identical to copytree_with_ignore().
+    Removes everything under target that is gone from src or ignored there (the --delete pass of a sync).
+    With keep_parts, the part files (see _part_path()) of files still in src are left for --resume.
+    Returns the number of removed entries and the (src, dst, reason) errors.
     """
-    src = Path(src).resolve()
-    if not src.exists():
-        host.print(f"Source {src} does not exist.", True)
-        return
-    if not src.is_dir():
-        host.print(f"Source {src} must be a directory.", True)
-        return
+    removed = 0
+    errors: list[tuple[str, str, str]] = []
+    parents: dict[str, _Scope | _Layers | None] = {"": None}  # scopes of the directories os.walk() goes into
+    for root, dirs, files in os.walk(target):
+        rel_root = os.path.relpath(root, target)
+        prefix = "" if rel_root == "." else rel_root.replace(os.sep, "/") + "/"
+        src_root = os.path.join(src, rel_root) if prefix else str(src)
+        try:
+            scope = ruleset._enter(src_root, prefix, parents.pop(prefix))
+        except OSError as why:  # an unreadable nested ignore file: the copy skipped this directory too
+            errors.append((src_root, root, str(why)))
+            dirs[:] = []
+            continue
 
-    def _draw(current: Path, prefix: str = "", depth: int = 0):
-        if max_depth is not None and depth > max_depth:
-            return
+        kept_dirs = []
+        for name in dirs:
+            src_path = os.path.join(src_root, name)
+            if not ruleset._ignored(scope, prefix + name, True) and os.path.isdir(src_path):
+                kept_dirs.append(name)
+                parents[f"{prefix}{name}/"] = scope
+                continue
+            try:
+                _remove_path(os.path.join(root, name))
+                removed += 1
+            except OSError as why:
+                errors.append((src_path, os.path.join(root, name), str(why)))
+        dirs[:] = kept_dirs
+
+        for name in files:
+            src_path = os.path.join(src_root, name)
+            if not ruleset._ignored(scope, prefix + name, False) and os.path.isfile(src_path):
+                continue
+            if keep_parts and name.startswith(".") and name.endswith(RESUME_PART_SUFFIX):
+                source = name[1:-len(RESUME_PART_SUFFIX)]
+                if not ruleset._ignored(scope, prefix + source, False) and os.path.isfile(
+                        os.path.join(src_root, source)):
+                    continue
+            try:
+                os.unlink(os.path.join(root, name))
+                removed += 1
+            except OSError as why:
+                errors.append((src_path, os.path.join(root, name), str(why)))
+    return removed, errors
 
+
+COPY_MODES = ("auto", "reflink", "kernel", "buffered")
+COPY_BUFFER_SIZE = 1 << 20  # userspace read/write size of the buffered backend
+_FICLONE = 0x40049409  # _IOW(0x94, 9, int): share the source's extents (btrfs, xfs, bcachefs, ...)
+# Errors meaning "this backend cannot copy between these files", as opposed to a failed copy
+_COPY_UNSUPPORTED = frozenset({errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.ENOTTY,
+                               errno.EINVAL, errno.ETXTBSY, errno.EBADF})
+_copy_unsupported: set[tuple[str, int, int]] = set()  # (backend, src st_dev, dst st_dev) known not to work
+
+
+class _Unsupported(Exception):
+    """The backend copied nothing and another one should be tried."""
+
+    def __init__(self, remember: bool = True):
+        super().__init__()
+        self.remember = remember
+
+
+def _copy_reflink(src_fd: int, dst_fd: int, size: int) -> None:
+    try:
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+    except OSError as why:
+        if why.errno in _COPY_UNSUPPORTED:
+            raise _Unsupported() from why
+        raise
+
+
+def _copy_kernel(src_fd: int, dst_fd: int, size: int, sendfile: bool = False) -> None:
+    # Data moves inside the kernel (copy_file_range() may itself share extents on NFS 4.2, btrfs, xfs)
+    chunk = min(max(size, 1 << 23), 1 << 30)
+    offset = 0
+    while True:
         try:
-            entries = sorted(current.iterdir(), key=lambda p: (not p.is_dir(), p.name.lower()))
-        except PermissionError:
-            host.print(f"Permission denied: {current}", True)
+            if sendfile:
+                copied = os.sendfile(dst_fd, src_fd, offset, chunk)
+            else:
+                copied = os.copy_file_range(src_fd, dst_fd, chunk)
+        except OSError as why:
+            if offset == 0 and why.errno in _COPY_UNSUPPORTED:
+                raise _Unsupported(why.errno != errno.EINVAL) from why
+            raise
+        if copied == 0:
+            if offset == 0 and size > 0:
+                raise _Unsupported(remember=False)  # e.g. /proc files, which report a size but copy nothing
             return
+        offset += copied
 
-        rel_dir = current.relative_to(src)
-        visible_entries = [
-            e for e in entries
-            if not should_ignore(rel_dir / e.name, rules, is_dir=e.is_dir())
-        ]
 
-        total = len(visible_entries)
-        for i, entry in enumerate(visible_entries):
-            is_last = (i == total - 1)
-            connector = "└── " if is_last else "├── "
+def _copy_buffered(src_fd: int, dst_fd: int, size: int) -> None:
+    while True:
+        view = memoryview(os.read(src_fd, COPY_BUFFER_SIZE))
+        if not view:
+            return
+        while view:
+            view = view[os.write(dst_fd, view):]
 
-            display_name = entry.name + "/" if entry.is_dir() else entry.name
-            host.print(f"{prefix}{connector}{display_name}")
 
-            if entry.is_dir():
-                new_prefix = prefix + ("    " if is_last else "│   ")
-                _draw(entry, new_prefix, depth + 1)
+_COPY_BACKENDS: dict[str, Callable[[int, int, int], None]] = {
+    "reflink": _copy_reflink,
+    "copy_file_range": _copy_kernel,
+    "sendfile": lambda src_fd, dst_fd, size: _copy_kernel(src_fd, dst_fd, size, sendfile=True),
+    "buffered": _copy_buffered,
+}
 
-    host.print(src.name + "/")
-    _draw(src)
 
+def _copy_backends(mode: str) -> tuple[str, ...] | None:
+    """Backends tried in order for a COPY_MODES entry; None where shutil's own fast path is the best choice."""
+    if mode == "buffered":
+        return ("buffered",)
+    if not sys.platform.startswith("linux"):
+        # macOS (fcopyfile) and Windows already get the platform's copy from shutil; no FICLONE there
+        return None if mode != "reflink" else ()
+    chain = ("reflink",) if mode in ("auto", "reflink") and fcntl is not None else ()
+    if mode != "reflink":
+        chain += tuple(name for name, available in (("copy_file_range", hasattr(os, "copy_file_range")),
+                                                    ("sendfile", hasattr(os, "sendfile"))) if available)
+        chain += ("buffered",)
+    return chain
 
-def load_exclude_rules() -> dict[str, list[str]]:
-    """Load exclusion rules from the INI File"""
-    exclude_rules = {}
-    rules_path = Path(os.path.dirname(os.path.abspath(__file__))) / EXCLUDE_RULES_INI
-    config = configparser.ConfigParser()
 
-    if os.path.exists(rules_path):
-        config.read(rules_path)
+def _copyfile(src_file: str, dst_file: str, mode: str = "auto") -> tuple[str, int]:
+    """
+    shutil.copyfile() with the data path picked by `mode` (see COPY_MODES).
+    Returns (backend, size); raises OSError when no allowed backend can copy the file.
+    """
+    import shutil
+    backends = _copy_backends(mode)
+    if backends is None:
+        shutil.copyfile(src_file, dst_file)
+        return "shutil", os.path.getsize(dst_file)
+    if stat.S_ISFIFO(os.stat(src_file).st_mode):
+        raise shutil.SpecialFileError(f"`{src_file}` is a named pipe")
+    with open(src_file, "rb") as fsrc:
+        src_st = os.fstat(fsrc.fileno())
+        try:
+            if os.path.samestat(src_st, os.stat(dst_file)):
+                raise shutil.SameFileError(f"{src_file!r} and {dst_file!r} are the same file")
+        except FileNotFoundError:
+            pass
+        with open(dst_file, "wb") as fdst:
+            dst_dev = os.fstat(fdst.fileno()).st_dev
+            for backend in backends:
+                key = (backend, src_st.st_dev, dst_dev)
+                if key in _copy_unsupported:
+                    continue
+                try:
+                    _COPY_BACKENDS[backend](fsrc.fileno(), fdst.fileno(), src_st.st_size)
+                    return backend, src_st.st_size
+                except _Unsupported as unsupported:
+                    if unsupported.remember:
+                        _copy_unsupported.add(key)
+    os.unlink(dst_file)
+    raise OSError(errno.EOPNOTSUPP, f"Copy mode '{mode}' is not supported between these files", dst_file)
 
-        # Get exclude-zip, exclude-log, and exclude-db rules
-        for section in ['exclude-zip', 'exclude-log', 'exclude-db']:
-            if config.has_section(section):
-                patterns = config.get(section, 'patterns', fallback='').split(',')
-                exclude_rules[section] = [pattern.strip() for pattern in patterns if pattern.strip()]
 
-    return exclude_rules
+FANOUT_CONCURRENT_MIN = COPY_BUFFER_SIZE  # smaller files are written to the destinations one after another
 
 
-def jh_cp_main(argv: list[bytes] = None) -> None:
-    """Main function to execute the jh_cp command."""
-    parser = argparse.ArgumentParser(description="jh_cp script with ignore functionality")
-    subparsers = parser.add_subparsers(dest="command")
-    if argv is None:
-        argv = sys.argv[1:]
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
 
-    # jh_cp command for file copying
-    cp_parser = subparsers.add_parser("cp", help="Copy files or directories with ignore rules")
-    cp_parser.add_argument("src", type=str, help="Source path [Directory / File]")
-    cp_parser.add_argument("target", type=str, help="Target path [Directory]")
-    cp_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
-    cp_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
-    cp_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
-    cp_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
-    cp_parser.add_argument("--create-subdir", action='store_true',
-                           help="Create a subdirectory with the same name as the source")
 
-    # archive command for creating compressed archives
-    archive_parser = subparsers.add_parser("archive", help="Create an archive with ignore rules")
-    archive_parser.add_argument("src", type=str, help="Source directory to archive")
-    archive_parser.add_argument("output", type=str, help="Output archive file path (with .zip/.tar/.tar.gz)")
-    archive_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
-    archive_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
-    archive_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
-    archive_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+def _copyfile_many(src_file: str, dst_files: list[str], mode: str = "auto",
+                   writers: ThreadPoolExecutor | None = None, hasher=None) -> list[tuple[str, int] | OSError]:
+    """
+    _copyfile() to several destinations, reading src_file once: destinations that cannot be reflinked
+    all receive the same read buffers ("fanout"), written concurrently on `writers` for large files.
+    A hashlib `hasher` is fed the same buffers, so even a single destination then goes through this read.
+    Returns (backend, size) or the OSError of each destination, in order.
+    """
+    import shutil
+    if len(dst_files) == 1 and hasher is None:
+        try:
+            return [_copyfile(src_file, dst_files[0], mode)]
+        except OSError as why:
+            return [why]
+    backends = _copy_backends(mode)
+    if backends is not None and "buffered" not in backends:
+        # --copy-mode reflink: clones only, which never read the data anyway
+        if hasher is not None:
+            with open(src_file, "rb") as f:
+                while chunk := f.read(COPY_BUFFER_SIZE):
+                    hasher.update(chunk)
+        return _copyfile_many_each(src_file, dst_files, mode)
+    results: list[tuple[str, int] | OSError | None] = [None] * len(dst_files)
+    if stat.S_ISFIFO(os.stat(src_file).st_mode):
+        raise shutil.SpecialFileError(f"`{src_file}` is a named pipe")
+    outputs: list[tuple[int, BinaryIO]] = []
+    with open(src_file, "rb") as fsrc:
+        src_fd = fsrc.fileno()
+        src_st = os.fstat(src_fd)
+        try:
+            for index, dst_file in enumerate(dst_files):
+                try:
+                    if os.path.samestat(src_st, os.stat(dst_file)):
+                        results[index] = shutil.SameFileError(f"{src_file!r} and {dst_file!r} are the same file")
+                        continue
+                except OSError:
+                    pass  # missing, or unusable: open() reports it for this destination alone
+                try:
+                    fdst = open(dst_file, "wb")
+                except OSError as why:
+                    results[index] = why
+                    continue
+                key = ("reflink", src_st.st_dev, os.fstat(fdst.fileno()).st_dev)
+                if backends and "reflink" in backends and key not in _copy_unsupported:
+                    try:
+                        _copy_reflink(src_fd, fdst.fileno(), src_st.st_size)
+                        results[index] = ("reflink", src_st.st_size)
+                        fdst.close()
+                        continue
+                    except _Unsupported as unsupported:
+                        if unsupported.remember:
+                            _copy_unsupported.add(key)
+                    except OSError as why:
+                        results[index] = why
+                        fdst.close()
+                        continue
+                outputs.append((index, fdst))
 
-    # cp_ignore subcommand for managing .cp_ignore
-    cp_ignore_parser = subparsers.add_parser("cp_ignore", help="Manage .cp_ignore rules")
-    cp_ignore_parser.add_argument("-register", nargs="+", help="Register pattern(s) to include")
-    cp_ignore_parser.add_argument("-ignore", nargs="+", help="Ignore pattern(s)")
-    cp_ignore_parser.add_argument("-export", type=str, help="Export current ignore rules to file")
-    cp_ignore_parser.add_argument("-reset", action='store_true', help="Reset to default ignore rules")
-    cp_ignore_parser.add_argument("-nano", action='store_true', help="Open .cp_ignore with nano editor")
+            pool = writers if writers is not None and src_st.st_size >= FANOUT_CONCURRENT_MIN else None
+            size = 0
+            data = os.read(src_fd, COPY_BUFFER_SIZE)
+            # Reflinked destinations need no data, but the digest does
+            while data and (outputs or hasher is not None):
+                if pool is not None:
+                    futures = [pool.submit(_write_all, fdst.fileno(), data) for _, fdst in outputs]
+                    try:
+                        if hasher is not None:
+                            hasher.update(data)  # hashlib releases the GIL: overlaps with the writes too
+                        next_data = os.read(src_fd, COPY_BUFFER_SIZE)  # overlaps with the writes
+                    finally:
+                        failures = [future.exception() for future in futures]
+                else:
+                    if hasher is not None:
+                        hasher.update(data)
+                    failures = []
+                    for _, fdst in outputs:
+                        try:
+                            _write_all(fdst.fileno(), data)
+                            failures.append(None)
+                        except OSError as why:
+                            failures.append(why)
+                    next_data = os.read(src_fd, COPY_BUFFER_SIZE)
+                size += len(data)
+                data = next_data
+                for (index, fdst), failure in zip(outputs, failures):
+                    if failure is not None:
+                        results[index] = failure
+                        with contextlib.suppress(OSError):
+                            fdst.close()
+                            os.unlink(dst_files[index])
+                outputs = [(index, fdst) for index, fdst in outputs if results[index] is None]
+        finally:
+            for index, fdst in outputs:
+                try:
+                    fdst.close()  # network filesystems report failed writes here
+                except OSError as why:
+                    results[index] = why
+                    continue
+                if results[index] is None:
+                    results[index] = ("fanout" if len(dst_files) > 1 else "buffered", size)
+    return results
 
-    # tree command for displaying directory structure
-    tree_parser = subparsers.add_parser("tree", help="Display directory structure with ignore rules")
-    tree_parser.add_argument("src", type=str, help="Source directory to visualize")
-    tree_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
-    tree_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
-    tree_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
-    tree_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
-    tree_parser.add_argument("--max-depth", type=int, default=None, help="Optional maximum depth to traverse")
 
-    args = parser.parse_args(argv)
+def _copyfile_many_each(src_file: str, dst_files: list[str], mode: str) -> list[tuple[str, int] | OSError]:
+    results: list[tuple[str, int] | OSError] = []
+    for dst_file in dst_files:
+        try:
+            results.append(_copyfile(src_file, dst_file, mode))
+        except OSError as why:
+            results.append(why)
+    return results
 
-    if args.command == "cp" or args.command == "archive":
-        if args.command == "cp":
-            if os.path.isfile(args.target):
-                host.print(f"FileExistsError: {args.target} is a File instead of a Directory", True)
-                return
-        elif args.command == "archive":
-            if not args.output.endswith(('.zip', '.tar', '.tar.gz', '.tgz')):
-                host.print("Output must end with .zip, .tar, or .tar.gz/.tgz", True)
-                return
-        exclude_rules = load_exclude_rules()
-        additional_rules = []
-
-        if args.exclude_zip:
-            additional_rules.extend(exclude_rules.get('exclude-zip', []))
-        if args.exclude_log:
-            additional_rules.extend(exclude_rules.get('exclude-log', []))
-        if args.exclude_db:
-            additional_rules.extend(exclude_rules.get('exclude-db', []))
-        ignore_path = Path(args.ignore) if args.ignore else Path(
-            os.path.dirname(os.path.abspath(__file__))) / CP_IGNORE_DEFAULT
-        rules = load_ignore_rules(ignore_path, additional_rules)
-        if args.command == "cp":
-            rules.append((str(Path(args.target).resolve()) + '/', False))
-            copytree_with_ignore(args.src, args.target, rules, args.create_subdir)
-        elif args.command == "archive":
-            rules.append((str(Path(args.output).resolve()), False))  # Ensure the output archive is ignored
-            create_archive_with_ignore(args.src, args.output, rules)
-    elif args.command == "cp_ignore":
-        handle_cp_ignore(args)
 
-    elif args.command == "tree":
-        src_path = Path(args.src).resolve()
-        exclude_rules = load_exclude_rules()
-        additional_rules = []
-        if args.exclude_zip:
-            additional_rules.extend(exclude_rules.get('exclude-zip', []))
-        if args.exclude_log:
-            additional_rules.extend(exclude_rules.get('exclude-log', []))
-        if args.exclude_db:
-            additional_rules.extend(exclude_rules.get('exclude-db', []))
-
-        ignore_path = Path(args.ignore) if args.ignore else Path(
-            os.path.dirname(os.path.abspath(__file__))) / CP_IGNORE_DEFAULT
-        rules = load_ignore_rules(ignore_path, additional_rules)
-
-        draw_tree_with_ignore(src_path, rules, args.max_depth)
+def _copy_files(src_file: str, dst_files: list[str], copy_function) -> list[tuple[str, str, str]]:
+    """copy_function(src_file, dst_files) -> per-destination errors; a failure of the source fails them all."""
+    try:
+        return copy_function(src_file, dst_files)
+    except OSError as why:
+        return [(src_file, dst_file, str(why)) for dst_file in dst_files]
+
+
+DEDUPE_MIN_SIZE = 1  # empty files share no data; linking them together would only couple unrelated files
+
+
+class _Primary:
+    """
+    The first copy of some content; duplicates hardlink to its path once `done` is set and `ok`.
+    For a copy to several targets, `path` lists the copy in each of them.
+    """
+    __slots__ = ('path', 'done', 'ok', 'digest')
+
+    def __init__(self, path: str | list[str]):
+        self.path = path
+        self.done = threading.Event()
+        self.ok = False
+        self.digest: str | None = None  # --verify / --manifest: digest taken while writing it
+
+    def finish(self, ok: bool) -> None:
+        self.ok = ok
+        self.done.set()
+
+
+class _LinkTable:
+    """
+    Maps each copied file to the first one written with the same inode (an existing hardlink) or,
+    with dedupe, the same content: sizes are compared first, and only files sharing a size are hashed.
+    Safe to share between the --jobs workers.
+    """
+
+    def __init__(self, inodes: bool = True, dedupe: bool = False):
+        self.inodes = inodes
+        self.dedupe = dedupe
+        self._lock = threading.Lock()
+        self._primaries: dict[tuple, _Primary] = {}
+        # size -> (src, primary) of the only file seen with that size, not hashed yet; None once hashed
+        self._sizes: dict[int, tuple[str, _Primary] | None] = {}
+
+    def claim(self, src_file: str, path: str | list[str], st: os.stat_result) -> tuple[_Primary, bool]:
+        """
+        (primary, True) when `path` is the first copy of its content: the caller writes it, then calls
+        primary.finish(). Otherwise (primary, False): wait for primary.done and hardlink to primary.path.
+        """
+        keys = []
+        if self.inodes and st.st_nlink > 1:
+            keys.append(("inode", st.st_dev, st.st_ino))
+        first_of_size = False
+        if self.dedupe and st.st_size >= DEDUPE_MIN_SIZE:
+            with self._lock:
+                first_of_size = st.st_size not in self._sizes
+                first = self._sizes.get(st.st_size)
+                self._sizes[st.st_size] = None
+            if not first_of_size:
+                if first is not None:
+                    # The first file of this size was not worth hashing until now
+                    try:
+                        first_key = ("content", st.st_size, _file_digest(first[0]))
+                    except OSError:
+                        pass  # gone or unreadable since: it just cannot be a link target
+                    else:
+                        with self._lock:
+                            self._primaries.setdefault(first_key, first[1])
+                keys.append(("content", st.st_size, _file_digest(src_file)))
+
+        with self._lock:
+            primary = next((self._primaries[key] for key in keys if key in self._primaries), None)
+            is_new = primary is None
+            if is_new:
+                primary = _Primary(path)
+            for key in keys:
+                self._primaries.setdefault(key, primary)
+            if first_of_size and self._sizes.get(st.st_size, ()) is None:
+                self._sizes[st.st_size] = (src_file, primary)
+        return primary, is_new
+
+
+def _hardlink(existing: str, dst_file: str) -> str | None:
+    """Makes dst_file a hardlink of existing: 'linked', 'unchanged' (already is), or None if impossible."""
+    try:
+        if os.path.lexists(dst_file):
+            if os.path.samefile(existing, dst_file):
+                return "unchanged"
+            os.unlink(dst_file)
+        os.link(existing, dst_file)
+        return "linked"
+    except OSError:
+        return None  # no hardlinks on this filesystem (FAT, some network shares) or too many links
+
+
+SCAN_CACHE_VERSION = 3
+SCAN_CACHE_MAX_AGE = 30 * 24 * 3600  # seconds before an unused cache file is removed
+_RACY_WINDOW_NS = 2_000_000_000  # directories modified this recently may still change within the same mtime tick
+
+
+def _cache_dir() -> Path:
+    if os.environ.get("JH_CP_CACHE_DIR"):
+        return Path(os.environ["JH_CP_CACHE_DIR"])
+    if os.name == 'nt':
+        return Path(os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local") / "jh_cp" / "Cache"
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "jh_cp"
+
+
+class _CachedEntry:
+    """Stands in for an os.DirEntry replayed from a ScanCache."""
+    __slots__ = ('name', 'path', '_is_dir', '_is_symlink')
+
+    def __init__(self, directory: str, name: str, flags: int):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._is_dir = bool(flags & 1)
+        self._is_symlink = bool(flags & 2)
+
+    def is_dir(self, *, follow_symlinks: bool = True) -> bool:
+        return self._is_dir and (follow_symlinks or not self._is_symlink)
+
+    def is_file(self, *, follow_symlinks: bool = True) -> bool:
+        return not self._is_dir and (follow_symlinks or not self._is_symlink)
+
+    def is_symlink(self) -> bool:
+        return self._is_symlink
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        return os.stat(self.path, follow_symlinks=follow_symlinks)
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def __repr__(self) -> str:
+        return f"<_CachedEntry '{self.name}'>"
+
+
+class ScanCache:
+    """
+    On-disk record of every scanned directory's mtime and kept entries, for one source root and RuleSet.
+    A directory whose mtime is unchanged is replayed without listing or matching it again.
+    """
+
+    def __init__(self, src: Path | str, ruleset: RuleSet, cache_dir: Path | str | None = None):
+        import hashlib
+        self.root = os.path.abspath(src)
+        self.digest = ruleset.digest
+        key = hashlib.sha256(f"{self.root}\0{self.digest}".encode()).hexdigest()[:32]
+        self.path = Path(cache_dir or _cache_dir()) / f"scan-{key}.json"
+        # "rel/dir/" -> [mtime_ns, [[name, flags], ...], excluded count, _Layers.key of its nested ignore files]
+        self.records: dict[str, list] = {}
+        self.files: int | None = None  # files yielded by the last complete walk, for progress ETAs
+        self.dirty = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if (data.get("version"), data.get("root"), data.get("rules")) == (
+                    SCAN_CACHE_VERSION, self.root, self.digest):
+                self.records = data["dirs"]
+                self.files = data.get("files")
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # Missing or unreadable: start empty
+
+    def lookup(self, prefix: str, mtime_ns: int, layers: str = "") -> tuple[list, int] | None:
+        """
+        (kept entries, number of excluded entries) recorded for the directory, if its mtime is unchanged
+        and the same nested ignore files (`layers`, see _Layers.key) applied to it.
+        """
+        record = self.records.get(prefix)
+        if record is not None and record[0] == mtime_ns and record[3] == layers:
+            return record[1], record[2]
+        return None
+
+    def store(self, prefix: str, mtime_ns: int, entries: list, skipped: int = 0, layers: str = "") -> None:
+        self.dirty = True
+        if time.time_ns() - mtime_ns < _RACY_WINDOW_NS:
+            self.records.pop(prefix, None)
+        else:
+            self.records[prefix] = [mtime_ns, entries, skipped, layers]
+
+    def set_files(self, count: int) -> None:
+        if count != self.files:
+            self.files = count
+            self.dirty = True
+
+    def save(self) -> None:
+        """Writes the cache atomically, dropping records no longer reachable from the root. Best effort."""
+        if not self.dirty:
+            return
+        reachable, stack = {}, [""]
+        while stack:
+            prefix = stack.pop()
+            record = self.records.get(prefix)
+            if record is not None:
+                reachable[prefix] = record
+                stack.extend(f"{prefix}{name}/" for name, flags in record[1] if flags & 1)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": SCAN_CACHE_VERSION, "root": self.root, "rules": self.digest,
+                           "files": self.files, "dirs": reachable}, f, separators=(",", ":"))
+            os.replace(temp_path, self.path)
+            self.dirty = False
+            # Caches of old rule sets (an edited .cp_ignore) are never hit again; expire them
+            expiry = time.time() - SCAN_CACHE_MAX_AGE
+            for stale in self.path.parent.glob("scan-*.json"):
+                if stale.stat().st_mtime < expiry:
+                    stale.unlink()
+        except OSError:
+            pass
+
+
+def _scan_dir(directory: str, prefix: str, ruleset: RuleSet, cache: ScanCache | None = None,
+              scope: _Scope | _Layers | None = None, on_rule: Callable[[str, str, object], None] | None = None,
+              on_skip: Callable[[int], None] | None = None) -> Iterator[tuple[str, os.DirEntry, bool]]:
+    """
+    Kept entries of one directory as (relpath, entry, is_dir), in listing order.
+    The type comes from the DirEntry (no extra stat on most filesystems); OSError propagates.
+    `scope` is ruleset._enter(directory, prefix, ...): a directory whose rules exclude everything below it
+    is not listed at all, and entries are only matched against the rules that can still fire there.
+    With a cache, an unchanged directory (same mtime, same nested ignore files) is replayed instead of
+    listed and matched.
+    `on_rule(relpath, kind, rule)` sees every decision a rule made, kept or not ('file', 'dir', or
+    'pruned' for this directory; rule as in RuleSet._decide()); it needs the listing, so the cache is bypassed.
+    `on_skip(count)` is told how many entries the rules excluded, once the directory is done.
+    """
+    scope = scope or ruleset._enter(directory, prefix)
+    skipped = 0
+    if on_rule is not None:
+        files_ignored, file_rule, dirs_ignored, dir_rule = ruleset._verdicts(prefix, scope)
+        if files_ignored and dirs_ignored:
+            for rule in dict.fromkeys((file_rule, dir_rule)):
+                on_rule(prefix.rstrip("/"), "pruned", rule)
+            return
+        with os.scandir(directory) as it:
+            for entry in it:
+                relpath = prefix + entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                verdict, rule = (dirs_ignored, dir_rule) if is_dir else (files_ignored, file_rule)
+                if verdict is None:
+                    rule, verdict = ruleset._decide(scope, relpath, is_dir)
+                if rule is not None:
+                    on_rule(relpath, "dir" if is_dir else "file", rule)
+                if verdict:
+                    skipped += 1
+                else:
+                    yield relpath, entry, is_dir
+        if on_skip is not None:
+            on_skip(skipped)
+        return
+
+    _, files_ignored, dirs_ignored = ruleset._view(prefix, scope)
+    if files_ignored and dirs_ignored:
+        return
+    layers = ""
+    match = ruleset._match
+    if isinstance(scope, _Layers):
+        layers, match = scope.key, ruleset._layered_match
+    kept: list[list] = []
+    mtime_ns = None
+    if cache is not None:
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            pass  # os.scandir() below reports it
+        cached = cache.lookup(prefix, mtime_ns, layers)
+        if cached is not None:
+            for name, flags in cached[0]:
+                yield prefix + name, _CachedEntry(directory, name, flags), bool(flags & 1)
+            if on_skip is not None:
+                on_skip(cached[1])
+            return
+
+    with os.scandir(directory) as it:
+        for entry in it:
+            relpath = prefix + entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            ignored = dirs_ignored if is_dir else files_ignored
+            if ignored is None:
+                ignored = match(scope, relpath, is_dir)
+            if ignored:
+                skipped += 1
+                continue
+            if cache is not None:
+                kept.append([entry.name, is_dir | entry.is_symlink() << 1])
+            yield relpath, entry, is_dir
+    if cache is not None and mtime_ns is not None:
+        cache.store(prefix, mtime_ns, kept, skipped, layers)
+    if on_skip is not None:
+        on_skip(skipped)
+
+
+def walk_with_ignore(src: Path | str, rules: list[tuple[str, bool]] | RuleSet, follow_symlinks: bool = True,
+                     onerror: Callable[[OSError], None] | None = None,
+                     cache: ScanCache | None = None, on_rule: Callable[[str, str, int], None] | None = None,
+                     on_skip: Callable[[int], None] | None = None) -> Iterator[tuple[str, os.DirEntry]]:
+    """
+    Walks src with os.scandir() and yields (relpath, entry) for every entry that passes the rules.
+    A directory is yielded before its contents; ignored directories, and directories whose contents
+    are all excluded (RuleSet.prunes()), are never listed.
+    on_rule(relpath, kind, rule_index) is told about every entry a rule decided (see _scan_dir()),
+    and on_skip(count) about the number of entries the rules excluded in each listed directory.
+    """
+    ruleset = rules if isinstance(rules, RuleSet) else RuleSet(rules)
+    stack = [(os.fspath(src), "", None)]
+    files = 0
+    try:
+        while stack:
+            directory, prefix, parent = stack.pop()
+            subdirs = []
+            try:
+                scope = ruleset._enter(directory, prefix, parent)
+                for relpath, entry, is_dir in _scan_dir(directory, prefix, ruleset, cache, scope, on_rule, on_skip):
+                    yield relpath, entry
+                    if not is_dir:
+                        files += 1
+                    elif follow_symlinks or not entry.is_symlink():
+                        subdirs.append((entry.path, relpath + "/", scope))
+            except OSError as error:
+                if onerror is not None:
+                    onerror(error)
+            stack.extend(reversed(subdirs))
+        if cache is not None:
+            cache.set_files(files)
+    finally:
+        if cache is not None:
+            cache.save()
+
+
+RESUME_VERSION = 1
+RESUME_PART_SUFFIX = ".jh_cp-part"  # ".name.jh_cp-part": a file or archive being written, renamed when complete
+RESUME_FLUSH_INTERVAL = 1.0  # seconds between two journal writes: at most this much finished work is redone
+RESUME_PARTIAL_MIN = 64 << 20  # bytes; files this large continue where an interrupted copy stopped
+
+
+def _part_path(path: str) -> str:
+    head, tail = os.path.split(path)
+    return os.path.join(head, f".{tail}{RESUME_PART_SUFFIX}")
+
+
+class _Journal:
+    """
+    The work a --resume run has finished, as JSON lines in resume-<key>.jsonl next to the scan caches.
+    The key covers the command, the source, the targets and the rules: only the same run picks it up again.
+    Records are buffered and written every RESUME_FLUSH_INTERVAL seconds, after before_flush() (e.g. an
+    fsync of the archive they describe); the torn last line of a killed run is ignored.
+    """
+
+    def __init__(self, kind: str, src: Path | str, targets: list[str], digest: str):
+        import hashlib
+        self.header = {"version": RESUME_VERSION, "kind": kind, "src": str(src), "targets": targets, "rules": digest}
+        key = hashlib.sha256(json.dumps(self.header).encode()).hexdigest()[:32]
+        self.path = _cache_dir() / f"resume-{key}.jsonl"
+        self.before_flush: Callable[[], None] | None = None
+        self._f = None
+        self._pending: list[str] = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def load(self) -> list[dict]:
+        """The records of an interrupted run with the same header; [] if there is none."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                if json.loads(f.readline()) != self.header:
+                    return []
+                records = []
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break  # cut off by the interruption
+                return records
+        except (OSError, ValueError):
+            return []
+
+    def start(self, records: list[dict]) -> None:
+        """Rewrites the journal with the records still valid, then keeps it open for add()."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for record in [self.header, *records]:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        os.replace(temp_path, self.path)
+        self._f = open(self.path, "a", encoding="utf-8")
+        # Journals of runs that were never resumed
+        expiry = time.time() - SCAN_CACHE_MAX_AGE
+        for stale in self.path.parent.glob("resume-*.jsonl"):
+            with contextlib.suppress(OSError):
+                if stale.stat().st_mtime < expiry:
+                    stale.unlink()
+
+    def add(self, record: dict, flush: bool = False) -> None:
+        """Appends a record; thread-safe. `flush` writes it (and the ones pending) at once."""
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._pending.append(line)
+            if flush or time.monotonic() - self._flushed_at >= RESUME_FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            if self.before_flush is not None:
+                self.before_flush()
+            self._f.write("".join(self._pending))
+            self._f.flush()
+            self._pending = []
+        self._flushed_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Writes the pending records while the file before_flush() syncs is still open, then forgets before_flush();
+        called as that file is closed, whether the run finished or not.
+        """
+        with self._lock:
+            try:
+                if self._f is not None:
+                    self._flush()
+            except OSError:
+                self._pending = []  # the sync failed: these records cannot be vouched for
+            finally:
+                self.before_flush = None
+
+    def close(self, finished: bool) -> None:
+        """Writes the pending records of an interrupted run; a finished run needs no journal and removes it."""
+        with self._lock:
+            if self._f is None:
+                return
+            try:
+                if not finished:
+                    self._flush()
+            except OSError:
+                pass  # e.g. the drive of the archive is gone: what is pending cannot be vouched for
+            finally:
+                self._f.close()
+                self._f = None
+            if finished:
+                with contextlib.suppress(OSError):
+                    self.path.unlink()
+
+
+def _resume_offset(src_file: str, part_file: str) -> int:
+    """
+    Bytes of an interrupted copy in part_file that can be kept: whole COPY_BUFFER_SIZE blocks, the last of
+    which must still equal the source's (a crash can leave a file longer than the data that reached it).
+    """
+    try:
+        size = os.path.getsize(part_file)
+    except OSError:
+        return 0
+    offset = size - size % COPY_BUFFER_SIZE
+    if not offset:
+        return 0
+    with open(src_file, "rb") as fsrc, open(part_file, "rb") as fpart:
+        fsrc.seek(offset - COPY_BUFFER_SIZE)
+        fpart.seek(offset - COPY_BUFFER_SIZE)
+        if fsrc.read(COPY_BUFFER_SIZE) != fpart.read(COPY_BUFFER_SIZE):
+            return 0
+    return offset
+
+
+def _continue_copy(src_file: str, part_file: str) -> tuple[str, int] | None:
+    """Completes the part_file of an interrupted copy from _resume_offset(): (backend, size), or None to start over."""
+    offset = _resume_offset(src_file, part_file)
+    if not offset:
+        return None
+    with open(src_file, "rb", buffering=0) as fsrc, open(part_file, "r+b", buffering=0) as fpart:
+        size = os.fstat(fsrc.fileno()).st_size
+        fpart.truncate(offset)
+        fsrc.seek(offset)
+        fpart.seek(offset)
+        _copy_buffered(fsrc.fileno(), fpart.fileno(), size - offset)
+    return "resumed", size
+
+
+def _copytree_walk(src: Path, targets: list[Path], ruleset: RuleSet, jobs: int = 1, copy_function=None,
+                   cache: ScanCache | None = None,
+                   on_skip: Callable[[int], None] | None = None) -> list[tuple[str, str, str]]:
+    """
+    Copies the filtered tree of src into every target, creating each directory before its files are copied.
+    The tree is walked once; copy_function(src_file, dst_files) writes a file to all targets and returns
+    the per-destination errors. With jobs > 1 the files go through a bounded pool of `jobs` threads.
+    Returns the (src, dst, reason) errors like shutil.Error.
+    """
+    import shutil
+    errors: list[tuple[str, str, str]] = []
+    dir_pairs: list[tuple[str, str]] = [(str(src), str(target)) for target in targets]
+
+    def onerror(error: OSError) -> None:
+        relpath = os.path.relpath(error.filename, src)
+        errors.extend((error.filename, os.path.join(target, relpath), str(error)) for target in targets)
+
+    pool = None
+    if jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        pool = ThreadPoolExecutor(max_workers=jobs)
+    pending = set()
+    try:
+        for relpath, entry in walk_with_ignore(src, ruleset, onerror=onerror, cache=cache, on_skip=on_skip):
+            dst_paths = [os.path.join(target, relpath) for target in targets]
+            if entry.is_dir():
+                for dst_path in dst_paths:
+                    try:
+                        os.makedirs(dst_path, exist_ok=True)
+                        dir_pairs.append((entry.path, dst_path))
+                    except OSError as why:
+                        errors.append((entry.path, dst_path, str(why)))
+            elif pool is None:
+                errors.extend(_copy_files(entry.path, dst_paths, copy_function))
+            else:
+                # Bounded number of in-flight copies keeps memory flat on trees with millions of files
+                if len(pending) >= jobs * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        errors.extend(future.result())
+                pending.add(pool.submit(_copy_files, entry.path, dst_paths, copy_function))
+        for future in pending:
+            errors.extend(future.result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)  # only queued copies are left when the walk was aborted
+
+    # Directory times are restored last, deepest first, since copying files into them changes them
+    for src_dir, dst_dir in reversed(dir_pairs):
+        try:
+            shutil.copystat(src_dir, dst_dir)
+        except OSError as why:
+            errors.append((src_dir, dst_dir, str(why)))
+    return errors
+
+
+def copytree_with_ignore(src: Path, target: Path | list[Path], rules: list[tuple[str, bool]],
+                         create_subdir: bool = False, jobs: int = 1, sync: bool = False, checksum: bool = False,
+                         delete: bool = False, cache: bool = False, copy_mode: str = "auto",
+                         dedupe: bool = False, resume: bool = False, verify: bool = False,
+                         manifest: Path | str | bool | None = None,
+                         progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
+    import shutil
+    src = Path(src).resolve()
+    # Several targets: one walk and one read of every file, written to all of them (fan-out)
+    targets = [Path(path).resolve() for path in (target if isinstance(target, (list, tuple)) else [target])]
+    if src.is_dir() and create_subdir:
+        targets = [path / src.name for path in targets]
+
+    if copy_mode not in COPY_MODES:
+        host.print(f"Unknown copy mode '{copy_mode}', use one of {', '.join(COPY_MODES)}", True)
+        return None
+
+    for path in targets:
+        if delete and src.is_relative_to(path):
+            host.print(f"Refusing to --delete: Source {src} and Target {path} overlap", True)
+            return
+
+    sync = sync or checksum
+    stats = RunStats("cp", src, targets[0] if len(targets) == 1 else targets)
+    stats.on_progress = progress
+    links = _LinkTable(dedupe=dedupe)
+    # --resume: files go to part names, renamed once complete; the journal lists the finished ones
+    journal: _Journal | None = None
+    done: dict[str, tuple[int, int]] = {}  # relpath -> (size, mtime_ns) of files an interrupted run finished
+    started: dict[str, tuple[int, int]] = {}  # the same for large files it had begun
+    src_root = os.path.join(str(src if src.is_dir() else src.parent), "")
+    # --verify / --manifest: relpath -> digest, taken in the read that copies the file
+    digests: dict[str, str] | None = {} if verify or manifest else None
+    # Large files are written to all targets at once; --jobs files can be in flight together
+    writers = None
+    if len(targets) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        writers = ThreadPoolExecutor(max_workers=len(targets) * jobs)
+
+    def copy_function(src_file: str, dst_files: list[str]) -> list[tuple[str, str, str]]:
+        # Also runs on the --jobs workers; RunStats.add(), _LinkTable and _Journal are thread-safe
+        st = os.stat(src_file)
+        relpath, stamp = src_file[len(src_root):], (st.st_size, st.st_mtime_ns)
+        primary, is_new = links.claim(src_file, dst_files, st)
+        if not is_new:
+            primary.done.wait()
+            unlinked = []
+            for existing, dst_file in zip(primary.path, dst_files):
+                linked = _hardlink(existing, dst_file) if primary.ok else None
+                if linked == "unchanged":
+                    stats.add(unchanged=1)
+                elif linked == "linked":
+                    stats.add(1, backend="hardlink")
+                    host.debug(f"{dst_file} [hardlink]")
+                else:
+                    unlinked.append(dst_file)
+            if not unlinked:
+                if digests is not None:
+                    digests[relpath.replace(os.sep, "/")] = primary.digest or _file_digest(src_file)
+                return []
+            dst_files = unlinked
+        errors = []
+        digest = None
+        try:
+            if journal is not None and done.get(relpath) == stamp and all(
+                    _is_unchanged(src_file, dst_file) for dst_file in dst_files):
+                stats.add(unchanged=len(dst_files))  # finished by the interrupted run, still in place
+                if digests is not None:
+                    digest = digests[relpath.replace(os.sep, "/")] = _file_digest(src_file)
+                return []
+            if sync:
+                changed = []
+                for dst_file in dst_files:
+                    if _is_unchanged(src_file, dst_file, checksum):
+                        stats.add(unchanged=1)
+                    else:
+                        changed.append(dst_file)
+            else:
+                changed = dst_files
+            writes = changed if journal is None else [_part_path(dst_file) for dst_file in changed]
+            hasher = None
+            if digests is not None:
+                import hashlib
+                hasher = hashlib.new(MANIFEST_ALGORITHM)
+            hashed = False  # whether hasher saw the whole file
+            if journal is not None and st.st_size >= RESUME_PARTIAL_MIN:
+                results: list[tuple[str, int] | OSError | None] = [None] * len(writes)
+                if started.get(relpath) == stamp:
+                    for index, part_file in enumerate(writes):
+                        try:
+                            results[index] = _continue_copy(src_file, part_file)
+                        except OSError as why:
+                            results[index] = why
+                fresh = [index for index, result in enumerate(results) if result is None]
+                if fresh:
+                    journal.add({"p": relpath, "s": st.st_size, "m": st.st_mtime_ns}, flush=True)
+                    copied = _copyfile_many(src_file, [writes[index] for index in fresh], copy_mode, writers, hasher)
+                    hashed = hasher is not None
+                    for index, result in zip(fresh, copied):
+                        results[index] = result
+            else:
+                results = _copyfile_many(src_file, writes, copy_mode, writers, hasher)
+                hashed = hasher is not None
+            for dst_file, write_file, result in zip(changed, writes, results):
+                try:
+                    if isinstance(result, OSError):
+                        raise result
+                    backend, size = result
+                    shutil.copystat(src_file, write_file)
+                    if write_file is not dst_file:
+                        os.replace(write_file, dst_file)
+                except OSError as why:
+                    errors.append((src_file, dst_file, str(why)))
+                    if write_file is not dst_file and st.st_size < RESUME_PARTIAL_MIN:
+                        with contextlib.suppress(OSError):
+                            os.unlink(write_file)
+                    continue
+                stats.add(1, size, backend=backend)
+                host.debug(f"{dst_file} [{backend}]")
+            if journal is not None and not errors:
+                journal.add({"f": relpath, "s": st.st_size, "m": st.st_mtime_ns})
+            if digests is not None and not errors:
+                digest = hasher.hexdigest() if hashed else _file_digest(src_file)
+                digests[relpath.replace(os.sep, "/")] = digest
+        except OSError as why:
+            errors = [(src_file, dst_file, str(why)) for dst_file in dst_files]
+        finally:
+            if is_new:
+                primary.digest = digest
+                primary.finish(len(errors) < len(dst_files))
+        return errors
+
+    def seal() -> None:
+        # Manifest paths are relative to the target given, so a subdirectory named after src is part of them
+        prefix = src.name + "/" if create_subdir and src.is_dir() else ""
+        stats.digests = {prefix + relpath: digest for relpath, digest in digests.items()}
+        if verify:
+            for path in targets:
+                _verify_into(stats, str(path), digests, jobs)
+            host.print(f"Verified {stats.verified} copied files: "
+                       f"{f'{len(stats.mismatches)} differ' if stats.mismatches else 'all match'}.")
+        if manifest and manifest is not True:
+            _write_manifest(manifest, stats.digests)
+            host.print(f"Manifest of {len(stats.digests)} files written to {manifest}")
+
+    for path in targets:
+        if path.is_relative_to(src):
+            # If subdir, add the relative path to ignore_rules
+            relative_target_path = path.relative_to(src)
+            length = len(relative_target_path.parts)
+
+            for i in range(length):
+                subdir_path = Path(*relative_target_path.parts[:i + 1])
+                if not os.path.isdir(subdir_path):  # Check if the directory exists
+                    rules = rules + [(f"{subdir_path}/", False)]  # Add the first non-existing directory to the rules
+                    break
+
+    # Ensure the target directories exist if copying a directory; a target that cannot be created is skipped
+    usable = []
+    for path in targets:
+        if not path.exists():
+            try:
+                os.makedirs(path)
+            except FileNotFoundError:
+                # This exception is raised if part of the path is a file instead of a directory
+                host.print(f"Some part of the Target Dir '{path}' is a File", True)
+                stats.fail(path, "Some part of the target directory is a file")
+                continue
+            except PermissionError as e:
+                host.print(f"Permission Denied: {e.filename}", True)
+                stats.fail(path, str(e))
+                continue
+            except Exception as e:
+                host.print(f"Unexpected error: {str(e)}", True)
+                stats.fail(path, str(e))
+                continue
+        usable.append(path)
+    if not usable:
+        return  # Return or exit the function to avoid further operations
+    if len(targets) > 1:
+        stats.target_errors = {str(path): int(path not in usable) for path in targets}
+    targets = usable
+
+    # === Handle the case where src is a file ===
+    if src.is_file():
+        # Ensure the targets are directories
+        for path in targets:
+            if not path.is_dir():
+                raise ValueError(f"Target {path} must be a directory if copying a file.")
+
+    finished = False
+    try:
+        ruleset = None if src.is_file() else RuleSet(rules)
+        if resume:
+            journal = _Journal("cp", src, [str(path) for path in targets], ruleset.digest if ruleset else "")
+            records = journal.load()
+            journal.start(records)
+            for record in records:
+                if "f" in record:
+                    done[record["f"]] = (record["s"], record["m"])
+                elif "p" in record:
+                    started[record["p"]] = (record["s"], record["m"])
+            if records:
+                host.print(f"Resuming an interrupted copy: {len(done)} files already finished are checked, "
+                           f"not copied again")
+
+        if src.is_file():
+            dst_files = [str(path / src.name) for path in targets]
+            if sync or resume or len(targets) > 1 or digests is not None:
+                errors = copy_function(str(src), dst_files)
+            else:
+                # Like shutil.copy(): permission bits only, no timestamps
+                backend, size = _copyfile(str(src), dst_files[0], copy_mode)
+                shutil.copymode(src, dst_files[0])
+                stats.add(1, size, backend=backend)
+                errors = []
+            if digests is not None:
+                seal()
+            if errors:
+                raise shutil.Error(errors)
+            finished = True
+            host.print(f"Copied file from {src} to {', '.join(dst_files)}.")
+            return stats.finish()
+
+        # === Handle the case where src is a directory ===
+        scan_cache = ScanCache(src, ruleset) if cache else None
+        if scan_cache is not None:
+            stats.expected_files = scan_cache.files
+
+        errors = []
+        if delete:
+            for path in targets:
+                removed, prune_errors = _prune_target(src, path, ruleset, keep_parts=resume)
+                stats.removed += removed
+                errors += prune_errors
+        errors += _copytree_walk(src, targets, ruleset, jobs, copy_function, scan_cache,
+                                 lambda count: stats.add(skipped=count))
+        if digests is not None:
+            seal()
+        stats.finish()
+        if errors:
+            raise shutil.Error(errors)
+        finished = True
+        to = ", ".join(str(path) for path in targets)
+        if sync:
+            host.print(f"Synced {src} to {to}: {stats.files} copied, {stats.unchanged} unchanged, "
+                       f"{stats.removed} removed, skipping ignored files. {stats}.")
+        else:
+            host.print(f"Copied from {src} to {to}, skipping ignored files. {stats}."
+                       + (f" Removed {stats.removed} stale entries." if delete else ""))
+    except shutil.Error as e:
+        # Catch errors during copying
+        for _, dst_file, why in e.args[0]:
+            stats.fail(dst_file, why)
+            host.print(f"Permission Denied: {dst_file}" if "Permission denied" in why else why, True)
+            if stats.target_errors is not None:
+                owner = next((path for path in targets if dst_file == str(path) or
+                              dst_file.startswith(os.path.join(path, ""))), None)
+                if owner is not None:
+                    stats.target_errors[str(owner)] += 1
+        if stats.target_errors is not None:
+            for path, count in stats.target_errors.items():
+                if count:
+                    host.print(f"{path}: {count} errors", True)
+    except PermissionError as e:
+        stats.fail(e.filename or src, str(e))
+        host.print(f"Permission Denied: {e.filename}", True)
+    except Exception as e:
+        stats.fail(src, str(e))
+        host.print(f"Unexpected error: {str(e)}", True)
+    finally:
+        if writers is not None:
+            writers.shutdown()
+        if journal is not None:
+            journal.close(finished)
+    return stats.finish()
+
+
+WATCH_DEBOUNCE = 0.5  # seconds without new events before the pending changes are applied
+WATCH_MAX_DELAY = 5.0  # seconds; pending changes are applied by then even while events keep coming
+WATCH_POLL_INTERVAL = 2.0  # seconds between two scans of the polling fallback
+_WATCH_TICK = 1.0  # longest wait for events: the ignore file and the stop event are checked in between
+
+_IN_MODIFY, _IN_ATTRIB, _IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+_IN_MOVED_FROM, _IN_MOVED_TO, _IN_CREATE, _IN_DELETE = 0x40, 0x80, 0x100, 0x200
+_IN_Q_OVERFLOW, _IN_IGNORED, _IN_ONLYDIR, _IN_ISDIR = 0x4000, 0x8000, 0x01000000, 0x40000000
+
+
+def _walk_below(root: str, prefix: str, ruleset: RuleSet,
+                onerror: Callable[[OSError], None] | None = None) -> Iterator[tuple[str, os.DirEntry, bool]]:
+    """walk_with_ignore() of the directory of root whose relpath is `prefix` ("" for root itself, else "rel/dir/")."""
+    directory = os.path.join(root, prefix) if prefix else root
+    try:
+        parent = _parent_scope(ruleset, root, prefix)
+    except OSError as error:
+        if onerror is not None:
+            onerror(error)
+        return
+    stack = [(directory, prefix, parent)]
+    while stack:
+        directory, prefix, parent = stack.pop()
+        subdirs = []
+        try:
+            scope = ruleset._enter(directory, prefix, parent)
+            for relpath, entry, is_dir in _scan_dir(directory, prefix, ruleset, None, scope):
+                yield relpath, entry, is_dir
+                if is_dir:
+                    subdirs.append((entry.path, relpath + "/", scope))
+        except OSError as error:
+            if onerror is not None:
+                onerror(error)
+        stack.extend(reversed(subdirs))
+
+
+def _parent_scope(ruleset: RuleSet, root: str, prefix: str) -> _Scope | _Layers | None:
+    """The scope a walk of root enters the directory `prefix` with: that of its parent, nested ignore files included."""
+    scope = None
+    if prefix:
+        scope = ruleset._enter(root, "")
+        parts = prefix.split("/")[:-2]
+        for depth in range(1, len(parts) + 1):
+            reldir = "/".join(parts[:depth]) + "/"
+            scope = ruleset._enter(os.path.join(root, reldir), reldir, scope)
+    return scope
+
+
+def _passes(ruleset: RuleSet, root: str, relpath: str, is_dir: bool) -> bool:
+    """Whether a walk of root reaches relpath: neither it nor one of its parent directories is ignored."""
+    parts = relpath.split("/")
+    try:
+        scope = ruleset._enter(root, "")
+        for depth in range(1, len(parts)):
+            reldir = "/".join(parts[:depth])
+            if ruleset._ignored(scope, reldir, True):
+                return False
+            scope = ruleset._enter(os.path.join(root, reldir), reldir + "/", scope)
+    except OSError:
+        return False  # an unreadable nested ignore file: the walk skips its directory
+    return not ruleset._ignored(scope, relpath, is_dir)
+
+
+class _Inotify:
+    """
+    Linux inotify through ctypes, with one watch per kept directory of the source.
+    Watches follow directories as they are created, moved in or out, and deleted.
+    """
+    name = "inotify"
+    MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+    _EVENT = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len, then the padded name
+
+    def __init__(self, src: str, ruleset: RuleSet):
+        import ctypes
+        import select
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)  # IN_NONBLOCK, IN_CLOEXEC
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1() failed")
+        self.src = src
+        self.ruleset = ruleset
+        self.overflow = False  # the kernel queue overflowed: events were lost, rescan everything
+        self._prefixes: dict[int, str] = {}  # watch descriptor -> "" for the root, else "rel/dir/"
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+        try:
+            self._add_tree(src, "")
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, directory: str, prefix: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK | _IN_ONLYDIR)
+        if wd >= 0:
+            self._prefixes[wd] = prefix
+            return
+        error = self._ctypes.get_errno()
+        if error == errno.ENOSPC:
+            raise OSError(error, "Too many directories for inotify (see fs.inotify.max_user_watches)", directory)
+        # Otherwise it was removed or made unreadable since it was listed; its parent reports that
+
+    def _add_tree(self, directory: str, prefix: str) -> None:
+        self._add(directory, prefix)
+        for relpath, entry, is_dir in _walk_below(self.src, prefix, self.ruleset):
+            if is_dir:
+                self._add(entry.path, relpath + "/")
+
+    def _forget(self, prefix: str) -> None:
+        for wd, watched in list(self._prefixes.items()):
+            if watched.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._prefixes[wd]
+
+    def read(self, timeout: float) -> set[str]:
+        """Relpaths that had events, waiting up to `timeout` seconds for the first one."""
+        changed: set[str] = set()
+        if not self._poll.poll(timeout * 1000):
+            return changed
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            name = data[offset + self._EVENT.size:offset + self._EVENT.size + length].rstrip(b"\0")
+            offset += self._EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                self.overflow = True
+                continue
+            if mask & _IN_IGNORED:
+                self._prefixes.pop(wd, None)  # its directory is gone
+                continue
+            prefix = self._prefixes.get(wd)
+            if prefix is None or not name:
+                continue
+            relpath = prefix + os.fsdecode(name)
+            changed.add(relpath)
+            if mask & _IN_ISDIR:
+                if mask & _IN_MOVED_FROM:
+                    self._forget(relpath + "/")
+                elif mask & (_IN_CREATE | _IN_MOVED_TO) and _passes(self.ruleset, self.src, relpath, True):
+                    # Watched before its subtree is copied, so nothing written into it meanwhile is missed
+                    self._add_tree(os.path.join(self.src, relpath), relpath + "/")
+        return changed
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _Poller:
+    """Fallback for _Inotify: rescans the kept tree every `interval` seconds and compares file sizes and mtimes."""
+    name = "polling"
+
+    def __init__(self, src: str, ruleset: RuleSet, interval: float = WATCH_POLL_INTERVAL):
+        self.src = src
+        self.ruleset = ruleset
+        self.interval = interval
+        self.overflow = False
+        self._state = self._scan()
+        self._scanned = time.monotonic()
+
+    def _scan(self) -> dict[str, tuple]:
+        state = {}
+        for relpath, entry, is_dir in _walk_below(self.src, "", self.ruleset):
+            if is_dir:
+                state[relpath] = ()  # new and removed entries show up on their own
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            state[relpath] = (st.st_size, st.st_mtime_ns, st.st_mode)
+        return state
+
+    def read(self, timeout: float) -> set[str]:
+        """Relpaths that changed since the previous scan, when a scan is due within `timeout` seconds."""
+        wait = self._scanned + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait, 0))
+        state = self._scan()
+        self._scanned = time.monotonic()
+        changed = {relpath for relpath in state.keys() | self._state.keys()
+                   if state.get(relpath) != self._state.get(relpath)}
+        self._state = state
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def _mirror_changes(src: str, target: str, ruleset: RuleSet, relpaths: set[str], stats: RunStats,
+                    copy_mode: str = "auto") -> None:
+    """
+    Brings target up to date for the changed relpaths of src: new or modified files are copied,
+    a new directory with its kept subtree, and whatever is gone from src is removed.
+    Each path is handled once however many events it had, parents before their children.
+    """
+    import shutil
+    synced: set[str] = set()  # "rel/dir/" of directories copied with their whole subtree
+    touched: set[str] = set()  # target directories whose times are restored at the end
+
+    def report(why: OSError) -> None:
+        stats.fail(why.filename or src, str(why))
+        host.print(f"Permission Denied: {why.filename}" if isinstance(why, PermissionError) else str(why), True)
+
+    def copy_file(src_file: str, relpath: str, st: os.stat_result) -> None:
+        dst_file = os.path.join(target, relpath)
+        try:
+            dst_st = os.lstat(dst_file)
+        except OSError:
+            dst_st = None
+        if dst_st is not None:
+            if (stat.S_ISREG(dst_st.st_mode) and dst_st.st_size == st.st_size
+                    and dst_st.st_mtime_ns == st.st_mtime_ns):
+                stats.add(unchanged=1)  # e.g. a file that was only opened, or events repeated
+                return
+            if not stat.S_ISREG(dst_st.st_mode):
+                _remove_path(dst_file)  # a directory or symlink replaced by a file
+        backend, size = _copyfile(src_file, dst_file, copy_mode)
+        shutil.copystat(src_file, dst_file)
+        stats.add(1, size, backend=backend)
+        host.debug(f"{dst_file} [{backend}]")
+
+    def make_dir(relpath: str) -> None:
+        dst_dir = os.path.join(target, relpath)
+        if os.path.lexists(dst_dir) and not os.path.isdir(dst_dir):
+            os.unlink(dst_dir)  # a file replaced by a directory
+        os.makedirs(dst_dir, exist_ok=True)
+        touched.add(relpath)
+
+    for relpath in sorted(relpaths):  # "a" sorts before "a/b"
+        if any(relpath[:index + 1] in synced for index, char in enumerate(relpath) if char == "/"):
+            continue  # already copied with its parent directory
+        src_path = os.path.join(src, relpath)
+        dst_path = os.path.join(target, relpath)
+        try:
+            try:
+                st = os.stat(src_path)
+            except (FileNotFoundError, NotADirectoryError):
+                if os.path.lexists(dst_path):
+                    _remove_path(dst_path)
+                    stats.removed += 1
+                    host.debug(f"{dst_path} [removed]")
+                    touched.add(os.path.dirname(relpath))
+                continue
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if not _passes(ruleset, src, relpath, is_dir) or not (is_dir or stat.S_ISREG(st.st_mode)):
+                continue
+            if not is_dir:
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                copy_file(src_path, relpath, st)
+            else:
+                make_dir(relpath)
+                for sub_relpath, entry, sub_is_dir in _walk_below(src, relpath + "/", ruleset, report):
+                    try:
+                        if sub_is_dir:
+                            make_dir(sub_relpath)
+                        else:
+                            copy_file(entry.path, sub_relpath, entry.stat())
+                    except OSError as why:
+                        report(why)
+                synced.add(relpath + "/")
+            touched.add(os.path.dirname(relpath))
+        except OSError as why:
+            report(why)
+
+    # Like _copytree_walk(): directory times last, deepest first
+    for relpath in sorted(touched, reverse=True):
+        with contextlib.suppress(OSError):
+            shutil.copystat(os.path.join(src, relpath), os.path.join(target, relpath))
+
+
+def watch_with_ignore(src: Path, target: Path, rules: list[tuple[str, bool]], ignore_file: Path | None = None,
+                      additional_patterns: list[str] | None = None, delete: bool = False,
+                      debounce: float = WATCH_DEBOUNCE, poll_interval: float | None = None,
+                      copy_mode: str = "auto", cache: bool = False,
+                      stop: threading.Event | None = None) -> RunStats | None:
+    src = Path(src).resolve()
+    target = Path(target).resolve()
+    if not src.is_dir():
+        host.print(f"Source {src} must be a directory.", True)
+        return None
+    if src.is_relative_to(target):
+        host.print(f"Refusing to watch: Source {src} is inside Target {target}", True)
+        return None
+    # A target inside src must never be watched, or every copy would trigger another one
+    own = [(target.relative_to(src).as_posix() + "/", False)] if target.is_relative_to(src) else []
+    nested = rules.nested if isinstance(rules, RuleSet) else NESTED_IGNORE_FILE
+    current = list(rules.rules if isinstance(rules, RuleSet) else rules)
+    stats = RunStats("watch", src, target)
+
+    def full_sync() -> bool:
+        result = copytree_with_ignore(src, target, RuleSet(current + own, nested), sync=True, delete=delete,
+                                      cache=cache, copy_mode=copy_mode)
+        if result is None:
+            return False
+        stats.add(result.files, result.bytes, result.unchanged, skipped=result.skipped)
+        stats.removed += result.removed
+        stats.errors += result.errors
+        stats.failures.extend(result.failures)
+        for backend, count in result.backends.items():
+            stats.backends[backend] = stats.backends.get(backend, 0) + count
+        return True
+
+    def start_watcher(ruleset: RuleSet) -> _Inotify | _Poller:
+        if poll_interval is None and sys.platform.startswith("linux"):
+            try:
+                return _Inotify(str(src), ruleset)
+            except (OSError, AttributeError) as why:  # AttributeError: a libc without inotify
+                host.print(f"inotify is unavailable ({why}); polling every {WATCH_POLL_INTERVAL} s instead")
+        return _Poller(str(src), ruleset, poll_interval or WATCH_POLL_INTERVAL)
+
+    # The watcher starts first: changes made during the initial copy are applied right after it
+    ruleset = RuleSet(current + own, nested)
+    watcher = start_watcher(ruleset)
+    stamp = _file_stamp(ignore_file) if ignore_file is not None else None
+    try:
+        if not full_sync():
+            return None
+        host.print(f"Watching {src} for changes ({watcher.name}), press Ctrl+C to stop.")
+        pending: set[str] = set()
+        first = last = 0.0
+        while stop is None or not stop.is_set():
+            timeout = min(last + debounce, first + WATCH_MAX_DELAY) - time.monotonic() if pending else _WATCH_TICK
+            try:
+                changed = watcher.read(max(min(timeout, _WATCH_TICK), 0))
+            except OSError as why:  # e.g. the inotify watch limit, hit by a new directory tree
+                host.print(f"{why}; polling every {WATCH_POLL_INTERVAL} s instead", True)
+                watcher.close()
+                watcher = _Poller(str(src), ruleset, poll_interval or WATCH_POLL_INTERVAL)
+                watcher.overflow, changed = True, set()
+            now = time.monotonic()
+            if changed:
+                first = first if pending else now
+                last = now
+                pending |= changed
+
+            rescan = watcher.overflow
+            due = pending and (now - last >= debounce or now - first >= WATCH_MAX_DELAY)
+            if ignore_file is not None and _file_stamp(ignore_file) != stamp:
+                stamp = _file_stamp(ignore_file)
+                current = load_ignore_rules(ignore_file, additional_patterns)
+                ruleset = RuleSet(current + own, nested)
+                host.print(f"{ignore_file} changed, reloaded {len(ruleset)} rules.")
+                watcher.close()
+                watcher = start_watcher(ruleset)
+                rescan = True
+            elif due and nested and any(relpath.rpartition("/")[2] == nested for relpath in pending):
+                # A nested ignore file changed what its subtree keeps: resync it as for the main one
+                host.print(f"A {nested} file changed, syncing again.")
+                watcher.close()
+                watcher = start_watcher(ruleset)
+                rescan = True
+            if rescan:
+                watcher.overflow = False
+                pending.clear()
+                full_sync()
+            elif due:
+                before = (stats.files, stats.removed, stats.errors)
+                _mirror_changes(str(src), str(target), ruleset, pending, stats, copy_mode)
+                pending = set()
+                host.end_progress()
+                files, removed, errors = (stats.files - before[0], stats.removed - before[1],
+                                          stats.errors - before[2])
+                if files or removed:
+                    host.print(f"{time.strftime('%H:%M:%S')} {files} copied, {removed} removed"
+                               + (f", {errors} errors" if errors else "") + ".")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    stats.finish()
+    host.print(f"Stopped watching {src}. {stats}.")
+    return stats
+
+
+ARCHIVE_SUFFIXES = {
+    ".zip": "zip", ".tar": "tar", ".tar.gz": "tgz", ".tgz": "tgz", ".tar.bz2": "tbz2", ".tbz2": "tbz2",
+    ".tar.xz": "txz", ".txz": "txz", ".tar.zst": "tzst", ".tzst": "tzst",
+}
+ARCHIVE_FORMATS = ("zip", "tar", "tgz", "tbz2", "txz", "tzst")
+ARCHIVE_LEVELS = {  # format -> (lowest, highest, default) compression level
+    "zip": (0, 9, 6), "tgz": (0, 9, 9), "tbz2": (1, 9, 9), "txz": (0, 9, 6), "tzst": (1, 22, 3),
+}
+STORE_EXTENSIONS = frozenset({  # already-compressed data: stored in zip archives without deflating
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".lz4", ".whl", ".jar", ".apk", ".egg",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".aac", ".ogg", ".opus", ".flac", ".m4a", ".mp4", ".m4v", ".mkv", ".mov", ".avi", ".webm",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".woff", ".woff2",
+})
+ENTROPY_SAMPLE_SIZE = 1 << 16
+ARCHIVE_BLOCK_SIZE = 1 << 20  # unit of parallel compression work
+_DEFLATE_WINDOW = 1 << 15
+_DEFLATE_END = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+
+
+def _deflate_block(data: bytes, level: int, zdict: bytes = b"") -> bytes:
+    """
+    Raw-deflates one block ending on a byte boundary (Z_SYNC_FLUSH), so blocks compressed independently
+    concatenate into one valid deflate stream. Priming with the previous 32 KiB (pigz-style) keeps the ratio.
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class _OrderedPipeline:
+    """Runs work on a thread pool and hands the results back to the calling thread in submission order."""
+
+    def __init__(self, pool: ThreadPoolExecutor, window: int):
+        self.pool = pool
+        self.window = window
+        self.queue: deque[tuple[Future | None, Callable]] = deque()
+
+    def submit(self, then: Callable, fn: Callable, *args) -> None:
+        self.queue.append((self.pool.submit(fn, *args), then))
+        self._drain(self.window)
+
+    def call(self, then: Callable) -> None:
+        """Queues `then(None)` to run in order with the other results, without any pool work."""
+        self.queue.append((None, then))
+        self._drain(self.window)
+
+    def flush(self) -> None:
+        self._drain(0)
+
+    def _drain(self, limit: int) -> None:
+        while len(self.queue) > limit:
+            future, then = self.queue.popleft()
+            then(future.result() if future is not None else None)
+
+
+class _ParallelGzipWriter:
+    """Write-only gzip stream deflated block-parallel (pigz-style); stock gzip and tar read it as usual."""
+
+    def __init__(self, fileobj, pipeline: _OrderedPipeline, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self.fileobj = fileobj
+        self.pipeline = pipeline
+        self.level = level
+        self.buffer = bytearray()
+        self.zdict = b""
+        self.crc = 0
+        self.size = 0
+        xfl = 2 if level == 9 else 4 if level == 1 else 0
+        fileobj.write(struct.pack("<BBBBIBB", 0x1f, 0x8b, zlib.DEFLATED, 0, int(time.time()), xfl, 255))
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= ARCHIVE_BLOCK_SIZE:
+            view = memoryview(self.buffer)
+            end = len(self.buffer) - len(self.buffer) % ARCHIVE_BLOCK_SIZE
+            for offset in range(0, end, ARCHIVE_BLOCK_SIZE):
+                self._submit(bytes(view[offset:offset + ARCHIVE_BLOCK_SIZE]))
+            view.release()
+            del self.buffer[:end]
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pipeline.submit(self.fileobj.write, _deflate_block, block, self.level, self.zdict)
+        self.zdict = block[-_DEFLATE_WINDOW:]
+
+    def close(self) -> None:
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        self.pipeline.flush()
+        self.fileobj.write(_DEFLATE_END)
+        self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xffffffff))
+
+
+class _DeflatedElsewhere:
+    """Stands in for the compressor of a zip write handle whose member data was deflated by the pool."""
+
+    @staticmethod
+    def flush() -> bytes:
+        return _DEFLATE_END
+
+
+class _PredeflatedMember:
+    """
+    A ZIP_DEFLATED write handle of ZipFile fed with raw deflate data compressed elsewhere. ZipFile still writes
+    the local header, the data descriptor and the central directory entry; the handle's private counters are
+    set here instead of by its compressor, so _zip_predeflate_works() checks them before this is used.
+    """
+    __slots__ = ('handle',)
+
+    def __init__(self, zip_f: zipfile.ZipFile, zinfo: zipfile.ZipInfo):
+        self.handle = zip_f.open(zinfo, 'w')
+        self.handle._compressor = _DeflatedElsewhere
+
+    def write(self, data: bytes) -> None:
+        self.handle._fileobj.write(data)
+        self.handle._compress_size += len(data)
+
+    def close(self, crc: int, size: int) -> None:
+        self.handle._crc = crc
+        self.handle._file_size = size
+        self.handle.close()
+
+
+_ZIP_WRITE_HANDLE_ATTRIBUTES = ('_compressor', '_fileobj', '_compress_size', '_crc', '_file_size')
+_ZIP_PREDEFLATE_WORKS: bool | None = None
+
+
+def _zip_predeflate_works() -> bool:
+    """
+    Whether this Python's ZipFile write handles still work the way _PredeflatedMember drives them: checked once
+    per process by writing a small member through it and reading it back. Otherwise zip members are deflated
+    by ZipFile itself, one at a time.
+    """
+    global _ZIP_PREDEFLATE_WORKS
+    if _ZIP_PREDEFLATE_WORKS is None:
+        import io
+        import zipfile
+        data = bytes(range(256)) * 64
+        compressed = _deflate_block(data, zlib.Z_DEFAULT_COMPRESSION)
+        buffer = io.BytesIO()
+        try:
+            with zipfile.ZipFile(buffer, 'w') as zip_f:
+                zinfo = zipfile.ZipInfo("probe")
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                member = _PredeflatedMember(zip_f, zinfo)
+                if not all(hasattr(member.handle, name) for name in _ZIP_WRITE_HANDLE_ATTRIBUTES):
+                    raise AttributeError("ZipFile write handles changed")
+                member.write(compressed)
+                member.close(zlib.crc32(data), len(data))
+            with zipfile.ZipFile(buffer) as zip_f:
+                info = zip_f.getinfo("probe")
+                works = (zip_f.read("probe") == data and info.file_size == len(data)
+                         and info.compress_size == len(compressed) + len(_DEFLATE_END))
+        except Exception:  # any change of the internals: fall back rather than write a broken archive
+            works = False
+        _ZIP_PREDEFLATE_WORKS = works
+    return _ZIP_PREDEFLATE_WORKS
+
+
+def _zip_add_parallel(zip_f: zipfile.ZipFile, pipeline: _OrderedPipeline, path: str, arcname: str,
+                      level: int = zlib.Z_DEFAULT_COMPRESSION, digests: dict[str, str] | None = None) -> None:
+    """
+    Queues one ZIP_DEFLATED member whose blocks are compressed by the pipeline's pool.
+    The local header, data and central directory entry are still written by ZipFile, in member order.
+    With `digests`, the member's digest is recorded from the same read.
+    """
+    import zipfile
+    if not _zip_predeflate_works():
+        pipeline.call(lambda _: _zip_write(zip_f, path, arcname, None, digests))
+        return
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    member: list[_PredeflatedMember] = []
+
+    def begin(_) -> None:
+        member.append(_PredeflatedMember(zip_f, zinfo))
+
+    def write(data: bytes) -> None:
+        member[0].write(data)
+
+    pipeline.call(begin)
+    crc = size = 0
+    zdict = b""
+    with open(path, "rb") as f:
+        if digests is not None:
+            f = _HashingReader(f)
+        while block := f.read(ARCHIVE_BLOCK_SIZE):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            pipeline.submit(write, _deflate_block, block, level, zdict)
+            zdict = block[-_DEFLATE_WINDOW:]
+        if digests is not None:
+            digests[arcname] = f.hexdigest()
+
+    pipeline.call(lambda _: member[0].close(crc, size))
+
+
+def _archive_format(name: str) -> str | None:
+    name = name.lower()
+    for suffix, archive_format in ARCHIVE_SUFFIXES.items():
+        if name.endswith(suffix):
+            return archive_format
+    return None
+
+
+def _is_incompressible(path: str, store_ext: tuple[str, ...]) -> bool:
+    """Known compressed extension, or a leading sample that deflate cannot shrink by 5 %."""
+    if path.lower().endswith(store_ext):
+        return True
+    try:
+        with open(path, "rb") as f:
+            sample = f.read(ENTROPY_SAMPLE_SIZE)
+    except OSError:
+        return False
+    if len(sample) < 4096:
+        return False  # Too small to be worth measuring
+    return len(zlib.compress(sample, 1)) > len(sample) * 0.95
+
+
+def _zstd_module():
+    """The optional `zstandard` module, else Python 3.14's compression.zstd, else None."""
+    try:
+        import zstandard
+        return zstandard
+    except ModuleNotFoundError:
+        pass
+    try:
+        from compression import zstd
+        return zstd
+    except ModuleNotFoundError:
+        return None
+
+
+def _zstd_writer(fileobj, level: int, jobs: int = 1):
+    zstd = _zstd_module()
+    if zstd.__name__ == "zstandard":
+        # zstandard: multithreaded frames when --jobs > 1; fileobj stays open for the caller
+        compressor = zstd.ZstdCompressor(level=level, threads=jobs if jobs > 1 else 0)
+        return compressor.stream_writer(fileobj, closefd=False)
+    return zstd.ZstdFile(fileobj, "w", level=level)
+
+
+def _tar_compressor(raw_f, archive_format: str, level: int, pipeline: _OrderedPipeline | None = None,
+                    jobs: int = 1):
+    """Compressing write stream over raw_f for a tar archive written in stream mode, or None for plain tar."""
+    if archive_format == "tgz":
+        if pipeline is not None:
+            return _ParallelGzipWriter(raw_f, pipeline, level)
+        import gzip
+        return gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=raw_f)
+    if archive_format == "tbz2":
+        import bz2
+        return bz2.BZ2File(raw_f, "wb", compresslevel=level)
+    if archive_format == "txz":
+        import lzma
+        return lzma.LZMAFile(raw_f, "wb", preset=level)
+    if archive_format == "tzst":
+        return _zstd_writer(raw_f, level, jobs)
+    return None
+
+
+def _counted_members(members: Iterator[tuple[str, str]], stats: RunStats) -> Iterator[tuple[str, str]]:
+    # A member is counted once the archive asks for the next one, i.e. after it has been added
+    for path, arcname in members:
+        yield path, arcname
+        try:
+            size = os.lstat(path).st_size
+        except OSError:
+            size = 0
+        stats.add(1, size)
+        host.debug(path)
+
+
+def _unfinished_members(members: Iterator[tuple[str, str]], done: dict[str, tuple[int, int]],
+                        stats: RunStats) -> Iterator[tuple[str, str]]:
+    # Members an interrupted run archived and that are unchanged since stay where they are
+    for path, arcname in members:
+        stamp = done.get(arcname)
+        if stamp is not None:
+            try:
+                st = os.lstat(path)
+            except OSError:
+                st = None
+            if st is not None and stamp == (st.st_size, st.st_mtime_ns):
+                stats.add(unchanged=1)
+                continue
+        yield path, arcname
+
+
+def _tar_resume_point(path: str, records: list[dict]) -> tuple[int, int]:
+    """
+    (offset, count): where an interrupted tar in `path` can be continued, after the first `count` journal
+    records. That is the end of the last recorded member whose header still reads back with its name
+    and length; (0, 0) when none does.
+    """
+    import tarfile
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            for count in range(len(records), 0, -1):
+                record = records[count - 1]
+                if record["e"] > size:
+                    continue
+                f.seek(record["h"])
+                try:
+                    with tarfile.open(fileobj=f, mode="r:") as tar_f:
+                        member = tar_f.firstmember
+                        if member is not None and member.name == record["a"] and tar_f.offset == record["e"]:
+                            return record["e"], count
+                except tarfile.TarError:
+                    pass
+    except (OSError, KeyError, TypeError):
+        pass
+    return 0, 0
+
+
+def create_archive_with_ignore(src: Path, output: Path | BinaryIO, rules: list[tuple[str, bool]], jobs: int = 1,
+                               level: int | None = None, store_ext: list[str] | None = None,
+                               archive_format: str | None = None, cache: bool = False,
+                               dedupe: bool = False, resume: bool = False, verify: bool = False,
+                               manifest: Path | str | bool | None = None,
+                               progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
+    import tarfile
+    import zipfile
+    src = Path(src).resolve()
+    # A writable binary stream (stdout, a pipe, a socket file) gets the archive written sequentially
+    is_stream = hasattr(output, "write")
+    if is_stream:
+        output_name = getattr(output, "name", "<stream>")
+    else:
+        output = Path(output).resolve()
+        output_name = output
+
+    archive_format = archive_format or (None if is_stream else _archive_format(output.name))
+    if archive_format not in ARCHIVE_FORMATS:
+        host.print("Unsupported archive format. Use .zip, .tar, .tar.gz/.tgz, .tar.bz2, .tar.xz or .tar.zst"
+                   + (" (a stream output needs an explicit format)" if is_stream else ""), True)
+        return
+    if archive_format in ARCHIVE_LEVELS:
+        lowest, highest, default = ARCHIVE_LEVELS[archive_format]
+        if level is None:
+            level = default
+        elif not lowest <= level <= highest:
+            host.print(f"Compression level for {archive_format} must be within {lowest}..{highest}", True)
+            return
+    if archive_format == "tzst" and _zstd_module() is None:
+        host.print(".tar.zst output needs the optional 'zstandard' module (pip install zstandard)", True)
+        return
+    if dedupe and archive_format == "zip":
+        host.print("--dedupe has no effect on zip archives, which cannot hold hardlinks")
+    if resume and is_stream:
+        host.print("--resume needs an archive file to continue, not a stream", True)
+        return
+    if verify and is_stream:
+        host.print("--verify needs an archive file to read back, not a stream; --manifest still works", True)
+        return
+    # --verify / --manifest: member -> digest, taken in the read that archives the file
+    digests: dict[str, str] | None = {} if verify or manifest else None
+    # --resume: the archive is written to a part name and renamed once complete
+    write_path = Path(_part_path(str(output))) if resume else output
+    store_ext = tuple(STORE_EXTENSIONS.union(
+        ext.lower() if ext.startswith(".") else f".{ext.lower()}" for ext in store_ext or ()))
+
+    if not is_stream and output.is_relative_to(src):
+        # If subdir, add the relative path to ignore_rules
+        relative_target_path = output.relative_to(src)
+        rules = rules + [(str(relative_target_path), False)]
+        if resume:
+            rules = rules + [(str(write_path.relative_to(src)), False)]
+
+    stats = RunStats("archive", src, output_name)
+    stats.on_progress = progress
+    # === Handle single file case (skip rules) ===
+    if src.is_file():
+        members: Iterator[tuple[str, str]] = iter([(str(src), src.name)])
+    elif src.is_dir():
+        # os.walk() never descended into symlinked directories here; keep that for archives
+        ruleset = RuleSet(rules)
+        host.debug(f"rules: {rules}")
+        scan_cache = ScanCache(src, ruleset) if cache else None
+        if scan_cache is not None:
+            stats.expected_files = scan_cache.files
+        members = ((entry.path, relpath) for relpath, entry in
+                   walk_with_ignore(src, ruleset, follow_symlinks=False, cache=scan_cache,
+                                    on_skip=lambda count: stats.add(skipped=count)) if not entry.is_dir())
+    else:
+        host.print(f"Source {src} must be a directory or file.", True)
+        return
+    # Only plain tar can be continued: compressed streams and the zip central directory cannot be appended to
+    journal = None
+    offset = 0
+    if resume and archive_format == "tar" and src.is_dir():
+        journal = _Journal("archive", src, [str(output)], ruleset.digest)
+        records = journal.load()
+        offset, count = _tar_resume_point(str(write_path), records)
+        del records[count:]
+        journal.start(records)
+        if offset:
+            host.print(f"Resuming an interrupted archive after {count} members ({_format_bytes(offset)})")
+            members = _unfinished_members(members, {record["a"]: (record["s"], record["m"]) for record in records},
+                                          stats)
+    elif resume and write_path.exists():
+        host.print(f"An interrupted {archive_format} archive cannot be continued, only a plain .tar; "
+                   f"writing {output.name} again")
+    members = _counted_members(members, stats)
+
+    pool = None
+    if jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=jobs)
+    finished = False
+    try:
+        pipeline = _OrderedPipeline(pool, jobs * 4) if pool is not None else None
+        if archive_format == "zip":
+            with zipfile.ZipFile(write_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as zip_f:
+                for path, arcname in members:
+                    if _is_incompressible(path, store_ext):
+                        if pipeline is None:
+                            _zip_write(zip_f, path, arcname, zipfile.ZIP_STORED, digests)
+                        else:
+                            pipeline.call(lambda _, p=path, a=arcname: _zip_write(zip_f, p, a, zipfile.ZIP_STORED,
+                                                                                  digests))
+                    elif pipeline is None:
+                        _zip_write(zip_f, path, arcname, None, digests)
+                    else:
+                        _zip_add_parallel(zip_f, pipeline, path, arcname, level, digests)
+                if pipeline is not None:
+                    pipeline.flush()
+        else:
+            links = _LinkTable(inodes=False, dedupe=True) if dedupe else None  # tarfile links inodes itself
+            linked = 0
+            with contextlib.ExitStack() as stack:
+                # Tar output is written in stream mode, so paths, pipes and stdout behave the same
+                if is_stream:
+                    raw_f = output
+                else:
+                    raw_f = stack.enter_context(open(write_path, "r+b" if offset else "wb"))
+                    raw_f.truncate(offset)
+                    raw_f.seek(offset)
+                stream = _tar_compressor(raw_f, archive_format, level, pipeline, jobs)
+                if stream is not None:
+                    stack.callback(stream.close)
+                if journal is not None:
+                    # A journaled member must be on disk before its record: a crash then loses neither
+                    journal.before_flush = lambda: (raw_f.flush(), os.fsync(raw_f.fileno()))
+                    # Unwound after tar_f and before raw_f: the last records are written while it can be synced
+                    stack.callback(journal.release)
+                    tar_f = stack.enter_context(tarfile.open(fileobj=raw_f, mode='w'))  # starts at `offset`
+                else:
+                    tar_f = stack.enter_context(tarfile.open(fileobj=raw_f if stream is None else stream, mode='w|'))
+                for path, arcname in members:
+                    st = os.lstat(path) if links is not None or journal is not None else None
+                    start = tar_f.offset
+                    if links is not None and stat.S_ISREG(st.st_mode):
+                        primary, is_new = links.claim(path, arcname, st)
+                        if is_new:
+                            _tar_add(tar_f, path, arcname, digests)
+                            primary.finish(True)
+                        else:
+                            # Same content as an earlier member: store a hardlink member, no data
+                            tarinfo = tar_f.gettarinfo(path, arcname)
+                            tarinfo.type, tarinfo.linkname, tarinfo.size = tarfile.LNKTYPE, primary.path, 0
+                            tar_f.addfile(tarinfo)
+                            linked += 1
+                            if digests is not None and primary.path in digests:
+                                digests[arcname] = digests[primary.path]
+                    else:
+                        _tar_add(tar_f, path, arcname, digests)
+                    if journal is not None:
+                        journal.add({"a": arcname, "s": st.st_size, "m": st.st_mtime_ns, "h": start,
+                                     "e": tar_f.offset})
+            if linked:
+                host.print(f"{linked} duplicate files stored as hardlink members")
+            if is_stream:
+                output.flush()
+        if write_path is not output:
+            os.replace(write_path, output)
+        if digests is not None:
+            stats.digests = digests
+            if verify:
+                _verify_into(stats, str(output), digests, jobs, archive_format)
+                host.print(f"Verified {stats.verified} archived files: "
+                           f"{f'{len(stats.mismatches)} differ' if stats.mismatches else 'all match'}.")
+            if manifest and manifest is not True:
+                _write_manifest(manifest, digests)
+                host.print(f"Manifest of {len(digests)} files written to {manifest}")
+        finished = True
+        stats.finish()
+        if not is_stream:
+            stats.output_bytes = output.stat().st_size
+        if src.is_file():
+            host.print(f"Archived file {src} -> {output_name}")
+        else:
+            host.print(f"{'ZIP' if archive_format == 'zip' else 'TAR'} archive created at {output_name}: {stats}.")
+    except Exception as e:
+        stats.fail(output_name, str(e))
+        host.print(f"Failed to {'archive file' if src.is_file() else 'create archive'}: {str(e)}", True)
+        if journal is None and write_path is not output:
+            with contextlib.suppress(OSError):
+                os.unlink(write_path)  # nothing to continue from
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if journal is not None:
+            journal.close(finished)
+    return stats.finish()
+
+
+MANIFEST_ALGORITHM = "sha256"  # digest of --manifest and --verify; manifests read back with `sha256sum -c`
+VERIFY_READ_SIZE = 8 << 20  # bytes per read when a copy, an archive or a manifest target is checked
+VERIFY_BATCH = 64  # files per task of the verify process pool
+
+
+class _HashingReader:
+    """Read-only file wrapper that hashes what passes through it, so one read both writes and digests a file."""
+    __slots__ = ('f', 'hasher')
+
+    def __init__(self, f: BinaryIO):
+        import hashlib
+        self.f = f
+        self.hasher = hashlib.new(MANIFEST_ALGORITHM)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+def _hash_stream(f: BinaryIO) -> tuple[str, int]:
+    """(digest, size) of what is left to read in f."""
+    import hashlib
+    hasher = hashlib.new(MANIFEST_ALGORITHM)
+    size = 0
+    while chunk := f.read(VERIFY_READ_SIZE):
+        hasher.update(chunk)
+        size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+def _zip_write(zip_f: zipfile.ZipFile, path: str, arcname: str, compress_type: int | None = None,
+               digests: dict[str, str] | None = None) -> None:
+    """ZipFile.write() of a file; with `digests`, its digest is recorded from the same read."""
+    if digests is None:
+        zip_f.write(path, arcname, compress_type)
+        return
+    import shutil
+    import zipfile
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    zinfo.compress_type = zip_f.compression if compress_type is None else compress_type
+    zinfo._compresslevel = zip_f.compresslevel  # what ZipFile.write() sets
+    with open(path, "rb") as src, zip_f.open(zinfo, 'w') as dst:
+        reader = _HashingReader(src)
+        shutil.copyfileobj(reader, dst, COPY_BUFFER_SIZE)
+    digests[arcname] = reader.hexdigest()
+
+
+def _tar_add(tar_f: tarfile.TarFile, path: str, arcname: str, digests: dict[str, str] | None = None) -> None:
+    """TarFile.add() of a non-directory; with `digests`, a regular file's digest is recorded from the same read."""
+    if digests is None:
+        tar_f.add(path, arcname=arcname)
+        return
+    tarinfo = tar_f.gettarinfo(path, arcname)
+    if tarinfo is None:
+        return  # sockets and the like, which TarFile.add() skips as well
+    if tarinfo.isreg():
+        with open(path, "rb") as f:
+            reader = _HashingReader(f)
+            tar_f.addfile(tarinfo, reader)
+        digests[arcname] = reader.hexdigest()
+    else:
+        tar_f.addfile(tarinfo)
+        if tarinfo.islnk() and tarinfo.linkname in digests:
+            digests[arcname] = digests[tarinfo.linkname]  # a second name of an inode stored before
+
+
+def _tar_reader(fileobj: BinaryIO, archive_format: str | None) -> tarfile.TarFile:
+    """Stream-mode TarFile over an archive of any ARCHIVE_SUFFIXES tar format (zstd through _zstd_module())."""
+    import tarfile
+    if archive_format == "tzst":
+        zstd = _zstd_module()
+        if zstd.__name__ == "zstandard":
+            fileobj = zstd.ZstdDecompressor().stream_reader(fileobj)
+        else:
+            fileobj = zstd.ZstdFile(fileobj)
+        return tarfile.open(fileobj=fileobj, mode='r|')
+    return tarfile.open(fileobj=fileobj, mode='r|*')
+
+
+def _reader_format(path: Path, archive_format: str | None) -> str | None:
+    """
+    Format of the archive file at path: archive_format, else its suffix, else zip or tar by content.
+    None, reported, for a .tar.zst without a zstd module to read it.
+    """
+    import zipfile
+    archive_format = archive_format or _archive_format(path.name) or ("zip" if zipfile.is_zipfile(path) else "tar")
+    if archive_format == "tzst" and _zstd_module() is None:
+        host.print(".tar.zst archives need the optional 'zstandard' module (pip install zstandard)", True)
+        return None
+    return archive_format
+
+
+def _manifest_line(relpath: str, digest: str) -> str:
+    # GNU coreutils escaping: names with a backslash or a line break start the line with a backslash
+    if "\\" in relpath or "\n" in relpath or "\r" in relpath:
+        relpath = relpath.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r")
+        return f"\\{digest}  {relpath}\n"
+    return f"{digest}  {relpath}\n"
+
+
+def _write_manifest(path: Path | str, digests: dict[str, str]) -> None:
+    """Writes digests (relpath -> hex digest) as a sorted `sha256sum` file, replacing path atomically."""
+    path = Path(path)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+        f.writelines(_manifest_line(relpath, digests[relpath]) for relpath in sorted(digests))
+    os.replace(temp_path, path)
+
+
+def _read_manifest(path: Path | str) -> dict[str, str]:
+    """relpath -> hex digest of a `sha256sum` file (text or '*' binary lines, escaped names); ValueError if malformed."""
+    digests = {}
+    with open(path, "r", encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            escaped = line.startswith("\\")
+            digest, separator, relpath = line[escaped:].partition(" ")
+            if not separator or not relpath or len(relpath) < 2 or relpath[0] not in " *":
+                raise ValueError(f"{path}, line {number}: not a '<digest>  <path>' line")
+            relpath = relpath[1:]
+            if escaped:
+                relpath = re.sub(r"\\(.)", lambda match: {"n": "\n", "r": "\r"}.get(match[1], match[1]), relpath)
+            digests[relpath.removeprefix("./")] = digest.lower()
+    return digests
+
+
+def _mismatch(relpath: str, status: str, expected: str, actual: str | None = None, error: str | None = None) -> dict:
+    record = {"path": relpath, "status": status, "expected": expected, "actual": actual}
+    if error is not None:
+        record["error"] = error
+    return record
+
+
+def _verify_files(root: str, expected: list[tuple[str, str]]) -> tuple[int, int, list[dict]]:
+    """(files, bytes read, mismatch records) of files under root against their expected digests; a pool task."""
+    nbytes = 0
+    problems = []
+    for relpath, digest in expected:
+        try:
+            with open(os.path.join(root, *relpath.split("/")), "rb", buffering=0) as f:
+                actual, size = _hash_stream(f)
+        except FileNotFoundError:
+            problems.append(_mismatch(relpath, "missing", digest))
+            continue
+        except OSError as why:
+            problems.append(_mismatch(relpath, "unreadable", digest, error=str(why)))
+            continue
+        nbytes += size
+        if actual != digest:
+            problems.append(_mismatch(relpath, "mismatch", digest, actual))
+    return len(expected), nbytes, problems
+
+
+def _verify_zip(path: str, expected: list[tuple[str, str]]) -> tuple[int, int, list[dict]]:
+    """_verify_files() for the members of a zip archive; each pool task opens the archive itself."""
+    import zipfile
+    nbytes = 0
+    problems = []
+    with zipfile.ZipFile(path) as zip_f:
+        for name, digest in expected:
+            try:
+                with zip_f.open(name) as f:
+                    actual, size = _hash_stream(f)
+            except KeyError:
+                problems.append(_mismatch(name, "missing", digest))
+                continue
+            except (OSError, EOFError, zipfile.BadZipFile, zlib.error) as why:  # a bad CRC is a BadZipFile
+                problems.append(_mismatch(name, "unreadable", digest, error=str(why)))
+                continue
+            nbytes += size
+            if actual != digest:
+                problems.append(_mismatch(name, "mismatch", digest, actual))
+    return len(expected), nbytes, problems
+
+
+def _verify_tar(path: str, archive_format: str | None,
+                expected: list[tuple[str, str]]) -> tuple[int, int, list[dict]]:
+    """_verify_files() for the members of a tar archive, read once in order (compressed streams cannot be split)."""
+    wanted = dict(expected)
+    seen: dict[str, str] = {}  # member -> digest, for the hardlink members that name it later
+    nbytes = 0
+    problems = []
+    error = None
+    try:
+        with open(path, "rb") as raw_f, _tar_reader(raw_f, archive_format) as tar_f:
+            for member in _tar_members(tar_f):
+                if member.isreg():
+                    actual, size = _hash_stream(tar_f.extractfile(member))
+                    nbytes += size
+                elif member.islnk() and member.linkname in seen:
+                    actual = seen[member.linkname]
+                else:
+                    continue
+                seen[member.name] = actual
+                digest = wanted.pop(member.name, None)
+                if digest is not None and actual != digest:
+                    problems.append(_mismatch(member.name, "mismatch", digest, actual))
+    except Exception as why:  # truncated or corrupt: tarfile, zlib, lzma, bz2 and zstd all raise their own
+        error = str(why) or type(why).__name__
+    for name, digest in wanted.items():
+        problems.append(_mismatch(name, "unreadable" if error else "missing", digest, error=error))
+    return len(expected), nbytes, problems
+
+
+def _verify_into(stats: RunStats, target: str, digests: dict[str, str], jobs: int = 1,
+                 archive_format: str | None = None, counted: bool = False) -> None:
+    """
+    Reads target back (a directory, or an archive of archive_format) and records in stats every file
+    whose digest differs from `digests`. Directory files and zip members are checked in batches on a
+    process pool of `jobs` workers; with `counted`, the files and bytes read also count as stats.files.
+    """
+    items = sorted(digests.items())
+    if archive_format is None or archive_format == "zip":
+        worker = _verify_files if archive_format is None else _verify_zip
+        batches = [items[start:start + VERIFY_BATCH] for start in range(0, len(items), VERIFY_BATCH)]
+        if jobs > 1 and len(batches) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=jobs)
+            results = pool.map(worker, [target] * len(batches), batches)
+        else:
+            pool = None
+            results = (worker(target, batch) for batch in batches)
+    else:
+        pool = None
+        results = iter([_verify_tar(target, archive_format, items)])
+    stats.verified = stats.verified or 0
+    try:
+        for files, nbytes, problems in results:
+            stats.verified += files
+            for problem in problems:
+                problem["target"] = target
+                stats.mismatches.append(problem)
+                where = os.path.join(target, problem["path"])
+                stats.fail(where, problem.get("error") or f"{problem['status']} after verify")
+                host.print(f"Verify: {where} is {problem['status']}"
+                           + (f" ({problem['error']})" if "error" in problem else ""), True)
+            if counted:
+                stats.add(files, nbytes)
+            else:
+                host.progress(stats)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def verify_manifest(manifest: Path | str, target: Path | str, jobs: int = 1, archive_format: str | None = None,
+                    progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
+    manifest, target = Path(manifest), Path(target).resolve()
+    try:
+        digests = _read_manifest(manifest)
+    except (OSError, ValueError) as e:
+        host.print(f"Cannot read the manifest {manifest}: {e}", True)
+        return None
+    if target.is_dir():
+        archive_format = None
+    elif target.is_file():
+        archive_format = _reader_format(target, archive_format)
+        if archive_format is None:
+            return None
+    else:
+        host.print(f"Target {target} does not exist.", True)
+        return None
+
+    stats = RunStats("verify", manifest, target)
+    stats.on_progress = progress
+    try:
+        _verify_into(stats, str(target), digests, jobs, archive_format, counted=True)
+    except Exception as e:
+        stats.fail(target, str(e))
+        host.print(f"Failed to read {target}: {e}", True)
+    stats.finish()
+    differing = len(stats.mismatches)
+    host.print(f"Verified {stats.verified} files of {target} against {manifest}: "
+               f"{f'{differing} differ' if differing else 'all match'}. {stats}.")
+    return stats
+
+
+def _verify_failed(stats: RunStats | None) -> bool:
+    """Whether a verified run should exit with status 1: it did not run, a file differs or one failed."""
+    return stats is None or bool(stats.mismatches) or stats.errors > 0
+
+
+def _tar_members(tar_f: tarfile.TarFile) -> Iterator[tarfile.TarInfo]:
+    """Members of a stream-mode TarFile one at a time; the TarInfo list tarfile keeps of them is dropped as it grows."""
+    while (member := tar_f.next()) is not None:
+        tar_f.members.clear()
+        yield member
+
+
+def _tar_type(member: tarfile.TarInfo) -> str:
+    if member.isdir():
+        return "dir"
+    if member.issym():
+        return "symlink"
+    if member.islnk():
+        return "hardlink"
+    return "file" if member.isreg() else "other"
+
+
+def _kept_members(members: Iterable[tuple[str, bool, object]], ruleset: RuleSet,
+                  stats: RunStats | None = None) -> Iterator[tuple[str, bool, object]]:
+    """
+    (relpath, is_dir, member) of the (name, is_dir, member) archive members that pass the rules, in archive order.
+    Names are matched like the relpaths of a walk, ancestors included, without touching the filesystem.
+    With stats, an excluded member counts as skipped unless a directory above it is excluded already.
+    """
+    classifier = _Classifier(ruleset)
+    for name, is_dir, member in members:
+        relpath, _ = _classify_path(name)
+        if not relpath:
+            continue  # the "./" member of `tar -C dir .`
+        if not classifier.ignored(relpath, is_dir):
+            yield relpath, is_dir, member
+        elif stats is not None:
+            head, sep, _ = relpath.rpartition('/')
+            if classifier._directory(head + sep) is not None:
+                stats.add(skipped=1)
+
+
+def _member_path(target: str, relpath: str, name: str) -> str:
+    """Where a member is extracted in target; OSError for an absolute name or one that climbs out with '..'."""
+    parts = relpath.split("/")
+    if relpath.startswith("/") or os.path.splitdrive(relpath)[0] or ".." in parts:
+        raise OSError(errno.EINVAL, "Unsafe path in archive", name)
+    return os.path.join(target, *parts)
+
+
+def _clear_for(dst_path: str) -> None:
+    """Removes the file or symlink at dst_path before a member replaces it, so no member is written through a link."""
+    try:
+        st = os.lstat(dst_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISDIR(st.st_mode):
+        os.unlink(dst_path)
+
+
+def _extract_tar(path: str, archive_format: str, target: str, ruleset: RuleSet, stats: RunStats,
+                 dirs: list[tuple[str, int, float]]) -> None:
+    """Extracts the kept members of a tar archive, read once as a stream; directory attributes go to `dirs`."""
+    import posixpath
+    import tarfile
+    # The "data" filter (Python 3.12, backported to 3.8.17+) refuses links leaving target, devices and setuid bits
+    options = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    try:
+        with open(path, "rb") as raw_f, _tar_reader(raw_f, archive_format) as tar_f:
+            members = ((member.name, member.isdir(), member) for member in _tar_members(tar_f))
+            for relpath, is_dir, member in _kept_members(members, ruleset, stats):
+                dst_path = os.path.join(target, relpath.lstrip("/"))
+                try:
+                    dst_path = _member_path(target, relpath, member.name)
+                    if is_dir:
+                        os.makedirs(dst_path, exist_ok=True)
+                        dirs.append((dst_path, member.mode & 0o755, member.mtime))
+                        continue
+                    if member.issym():
+                        link = posixpath.normpath(posixpath.join(posixpath.dirname(relpath), member.linkname))
+                        if member.linkname.startswith("/") or link == ".." or link.startswith("../"):
+                            raise OSError(errno.EINVAL, "Unsafe link target in archive", member.linkname)
+                    _clear_for(dst_path)
+                    if member.islnk():
+                        # tarfile would look an unextracted link target up in the full member list, read to the end
+                        link_path = _member_path(target, _classify_path(member.linkname)[0], member.linkname)
+                        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                        os.link(link_path, dst_path, follow_symlinks=False)
+                    else:
+                        tar_f.extract(member, target, **options)
+                except (OSError, tarfile.TarError) as why:
+                    stats.fail(dst_path, str(why))
+                    continue
+                # A hardlink member holds no data of its own; its size is the file it now shares
+                stats.add(1, member.size if member.isreg() else
+                          os.lstat(dst_path).st_size if member.islnk() else 0)
+                host.debug(relpath)
+    except Exception as why:  # truncated or corrupt: tarfile, zlib, lzma, bz2 and zstd all raise their own
+        stats.fail(path, str(why) or type(why).__name__)
+
+
+def _extract_zip_member(zip_f: zipfile.ZipFile, info: zipfile.ZipInfo, dst_path: str, stats: RunStats) -> None:
+    """Writes one zip member to dst_path with its mode and mtime; a task of the extract thread pool."""
+    import shutil
+    try:
+        _clear_for(dst_path)
+        with zip_f.open(info) as src, open(dst_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+        mode = (info.external_attr >> 16) & 0o755
+        if mode:
+            os.chmod(dst_path, mode)
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        os.utime(dst_path, (mtime, mtime))
+    except Exception as why:  # bad CRC, truncated data, encryption or an unsupported compression method
+        stats.fail(dst_path, str(why) or type(why).__name__)
+        return
+    stats.add(1, info.file_size)
+    host.debug(info.filename)
+
+
+def _extract_zip(path: str, target: str, ruleset: RuleSet, stats: RunStats, dirs: list[tuple[str, int, float]],
+                 jobs: int = 1) -> None:
+    """
+    Extracts the kept members of a zip archive. Directories are created in member order, then the files
+    are written by a bounded pool of `jobs` threads, which read the archive through the same ZipFile.
+    """
+    import zipfile
+    try:
+        zip_f = zipfile.ZipFile(path)
+    except (OSError, zipfile.BadZipFile) as why:
+        stats.fail(path, str(why))
+        return
+    pool = None
+    if jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        pool = ThreadPoolExecutor(max_workers=jobs)
+    pending = set()
+    created: set[str] = set()
+    real_target = os.path.join(os.path.realpath(target), "")
+    try:
+        members = ((info.filename, info.is_dir(), info) for info in zip_f.infolist())
+        kept = list(_kept_members(members, ruleset, stats))
+        stats.expected_files = sum(not is_dir for _, is_dir, _ in kept)
+        for relpath, is_dir, info in kept:
+            dst_path = os.path.join(target, relpath.lstrip("/"))
+            try:
+                dst_path = _member_path(target, relpath, info.filename)
+                parent = dst_path if is_dir else os.path.dirname(dst_path)
+                if parent not in created:
+                    # A symlink already in target must not lead a member out of it
+                    if not os.path.join(os.path.realpath(parent), "").startswith(real_target):
+                        raise OSError(errno.EINVAL, "Path in archive leaves the target through a symlink",
+                                      info.filename)
+                    os.makedirs(parent, exist_ok=True)
+                    created.add(parent)
+                if is_dir:
+                    dirs.append((dst_path, (info.external_attr >> 16) & 0o755,
+                                 time.mktime(info.date_time + (0, 0, -1))))
+                    continue
+            except OSError as why:
+                stats.fail(dst_path, str(why))
+                continue
+            if pool is None:
+                _extract_zip_member(zip_f, info, dst_path, stats)
+                continue
+            if len(pending) >= jobs * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(pool.submit(_extract_zip_member, zip_f, info, dst_path, stats))
+        for future in pending:
+            future.result()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        zip_f.close()
+
+
+def extract_archive_with_ignore(archive: Path | str, target: Path | str, rules: list[tuple[str, bool]] | RuleSet,
+                                jobs: int = 1, archive_format: str | None = None,
+                                progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
+    archive, target = Path(archive).resolve(), Path(target).resolve()
+    if not archive.is_file():
+        host.print(f"Archive {archive} does not exist.", True)
+        return None
+    if target.exists() and not target.is_dir():
+        host.print(f"FileExistsError: {target} is a File instead of a Directory", True)
+        return None
+    archive_format = _reader_format(archive, archive_format)
+    if archive_format is None:
+        return None
+
+    # Member names never exist here before extraction: nested .cp_ignore files cannot be read
+    ruleset = RuleSet(rules, nested=None)
+    stats = RunStats("extract", archive, target)
+    stats.on_progress = progress
+    dirs: list[tuple[str, int, float]] = []
+    os.makedirs(target, exist_ok=True)
+    if archive_format == "zip":
+        _extract_zip(str(archive), str(target), ruleset, stats, dirs, jobs)
+    else:
+        _extract_tar(str(archive), archive_format, str(target), ruleset, stats, dirs)
+
+    # Directory modes and times are restored last, deepest first, since filling them changes them
+    for dst_dir, mode, mtime in sorted(dirs, key=lambda item: item[0], reverse=True):
+        try:
+            if mode:
+                os.chmod(dst_dir, mode)
+            os.utime(dst_dir, (mtime, mtime))
+        except OSError as why:
+            stats.fail(dst_dir, str(why))
+
+    stats.finish()
+    for dst_path, why in stats.failures:
+        host.print(f"Permission Denied: {dst_path}" if "Permission denied" in why else f"{dst_path}: {why}", True)
+    host.print(f"Extracted {archive} to {target}: {stats.files} files written, "
+               f"{stats.skipped} skipped by the rules. {stats}.")
+    return stats
+
+
+def list_archive_with_ignore(archive: Path | str, rules: list[tuple[str, bool]] | RuleSet,
+                             archive_format: str | None = None) -> Iterator[dict]:
+    import zipfile
+    archive = Path(archive).resolve()
+    if not archive.is_file():
+        host.print(f"Archive {archive} does not exist.", True)
+        return
+    archive_format = _reader_format(archive, archive_format)
+    if archive_format is None:
+        return
+    ruleset = RuleSet(rules, nested=None)
+    try:
+        if archive_format == "zip":
+            with zipfile.ZipFile(archive) as zip_f:
+                members = ((info.filename, info.is_dir(), info) for info in zip_f.infolist())
+                for relpath, is_dir, info in _kept_members(members, ruleset):
+                    yield {"path": relpath, "type": "dir" if is_dir else "file",
+                           "size": 0 if is_dir else info.file_size,
+                           "mtime": time.mktime(info.date_time + (0, 0, -1))}
+            return
+        with open(archive, "rb") as raw_f, _tar_reader(raw_f, archive_format) as tar_f:
+            sizes: dict[str, int] = {}  # file member -> size, since a hardlink member stores none of its own
+
+            def sized(members: Iterator[tarfile.TarInfo]) -> Iterator[tuple[str, bool, tarfile.TarInfo]]:
+                # Excluded members count too: a kept hardlink may name one
+                for member in members:
+                    if member.isreg():
+                        sizes[member.name] = member.size
+                    elif member.islnk():
+                        sizes[member.name] = sizes.get(member.linkname, 0)
+                    yield member.name, member.isdir(), member
+
+            for relpath, is_dir, member in _kept_members(sized(_tar_members(tar_f)), ruleset):
+                record = {"path": relpath, "type": _tar_type(member),
+                          "size": sizes.get(member.name, 0), "mtime": float(member.mtime)}
+                if member.issym() or member.islnk():
+                    record["link"] = member.linkname
+                yield record
+    except Exception as why:  # truncated or corrupt: the members read so far have been yielded
+        host.print(f"Failed to read {archive}: {str(why) or type(why).__name__}", True)
+
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK_SIZE = 1 << 20  # fixed chunk size, or average chunk size with content-defined chunking
+# Gear table of the content-defined chunker: one pseudo-random 64-bit value per byte, fixed forever
+# since changing it would move every chunk boundary and defeat deduplication against older snapshots
+_GEAR: tuple[int, ...] = ()
+
+
+def _gear_table() -> tuple[int, ...]:
+    global _GEAR
+    if not _GEAR:
+        import hashlib
+        _GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "little") for i in range(256))
+    return _GEAR
+
+
+def _cdc_cut(data: bytes, min_size: int, max_size: int, mask: int) -> int:
+    """Length of the first content-defined chunk of data: where the gear hash has the masked bits clear."""
+    end = min(len(data), max_size)
+    if end <= min_size:
+        return end
+    gear = _GEAR or _gear_table()
+    digest = 0
+    position = min_size
+    for byte in data[min_size:end]:
+        digest = ((digest << 1) + gear[byte]) & 0xFFFFFFFFFFFFFFFF
+        position += 1
+        if not digest & mask:
+            return position
+    return end
+
+
+def _iter_chunks(f: BinaryIO, chunk_size: int, cdc: bool = False) -> Iterator[bytes]:
+    if not cdc:
+        while chunk := f.read(chunk_size):
+            yield chunk
+        return
+    # FastCDC-style: boundaries follow the content, so an insertion only changes the chunks around it
+    min_size, max_size = chunk_size // 4, chunk_size * 4
+    bits = max(chunk_size.bit_length() - 1, 1)
+    mask = ((1 << bits) - 1) << (64 - bits)  # the high bits depend on the last 64 bytes
+    buffer = b""
+    while True:
+        if len(buffer) < max_size:
+            buffer += f.read(max_size - len(buffer))
+        if not buffer:
+            return
+        cut = _cdc_cut(buffer, min_size, max_size, mask)
+        yield buffer[:cut]
+        buffer = buffer[cut:]
+
+
+class _ChunkStore:
+    """
+    Directory holding snapshot data: chunks/ab/<sha256> (one file per unique chunk)
+    and snapshots/<name>.json (one manifest per snapshot).
+    """
+
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+        self.chunks = self.root / "chunks"
+        self.snapshots = self.root / "snapshots"
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.chunks / digest[:2] / digest
+
+    def put(self, data: bytes) -> tuple[str, bool]:
+        """Stores one chunk; returns (digest, whether it was new)."""
+        import hashlib
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if path.exists():
+            return digest, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return digest, True
+
+    def get(self, digest: str) -> bytes:
+        import hashlib
+        with open(self.chunk_path(digest), "rb") as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise OSError(errno.EIO, "Corrupt chunk in snapshot store", str(self.chunk_path(digest)))
+        return data
+
+    def manifest_path(self, name: str) -> Path:
+        if name == "latest":
+            manifests = sorted(self.snapshots.glob("*.json"), key=lambda path: path.stat().st_mtime_ns)
+            if not manifests:
+                raise FileNotFoundError(errno.ENOENT, "No snapshot in store", str(self.snapshots))
+            return manifests[-1]
+        return self.snapshots / f"{name}.json"
+
+    def previous(self, src: str) -> dict | None:
+        """Latest manifest of the same source, whose unchanged files need not be read again."""
+        if not self.snapshots.is_dir():
+            return None
+        for path in sorted(self.snapshots.glob("*.json"), key=lambda path: path.stat().st_mtime_ns, reverse=True):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if manifest.get("version") == SNAPSHOT_VERSION and manifest.get("src") == src:
+                return manifest
+        return None
+
+
+def create_snapshot(src: Path, store: Path, rules: list[tuple[str, bool]], name: str | None = None,
+                    chunk_size: int = SNAPSHOT_CHUNK_SIZE, cdc: bool = False, cache: bool = False) -> RunStats | None:
+    src = Path(src).resolve()
+    store = Path(store).resolve()
+    if not src.is_dir():
+        host.print(f"Source {src} must be a directory.", True)
+        return None
+    name = name or time.strftime("%Y%m%d-%H%M%S")
+    if not re.fullmatch(r"[\w.-]+", name) or name == "latest":
+        host.print(f"Invalid snapshot name '{name}'", True)
+        return None
+    if store.is_relative_to(src):
+        rules = rules + [(f"{store.relative_to(src).as_posix()}/", False)]  # Never snapshot the store itself
+
+    chunk_store = _ChunkStore(store)
+    manifest_path = chunk_store.manifest_path(name)
+    if manifest_path.exists():
+        host.print(f"Snapshot '{name}' already exists in {store}", True)
+        return None
+    previous = chunk_store.previous(str(src))
+    known = {}
+    # Chunk lists only carry over under the same chunking, or the new snapshot mixes two of them
+    if previous and previous.get("chunking") == {"cdc": cdc, "chunk_size": chunk_size}:
+        known = {entry["path"]: entry for entry in previous["entries"] if entry["type"] == "file"}
+
+    stats = RunStats("snapshot", src, manifest_path)
+    stats.output_bytes = 0  # bytes of new chunks added to the store
+    ruleset = RuleSet(rules)
+    scan_cache = ScanCache(src, ruleset) if cache else None
+    if scan_cache is not None:
+        stats.expected_files = scan_cache.files
+    entries = []
+    try:
+        for relpath, entry in walk_with_ignore(src, ruleset, follow_symlinks=False, cache=scan_cache,
+                                               on_skip=lambda count: stats.add(skipped=count)):
+            st = entry.stat(follow_symlinks=False)
+            record = {"path": relpath, "mode": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}
+            if entry.is_symlink():
+                record.update(type="symlink", target=os.readlink(entry.path))
+            elif entry.is_dir():
+                record.update(type="dir")
+            else:
+                record.update(type="file", size=st.st_size)
+                old = known.get(relpath)
+                if old is not None and (old["size"], old["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+                    record["chunks"] = old["chunks"]
+                    stats.add(unchanged=1)
+                else:
+                    digests = []
+                    with open(entry.path, "rb") as f:
+                        for chunk in _iter_chunks(f, chunk_size, cdc):
+                            digest, new = chunk_store.put(chunk)
+                            digests.append(digest)
+                            if new:
+                                stats.output_bytes += len(chunk)
+                    record["chunks"] = digests
+                    stats.add(1, st.st_size)
+                    host.debug(relpath)
+            entries.append(record)
+
+        chunk_store.snapshots.mkdir(parents=True, exist_ok=True)
+        temp_path = manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "name": name, "src": str(src),
+                       "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                       "chunking": {"cdc": cdc, "chunk_size": chunk_size}, "entries": entries},
+                      f, separators=(",", ":"))
+        os.replace(temp_path, manifest_path)
+        stats.finish()
+        host.print(f"Snapshot '{name}' of {src} saved in {store}: {stats.files} files read, "
+                   f"{stats.unchanged} unchanged, {_format_bytes(stats.output_bytes)} of new data.")
+    except OSError as e:
+        stats.fail(e.filename or store, str(e))
+        host.print(f"Failed to create snapshot: {str(e)}", True)
+    return stats.finish()
+
+
+def restore_snapshot(store: Path, name: str, target: Path) -> RunStats | None:
+    store = Path(store).resolve()
+    target = Path(target).resolve()
+    chunk_store = _ChunkStore(store)
+    try:
+        with open(chunk_store.manifest_path(name), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        host.print(f"Cannot read snapshot '{name}' from {store}: {str(e)}", True)
+        return None
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        host.print(f"Snapshot '{name}' has unsupported version {manifest.get('version')}", True)
+        return None
+
+    stats = RunStats("restore", manifest["src"], target)
+    stats.expected_files = sum(entry["type"] == "file" for entry in manifest["entries"])
+    errors: list[tuple[str, str, str]] = []
+    dirs: list[tuple[str, dict]] = [(str(target), None)]
+    os.makedirs(target, exist_ok=True)
+    for entry in manifest["entries"]:
+        parts = entry["path"].split("/")
+        dst_path = os.path.join(target, *parts)
+        try:
+            if ".." in parts or os.path.isabs(entry["path"]):
+                raise OSError(errno.EINVAL, "Unsafe path in snapshot manifest", entry["path"])
+            if entry["type"] == "dir":
+                os.makedirs(dst_path, exist_ok=True)
+                dirs.append((dst_path, entry))
+            elif entry["type"] == "symlink":
+                if os.path.lexists(dst_path):
+                    os.unlink(dst_path)
+                os.symlink(entry["target"], dst_path)
+            else:
+                try:
+                    st = os.stat(dst_path, follow_symlinks=False)
+                    if (stat.S_ISREG(st.st_mode) and st.st_size == entry["size"]
+                            and abs(st.st_mtime_ns - entry["mtime_ns"]) <= SYNC_MTIME_WINDOW * 1e9):
+                        stats.add(unchanged=1)
+                        continue
+                except FileNotFoundError:
+                    pass
+                with open(dst_path, "wb") as f:
+                    for digest in entry["chunks"]:
+                        f.write(chunk_store.get(digest))
+                os.chmod(dst_path, entry["mode"])
+                os.utime(dst_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                stats.add(1, entry["size"])
+                host.debug(entry["path"])
+        except OSError as why:
+            errors.append((entry["path"], dst_path, str(why)))
+
+    # Directory modes and times are restored last, deepest first, since filling them changes them
+    for dst_dir, entry in reversed(dirs):
+        if entry is None:
+            continue
+        try:
+            os.chmod(dst_dir, entry["mode"])
+            os.utime(dst_dir, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        except OSError as why:
+            errors.append((entry["path"], dst_dir, str(why)))
+
+    for _, dst_file, why in errors:
+        stats.fail(dst_file, why)
+    stats.finish()
+    for _, dst_file, why in errors:
+        host.print(f"Permission Denied: {dst_file}" if "Permission denied" in why else why, True)
+    if not errors:
+        host.print(f"Restored snapshot '{manifest['name']}' to {target}: {stats.files} files written, "
+                   f"{stats.unchanged} unchanged. {stats}.")
+    return stats
+
+
+PLAN_TOP_DIRS = 10  # largest directories reported by plan_with_ignore()
+
+
+def _rule_sources(rules: list[tuple[str, bool]]) -> list[tuple[str, list[int]]]:
+    """
+    Groups normalized rules back into the .cp_ignore lines they came from, as (line, rule indices):
+    load_ignore_rules() turns a slash-free pattern p into the pair ('**/p', 'p').
+    """
+    sources, i = [], 0
+    while i < len(rules):
+        pattern, include = rules[i]
+        line = ("!" if include else "") + pattern
+        if pattern.startswith("**/") and i + 1 < len(rules) and rules[i + 1] == (pattern[3:], include):
+            sources.append((("!" if include else "") + pattern[3:], [i, i + 1]))
+            i += 2
+        else:
+            sources.append((line, [i]))
+            i += 1
+    return sources
+
+
+def plan_with_ignore(src: Path, rules: list[tuple[str, bool]], follow_symlinks: bool = True,
+                     entries: bool = True, top: int = PLAN_TOP_DIRS) -> Iterator[dict]:
+    """
+    Dry run of a copy / archive of src: streams the filtered walk as JSON-ready records.
+    {"type": "dir"|"file", "path", "size"} per kept entry (unless entries=False), then "error" records,
+    the `top` "largest_dir" records (bytes of kept files below them), one "rule" record per .cp_ignore
+    line with the files / directories it decided and the directories it pruned unlisted (busiest first;
+    lines of nested ignore files carry their "source"), and a "summary".
+    Nothing is written and the scan cache is not used (cached directories hide the rule decisions).
+    """
+    src = Path(src).resolve()
+    if not src.is_dir():
+        yield {"type": "error", "path": str(src), "error": "Source must be a directory"}
+        return
+    ruleset = RuleSet(rules)
+    hits = [{"file": 0, "dir": 0, "pruned": 0} for _ in ruleset.rules]
+    nested: dict[tuple[str, RuleSet], list[dict[str, int]]] = {}  # hits of the nested ignore files, by file
+
+    def on_rule(relpath: str, kind: str, rule: int | tuple[str, RuleSet, int]) -> None:
+        if isinstance(rule, tuple):
+            source, layer, index = rule
+            counts = nested.get((source, layer))
+            if counts is None:
+                counts = nested[(source, layer)] = [{"file": 0, "dir": 0, "pruned": 0} for _ in layer.rules]
+            counts[index][kind] += 1
+        else:
+            hits[rule][kind] += 1
+
+    errors: list[OSError] = []
+    dirs: dict[str, list[int]] = {"": [0, 0]}  # relpath -> [files, bytes] below it
+    files = nbytes = 0
+    started = time.monotonic()
+    for relpath, entry in walk_with_ignore(src, ruleset, follow_symlinks, errors.append, on_rule=on_rule):
+        if entry.is_dir():
+            dirs[relpath] = [0, 0]
+            if entries:
+                yield {"type": "dir", "path": relpath}
+            continue
+        try:
+            size = entry.stat(follow_symlinks=follow_symlinks).st_size
+        except OSError as e:
+            errors.append(e)
+            continue
+        files += 1
+        nbytes += size
+        parent = relpath
+        while parent:
+            parent = parent.rpartition("/")[0]
+            totals = dirs[parent]
+            totals[0] += 1
+            totals[1] += size
+        if entries:
+            yield {"type": "file", "path": relpath, "size": size}
+
+    for error in errors:
+        yield {"type": "error", "path": error.filename, "error": error.strerror or str(error)}
+    largest = sorted((item for item in dirs.items() if item[0]), key=lambda item: item[1][1], reverse=True)
+    for relpath, (count, size) in largest[:top]:
+        yield {"type": "largest_dir", "path": relpath, "files": count, "bytes": size}
+    ignored = {"file": 0, "dir": 0, "pruned": 0}
+    rule_records = []
+    for source, layer, layer_hits in [(None, ruleset, hits)] + [(*key, value) for key, value in nested.items()]:
+        for line, indices in _rule_sources(layer.rules):
+            counts = {kind: sum(layer_hits[i][kind] for i in indices) for kind in ignored}
+            include = layer.rules[indices[0]][1]
+            if not include:
+                for kind in ignored:
+                    ignored[kind] += counts[kind]
+            record = {"type": "rule", "rule": line, "include": include,
+                      "files": counts["file"], "dirs": counts["dir"], "pruned": counts["pruned"]}
+            if source is not None:
+                record["source"] = source
+            rule_records.append(record)
+    # Busiest rules first; ties keep the .cp_ignore order
+    yield from sorted(rule_records, key=lambda record: record["files"] + record["dirs"] + record["pruned"],
+                      reverse=True)
+    yield {"type": "summary", "src": str(src), "files": files, "dirs": len(dirs) - 1, "bytes": nbytes,
+           "ignored_files": ignored["file"], "ignored_dirs": ignored["dir"], "pruned_dirs": ignored["pruned"],
+           "errors": len(errors), "seconds": round(time.monotonic() - started, 3)}
+
+
+def _print_plan(records: Iterator[dict]) -> None:
+    """Writes plan_with_ignore() records to stdout as NDJSON, one flushed line per record."""
+    for record in records:
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+ASYNC_WORKERS = 4  # threads of the executor shared by the async_* functions when none is given
+ASYNC_WALK_BATCH = 256  # entries handed from the walking thread to the event loop at a time
+ASYNC_WALK_BACKLOG = 8  # batches the walking thread may get ahead of the consumer
+_async_executor: ThreadPoolExecutor | None = None
+_async_executor_lock = threading.Lock()
+
+
+def _default_executor() -> ThreadPoolExecutor:
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _async_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="jh_cp")
+        return _async_executor
+
+
+class _Cancelled(BaseException):
+    """Unwinds the worker thread of a cancelled AsyncRun; not an Exception, so no error handler swallows it."""
+
+
+class AsyncRun:
+    """
+    A copy or archive running on an executor thread, as returned by async_copytree() and async_archive().
+    `await run` gives its RunStats; `async for event in run` yields progress and error events until it ends.
+    Cancelling the awaiting task, or cancel(), stops the worker at its next file or directory.
+    """
+
+    def __init__(self, function: Callable[[Callable[[RunStats], None]], RunStats | None],
+                 executor: ThreadPoolExecutor | None = None, interval: float = Host.PROGRESS_INTERVAL):
+        import asyncio
+        self._loop = asyncio.get_running_loop()
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._cancelled = threading.Event()
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._reported = 0.0
+        self._failures = 0  # stats.failures already sent as events
+        self._future = self._loop.run_in_executor(executor or _default_executor(), function, self._progress)
+        self._future.add_done_callback(self._done)
+
+    def _progress(self, stats: RunStats) -> None:
+        # RunStats.on_progress, on the worker threads
+        if self._cancelled.is_set():
+            raise _Cancelled()
+        now = time.monotonic()
+        with self._lock:
+            failures = stats.failures[self._failures:]
+            self._failures += len(failures)
+            if not failures and now - self._reported < self._interval:
+                return
+            self._reported = now
+        with contextlib.suppress(RuntimeError):  # the event loop is closed: nobody is listening any more
+            for event in self._stats_events(stats, failures, now - stats.started):
+                self._loop.call_soon_threadsafe(self._events.put_nowait, event)
+
+    @staticmethod
+    def _stats_events(stats: RunStats, failures: list[tuple[str, str]], seconds: float) -> list[dict]:
+        events = [{"type": "error", "path": path, "error": reason} for path, reason in failures]
+        events.append({"type": "progress", "files": stats.files, "bytes": stats.bytes, "unchanged": stats.unchanged,
+                       "skipped": stats.skipped, "errors": stats.errors, "seconds": round(seconds, 3)})
+        return events
+
+    def _done(self, future) -> None:
+        # On the event loop, after the events the worker queued: the final counts, not throttled, end the stream
+        stats = None
+        if not future.cancelled() and future.exception() is None:  # retrieved, so a run nobody awaits logs nothing
+            stats = future.result()
+        if stats is not None:
+            with self._lock:
+                failures = stats.failures[self._failures:]
+                self._failures += len(failures)
+            for event in self._stats_events(stats, failures, stats.elapsed or time.monotonic() - stats.started):
+                self._events.put_nowait(event)
+        self._events.put_nowait(None)
+
+    def cancel(self) -> None:
+        """Stops the run at its next file or directory; awaiting it then raises asyncio.CancelledError."""
+        self._cancelled.set()
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def __await__(self):
+        return self._result().__await__()
+
+    async def _result(self) -> RunStats:
+        import asyncio
+        try:
+            # Shielded: a cancelled awaiter stops the worker through the flag, and the run still ends cleanly
+            stats = await asyncio.shield(self._future)
+        except asyncio.CancelledError:
+            self._cancelled.set()
+            raise
+        except _Cancelled:
+            raise asyncio.CancelledError() from None
+        if stats is None:
+            raise ValueError("The run could not start; the reason was printed through host")
+        return stats
+
+    def __aiter__(self) -> AsyncRun:
+        return self
+
+    async def __anext__(self) -> dict:
+        import asyncio
+        try:
+            event = await self._events.get()
+        except asyncio.CancelledError:
+            self._cancelled.set()
+            raise
+        if event is None:
+            self._events.put_nowait(None)  # every later iteration ends as well
+            raise StopAsyncIteration
+        return event
+
+
+def async_copytree(src: Path, target: Path | list[Path], rules: list[tuple[str, bool]],
+                   create_subdir: bool = False, jobs: int = 1, sync: bool = False, checksum: bool = False,
+                   delete: bool = False, cache: bool = False, copy_mode: str = "auto", dedupe: bool = False,
+                   resume: bool = False, verify: bool = False, manifest: Path | str | bool | None = None,
+                   executor: ThreadPoolExecutor | None = None) -> AsyncRun:
+    rules = rules if isinstance(rules, RuleSet) else list(rules)
+    return AsyncRun(lambda progress: copytree_with_ignore(src, target, rules, create_subdir, jobs, sync, checksum,
+                                                          delete, cache, copy_mode, dedupe, resume, verify,
+                                                          manifest, progress),
+                    executor)
+
+
+def async_archive(src: Path, output: Path | BinaryIO, rules: list[tuple[str, bool]], jobs: int = 1,
+                  level: int | None = None, store_ext: list[str] | None = None, archive_format: str | None = None,
+                  cache: bool = False, dedupe: bool = False, resume: bool = False, verify: bool = False,
+                  manifest: Path | str | bool | None = None, executor: ThreadPoolExecutor | None = None) -> AsyncRun:
+    rules = rules if isinstance(rules, RuleSet) else list(rules)
+
+    def run(progress: Callable[[RunStats], None]) -> RunStats | None:
+        try:
+            return create_archive_with_ignore(src, output, rules, jobs, level, store_ext, archive_format,
+                                              cache, dedupe, resume, verify, manifest, progress)
+        except _Cancelled:
+            if not hasattr(output, "write") and not resume:
+                with contextlib.suppress(OSError):
+                    os.unlink(output)  # never leave a truncated archive behind
+            raise
+
+    return AsyncRun(run, executor)
+
+
+async def async_walk(src: Path | str, rules: list[tuple[str, bool]] | RuleSet, follow_symlinks: bool = True,
+                     onerror: Callable[[OSError], None] | None = None, cache: ScanCache | None = None,
+                     executor: ThreadPoolExecutor | None = None) -> AsyncIterator[tuple[str, os.DirEntry]]:
+    import asyncio
+    loop = asyncio.get_running_loop()
+    batches: asyncio.Queue = asyncio.Queue()
+    slots = threading.Semaphore(ASYNC_WALK_BACKLOG)  # the walk waits for the consumer beyond this backlog
+    stop = threading.Event()
+
+    def send(item) -> bool:
+        while not slots.acquire(timeout=0.1):
+            if stop.is_set():
+                return False
+        with contextlib.suppress(RuntimeError):  # the event loop is closed
+            loop.call_soon_threadsafe(batches.put_nowait, item)
+        return not stop.is_set()
+
+    def produce() -> None:
+        batch = []
+        try:
+            for item in walk_with_ignore(src, rules, follow_symlinks, onerror, cache):
+                batch.append(item)
+                if len(batch) == ASYNC_WALK_BATCH:
+                    if not send(batch):
+                        return
+                    batch = []
+            if send(batch):
+                send(None)
+        except Exception as error:
+            send(error)
+
+    producer = loop.run_in_executor(executor or _default_executor(), produce)
+    try:
+        while (batch := await batches.get()) is not None:
+            slots.release()
+            if isinstance(batch, Exception):
+                raise batch
+            for item in batch:
+                yield item
+        await producer
+    finally:
+        stop.set()  # the consumer stopped early, was cancelled or failed: end the walk too
+
+
+def handle_cp_ignore(args: argparse.Namespace) -> None:
+    """Handles the cp_ignore subcommand to manage the .cp_ignore file."""
+    import shutil
+    cp_ignore_path = Path(os.path.dirname(os.path.abspath(__file__))) / CP_IGNORE_DEFAULT
+
+    if args.register:
+        with open(cp_ignore_path, "a") as f:
+            for pattern in args.register:
+                f.write(f"!{pattern}\n")
+        host.print(f"Registered {[f'!{p}' for p in args.register]} in {cp_ignore_path}")
+
+    elif args.ignore:
+        with open(cp_ignore_path, "a") as f:
+            for pattern in args.ignore:
+                f.write(f"{pattern}\n")
+        host.print(f"Ignored {args.ignore} in {cp_ignore_path}")
+
+    elif args.export:
+        shutil.copy(cp_ignore_path, args.export)
+        host.print(f"Exported ignore rules to {args.export}")
+
+    elif args.reset:
+        with open(cp_ignore_path, "w") as f:
+            f.writelines(f"{rule}\n" for rule in DEFAULT_IGNORE_RULES)
+        host.print(f"Reset {cp_ignore_path} to default rules.")
+
+    elif args.nano:
+        # Check if Unix-like system (macOS, BSD, Linux, etc.)
+        if host.system in ['Darwin', 'FreeBSD', 'NetBSD', 'OpenBSD', 'Linux']:
+            os.system(f"nano {cp_ignore_path}")
+        else:
+            host.print(f"Nano might not be available on your system. "
+                       f"Please edit {cp_ignore_path} manually.")
+    else:
+        host.print("No valid action specified for cp_ignore.")
+
+
+TREE_OPEN_LISTINGS = 64  # directories `tree --no-sort` streams at once; deeper ones are read ahead into memory
+
+
+class _TreeLevel:
+    """One open directory of _tree_lines() or _archive_tree_lines(): its listing, read one entry ahead, and totals."""
+    __slots__ = ('directory', 'rel_prefix', 'indent', 'depth', 'scope', 'entries', 'pending',
+                 'files', 'nbytes', 'more', 'more_files', 'more_bytes')
+
+    def __init__(self, directory: str, rel_prefix: str, indent: str, depth: int, scope: _Scope | _Layers | None):
+        self.directory = directory
+        self.rel_prefix = rel_prefix
+        self.indent = indent
+        self.depth = depth
+        self.scope = scope
+        self.entries: Iterator[tuple[str, os.DirEntry, bool]] = iter(())
+        self.pending: tuple[str, os.DirEntry, bool] | None = None
+        self.files = self.nbytes = 0  # drawn entries, with --du
+        self.more = self.more_files = self.more_bytes = 0  # entries past max_entries
+
+
+def _tree_lines(root: str, ruleset: RuleSet, cache: ScanCache | None = None, max_depth: int | None = None,
+                sort: bool = True, max_entries: int | None = None,
+                du: bool = False) -> Iterator[tuple[str, bool]]:
+    """
+    (line, is_error) of the tree below root, drawn with an explicit stack of open directories.
+    Without `sort` each directory is streamed from os.scandir(); with it, a directory's entries are sorted,
+    and only the first `max_entries` of them are held. Entries past `max_entries` become a "... N more" line.
+    With `du` the kept files and bytes are totalled in the same pass: a drawn directory ends with its total,
+    and one that is not drawn (past max_depth or max_entries) is walked for its size without drawing it.
+    """
+    import bisect
+    errors: list[str] = []
+
+    def unreadable(directory: str, error: OSError) -> None:
+        if isinstance(error, PermissionError):
+            errors.append(f"Permission denied: {directory}")
+        else:
+            errors.append(f"Cannot read {directory}: {error.strerror or error}")
+
+    def looped(entry: os.DirEntry, directory: str) -> bool:
+        """A symlink to the directory holding it, or to one of its parents."""
+        if not entry.is_symlink():
+            return False
+        target = os.path.realpath(entry.path).rstrip(os.sep) + os.sep
+        return (os.path.realpath(directory) + os.sep).startswith(target)
+
+    def size(relpath: str, entry: os.DirEntry, is_dir: bool, parent: _Scope | _Layers) -> tuple[int, int]:
+        """(files, bytes) kept in one entry: the whole filtered subtree of a directory."""
+        if not is_dir:
+            with contextlib.suppress(OSError):
+                return 1, entry.stat().st_size
+            return 1, 0
+        files = nbytes = 0
+        stack = [(entry.path, relpath + "/", parent)]
+        while stack:
+            directory, prefix, parent = stack.pop()
+            try:
+                scope = ruleset._enter(directory, prefix, parent)
+                for relpath, entry, is_dir in _scan_dir(directory, prefix, ruleset, cache, scope):
+                    if not is_dir:
+                        files += 1
+                        with contextlib.suppress(OSError):
+                            nbytes += entry.stat().st_size
+                    elif not looped(entry, directory):
+                        stack.append((entry.path, relpath + "/", scope))
+            except OSError as error:
+                unreadable(directory, error)
+        return files, nbytes
+
+    def order(item: tuple[str, os.DirEntry, bool]) -> tuple[bool, str]:
+        return not item[2], item[1].name.lower()  # directories first, then by name
+
+    def listing(level: _TreeLevel) -> Iterator[tuple[str, os.DirEntry, bool]]:
+        """The entries of level to draw; the others are counted (and sized) into level.more."""
+        def hide(relpath: str, entry: os.DirEntry, is_dir: bool) -> None:
+            level.more += 1
+            if du and not (is_dir and looped(entry, level.directory)):
+                files, nbytes = size(relpath, entry, is_dir, level.scope)
+                level.more_files += files
+                level.more_bytes += nbytes
+
+        entries = _scan_dir(level.directory, level.rel_prefix, ruleset, cache, level.scope)
+        if not sort:
+            try:
+                for index, item in enumerate(entries):
+                    if max_entries is not None and index >= max_entries:
+                        hide(*item)
+                    else:
+                        yield item
+            except OSError as error:
+                unreadable(level.directory, error)
+            return
+        kept: list = []
+        try:
+            if max_entries is None:
+                kept = sorted(entries, key=order)
+            else:
+                for index, item in enumerate(entries):
+                    bisect.insort(kept, (order(item), index, item))
+                    if len(kept) > max_entries:
+                        hide(*kept.pop()[2])
+                kept = [item for _, _, item in kept]
+        except OSError as error:
+            unreadable(level.directory, error)
+        yield from kept
+
+    def open_level(directory: str, rel_prefix: str, indent: str, depth: int,
+                   parent: _Scope | _Layers | None) -> _TreeLevel:
+        try:
+            scope = ruleset._enter(directory, rel_prefix, parent)
+        except OSError as error:
+            unreadable(directory, error)
+            return _TreeLevel(directory, rel_prefix, indent, depth, parent)  # drawn empty
+        level = _TreeLevel(directory, rel_prefix, indent, depth, scope)
+        level.entries = listing(level)
+        level.pending = next(level.entries, None)
+        return level
+
+    def totals(files: int, nbytes: int) -> str:
+        return f"{files} files, {_format_bytes(nbytes)}"
+
+    stack = [open_level(root, "", "", 0, None)]
+    while stack:
+        while errors:
+            yield errors.pop(0), True
+        level = stack[-1]
+        if level.pending is None:
+            stack.pop()
+            tail = []
+            if level.more:
+                tail.append(f"... {level.more} more" + (f" ({totals(level.more_files, level.more_bytes)})"
+                                                        if du else ""))
+            if du:
+                files, nbytes = level.files + level.more_files, level.nbytes + level.more_bytes
+                tail.append(f"[{totals(files, nbytes)}]")
+                if stack:
+                    stack[-1].files += files
+                    stack[-1].nbytes += nbytes
+            for index, text in enumerate(tail):
+                yield f"{level.indent}{'└── ' if index == len(tail) - 1 else '├── '}{text}", False
+            continue
+
+        relpath, entry, is_dir = level.pending
+        level.pending = next(level.entries, None)
+        is_last = level.pending is None and not level.more and not du
+        name = entry.name + "/" if is_dir else entry.name
+        expand = is_dir and (max_depth is None or level.depth < max_depth) and not looped(entry, level.directory)
+        if du and not expand:
+            files, nbytes = (0, 0) if is_dir and looped(entry, level.directory) else \
+                size(relpath, entry, is_dir, level.scope)
+            level.files += files
+            level.nbytes += nbytes
+            name += f"  ({totals(files, nbytes)})" if is_dir else f"  ({_format_bytes(nbytes)})"
+        yield f"{level.indent}{'└── ' if is_last else '├── '}{name}", False
+        if expand:
+            if not sort and len(stack) >= TREE_OPEN_LISTINGS:
+                level.entries = iter(list(level.entries))  # closes this os.scandir() before going deeper
+            stack.append(open_level(entry.path, relpath + "/", level.indent + ("    " if is_last else "│   "),
+                                    level.depth + 1, level.scope))
+    while errors:
+        yield errors.pop(0), True
+
+
+def _archive_tree_lines(records: Iterable[dict], max_depth: int | None = None, sort: bool = True,
+                        max_entries: int | None = None, du: bool = False) -> Iterator[str]:
+    """
+    The lines of _tree_lines() for the records of list_archive_with_ignore(). Archives list their members
+    in any order and may leave parent directories out, so the names are gathered into a tree first;
+    without `sort` each directory keeps the order its entries first appear in.
+    """
+    root: dict[str, list] = {}  # name -> [is_dir, size, children]
+    for record in records:
+        children = root
+        *parents, name = record["path"].split("/")
+        for part in parents:
+            node = children.get(part)
+            if node is None or not node[0]:
+                node = children[part] = [True, 0, {}]
+            children = node[2]
+        if record["type"] != "dir":
+            children[name] = [False, record["size"], None]
+        elif name not in children or not children[name][0]:
+            children[name] = [True, 0, {}]
+
+    def size(node: list) -> tuple[int, int]:
+        """(files, bytes) below one node."""
+        if not node[0]:
+            return 1, node[1]
+        files = nbytes = 0
+        stack = [node[2]]
+        while stack:
+            for is_dir, file_size, children in stack.pop().values():
+                if is_dir:
+                    stack.append(children)
+                else:
+                    files += 1
+                    nbytes += file_size
+        return files, nbytes
+
+    def open_level(children: dict[str, list], indent: str, depth: int) -> _TreeLevel:
+        level = _TreeLevel("", "", indent, depth, None)
+        items = list(children.items())
+        if sort:
+            items.sort(key=lambda item: (not item[1][0], item[0].lower()))  # directories first, then by name
+        if max_entries is not None:
+            for _, node in items[max_entries:]:
+                level.more += 1
+                if du:
+                    files, nbytes = size(node)
+                    level.more_files += files
+                    level.more_bytes += nbytes
+            items = items[:max_entries]
+        level.entries = iter(items)
+        level.pending = next(level.entries, None)
+        return level
+
+    def totals(files: int, nbytes: int) -> str:
+        return f"{files} files, {_format_bytes(nbytes)}"
+
+    stack = [open_level(root, "", 0)]
+    while stack:
+        level = stack[-1]
+        if level.pending is None:
+            stack.pop()
+            tail = []
+            if level.more:
+                tail.append(f"... {level.more} more" + (f" ({totals(level.more_files, level.more_bytes)})"
+                                                        if du else ""))
+            if du:
+                files, nbytes = level.files + level.more_files, level.nbytes + level.more_bytes
+                tail.append(f"[{totals(files, nbytes)}]")
+                if stack:
+                    stack[-1].files += files
+                    stack[-1].nbytes += nbytes
+            for index, text in enumerate(tail):
+                yield f"{level.indent}{'└── ' if index == len(tail) - 1 else '├── '}{text}"
+            continue
+
+        name, node = level.pending
+        level.pending = next(level.entries, None)
+        is_last = level.pending is None and not level.more and not du
+        is_dir = node[0]
+        expand = is_dir and (max_depth is None or level.depth < max_depth)
+        if is_dir:
+            name += "/"
+        if du and not expand:
+            files, nbytes = size(node)
+            level.files += files
+            level.nbytes += nbytes
+            name += f"  ({totals(files, nbytes)})" if is_dir else f"  ({_format_bytes(nbytes)})"
+        yield f"{level.indent}{'└── ' if is_last else '├── '}{name}"
+        if expand:
+            stack.append(open_level(node[2], level.indent + ("    " if is_last else "│   "), level.depth + 1))
+
+
+def draw_tree_with_ignore(src: Path, rules: list[tuple[str, bool]], max_depth: int | None = None,
+                          cache: bool = False, sort: bool = True, max_entries: int | None = None,
+                          du: bool = False, archive_format: str | None = None) -> None:
+    """
+    Draws the directory tree structure while applying "ignore rules".
+    Matching logic identical to copytree_with_ignore(); an archive is drawn from its member names.
+    """
+    src = Path(src).resolve()
+    if not src.exists():
+        host.print(f"Source {src} does not exist.", True)
+        return
+    if src.is_file():
+        records = list_archive_with_ignore(src, rules, archive_format)
+        host.print(src.name + "/")
+        for line in _archive_tree_lines(records, max_depth, sort, max_entries, du):
+            host.print(line)
+        return
+    if not src.is_dir():
+        host.print(f"Source {src} must be a directory or an archive.", True)
+        return
+
+    ruleset = RuleSet(rules)
+    scan_cache = ScanCache(src, ruleset) if cache else None
+    host.print(src.name + "/")
+    for line, is_error in _tree_lines(str(src), ruleset, scan_cache, max_depth, sort, max_entries, du):
+        host.print(line, is_error)
+    if scan_cache is not None:
+        scan_cache.save()
+
+
+def load_exclude_rules() -> dict[str, list[str]]:
+    """Load exclusion rules from the INI File"""
+    import configparser
+    exclude_rules = {}
+    rules_path = Path(os.path.dirname(os.path.abspath(__file__))) / EXCLUDE_RULES_INI
+    config = configparser.ConfigParser()
+
+    if os.path.exists(rules_path):
+        config.read(rules_path)
+
+        # Get exclude-zip, exclude-log, and exclude-db rules
+        for section in ['exclude-zip', 'exclude-log', 'exclude-db']:
+            if config.has_section(section):
+                patterns = config.get(section, 'patterns', fallback='').split(',')
+                exclude_rules[section] = [pattern.strip() for pattern in patterns if pattern.strip()]
+
+    return exclude_rules
+
+
+CLI_COMMANDS = ("cp", "watch", "archive", "verify", "extract", "ls", "snapshot", "restore", "plan", "filter",
+                "cp_ignore", "tree")
+
+
+RULES_CACHE_VERSION = 1
+RULES_CACHE_ENTRIES = 32  # ignore file / exclude group combinations remembered
+
+
+def _file_stamp(path: Path) -> list:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [str(path), None, None]
+    return [str(path), st.st_mtime_ns, st.st_size]
+
+
+def _cli_rule_files(args: argparse.Namespace) -> tuple[Path, list[str]]:
+    """The ignore file and the exclude-rules.ini groups selected by a command's -ignore / --exclude-* arguments."""
+    groups = [group for group, flag in (('exclude-zip', args.exclude_zip), ('exclude-log', args.exclude_log),
+                                        ('exclude-db', args.exclude_db)) if flag]
+    package_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+    return (Path(args.ignore).absolute() if args.ignore else package_dir / CP_IGNORE_DEFAULT), groups
+
+
+def _cli_rules(args: argparse.Namespace) -> list[tuple[str, bool]] | RuleSet:
+    """
+    The rules a walking command uses: the list from _cli_rule_list(), which RuleSet builds with nested
+    .cp_ignore discovery, or with --no-nested a RuleSet that does not look for nested files.
+    """
+    rules = _cli_rule_list(args)
+    return RuleSet(rules, nested=None) if args.no_nested else rules
+
+
+def _cli_rule_list(args: argparse.Namespace) -> list[tuple[str, bool]]:
+    """
+    Normalized rules for a command's -ignore / --exclude-* arguments.
+    They are kept in rules.json next to the scan caches, keyed by the ignore file and the exclude groups
+    and checked against the size and mtime of both files, so most runs neither parse .cp_ignore
+    nor import configparser for exclude-rules.ini.
+    """
+    ignore_path, groups = _cli_rule_files(args)
+    package_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+    stamps = [_file_stamp(ignore_path)] + ([_file_stamp(package_dir / EXCLUDE_RULES_INI)] if groups else [])
+    key = "\0".join([str(ignore_path)] + groups)
+    cache_path = _cache_dir() / "rules.json"
+
+    entries = {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == RULES_CACHE_VERSION:
+            entries = data["entries"]
+            entry = entries.get(key)
+            if entry is not None and entry["stamps"] == stamps:
+                return [(pattern, is_include) for pattern, is_include in entry["rules"]]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        entries = {}  # Missing or unreadable: rebuild it
+
+    additional_rules = []
+    if groups:
+        exclude_rules = load_exclude_rules()
+        for group in groups:
+            additional_rules.extend(exclude_rules.get(group, []))
+    rules = load_ignore_rules(ignore_path, additional_rules)
+
+    # A file edited within the mtime granularity could change again without changing its stamp
+    if all(mtime is None or time.time_ns() - mtime >= _RACY_WINDOW_NS for _, mtime, _ in stamps):
+        entries.pop(key, None)
+        entries[key] = {"stamps": stamps, "rules": rules}
+        while len(entries) > RULES_CACHE_ENTRIES:
+            del entries[next(iter(entries))]
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": RULES_CACHE_VERSION, "entries": entries}, f, separators=(",", ":"))
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+    return rules
+
+
+PROFILE_TOP = 25  # functions (cProfile) or allocation sites (tracemalloc) printed by --profile / --profile-memory
+
+
+def _profile_run(profile_path: str | None, memory: bool, function: Callable[[], None]) -> None:
+    """Runs function under cProfile and/or tracemalloc, then reports on stderr (stdout stays the command's)."""
+    profiler = None
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        function()
+    finally:
+        if profiler is not None:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"Profile written to {profile_path}", file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"Peak traced memory: {_format_bytes(peak)}", file=sys.stderr)
+            for statistic in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                print(f"  {statistic}", file=sys.stderr)
+
+
+def jh_cp_main(argv: list[bytes] = None) -> None:
+    """Main function to execute the jh_cp command."""
+    import argparse
+    parser = argparse.ArgumentParser(description="jh_cp script with ignore functionality")
+    subparsers = parser.add_subparsers(dest="command")
+    parser.add_argument("--profile", type=str, metavar="FILE",
+                        help="Run the command under cProfile: write the stats to FILE (for pstats/snakeviz) "
+                             f"and print the {PROFILE_TOP} costliest calls to stderr")
+    parser.add_argument("--profile-memory", action='store_true',
+                        help=f"Trace allocations with tracemalloc; print the peak and the {PROFILE_TOP} "
+                             "largest allocation sites to stderr")
+    if argv is None:
+        argv = sys.argv[1:]
+    # The profiling options come before the command; what follows them is run again, profiled
+    rest = list(argv)
+    while rest and rest[0].startswith("--profile"):
+        rest = rest[2:] if rest[0] == "--profile" else rest[1:]
+    # Only the invoked command's parser is built; -h and unknown commands get all of them
+    command = rest[0] if rest and rest[0] in CLI_COMMANDS else None
+
+    def wanted(name: str) -> bool:
+        return command is None or command == name
+
+    # jh_cp command for file copying
+    if wanted("cp"):
+        cp_parser = subparsers.add_parser("cp", help="Copy files or directories with ignore rules")
+        cp_parser.add_argument("paths", type=str, nargs="+", metavar="path",
+                               help="Source path(s) [Directory / File], then the Target path [Directory] "
+                                    "unless --to is given")
+        cp_parser.add_argument("--to", type=str, action='append', metavar="DIR",
+                               help="Target directory; repeat it to copy to several targets, reading each file once")
+        cp_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        cp_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        cp_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        cp_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        cp_parser.add_argument("--no-nested", action='store_true',
+                               help="Ignore .cp_ignore files found inside the source tree")
+        cp_parser.add_argument("--no-cache", action='store_true',
+                               help="Do not read or update the directory scan cache (on by default, kept in "
+                                    "$JH_CP_CACHE_DIR or ~/.cache/jh_cp)")
+        cp_parser.add_argument("--create-subdir", action='store_true',
+                               help="Create a subdirectory with the same name as the source")
+        cp_parser.add_argument("--jobs", type=int, default=1,
+                               help="Number of files copied concurrently (default 1, sequential)")
+        cp_parser.add_argument("--sync", action='store_true',
+                               help="Only copy files whose size or mtime differ from the target copy")
+        cp_parser.add_argument("--checksum", action='store_true',
+                               help="With --sync, compare file contents (SHA-256) instead of mtimes")
+        cp_parser.add_argument("--delete", action='store_true',
+                               help="Remove target files that are gone or ignored in the source")
+        cp_parser.add_argument("--copy-mode", choices=COPY_MODES, default="auto",
+                               help="How file data is copied: auto (reflink, then kernel copy, then buffered), "
+                                    "reflink (CoW clones only), kernel (copy_file_range/sendfile) or buffered")
+        cp_parser.add_argument("--dedupe", action='store_true',
+                               help="Hardlink files with identical content in the target (size, then SHA-256)")
+        cp_parser.add_argument("--resume", action='store_true',
+                               help="Copy through temporary names and keep a journal; running the same command "
+                                    "again after an interruption skips the finished files")
+        cp_parser.add_argument("--verify", action='store_true',
+                               help="Read every copied file back and compare it with the SHA-256 taken while "
+                                    "copying it; exit with status 1 if any file differs or fails")
+        cp_parser.add_argument("--manifest", type=str, metavar="FILE",
+                               help="Write the SHA-256 of every copied file to FILE, in sha256sum format with "
+                                    "paths relative to the target (see 'verify')")
+        cp_parser.add_argument("--dry-run", action='store_true',
+                               help="Copy nothing; print the plan (see 'plan') as NDJSON instead")
+        cp_parser.add_argument("-q", "--quiet", action='store_true', help="Only print errors")
+        cp_parser.add_argument("-v", "--verbose", action='store_true', help="Also print every copied file")
+        cp_parser.add_argument("--json", action='store_true',
+                               help="Print a JSON summary on stdout (other messages go to stderr)")
+
+    # watch command: initial copy, then mirror every change
+    if wanted("watch"):
+        watch_parser = subparsers.add_parser("watch", help="Copy a directory, then keep mirroring its changes")
+        watch_parser.add_argument("src", type=str, help="Source directory to watch")
+        watch_parser.add_argument("target", type=str, help="Target directory kept in sync")
+        watch_parser.add_argument("-ignore", type=str, help="Custom ignore file path (reloaded when edited)")
+        watch_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        watch_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        watch_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        watch_parser.add_argument("--no-nested", action='store_true',
+                                  help="Ignore .cp_ignore files found inside the source tree")
+        watch_parser.add_argument("--no-cache", action='store_true',
+                                  help="Do not read or update the directory scan cache (on by default, kept in "
+                                       "$JH_CP_CACHE_DIR or ~/.cache/jh_cp)")
+        watch_parser.add_argument("--delete", action='store_true',
+                                  help="Also remove target files that are gone or ignored in the source "
+                                       "when the whole tree is synced (start, rule reload)")
+        watch_parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE, metavar="SECONDS",
+                                  help=f"Quiet time before changes are applied (default {WATCH_DEBOUNCE})")
+        watch_parser.add_argument("--poll", type=float, nargs="?", const=WATCH_POLL_INTERVAL, default=None,
+                                  metavar="SECONDS", help="Rescan every SECONDS instead of using inotify "
+                                                          f"(default {WATCH_POLL_INTERVAL})")
+        watch_parser.add_argument("--copy-mode", choices=COPY_MODES, default="auto",
+                                  help="How file data is copied (see 'cp')")
+        watch_parser.add_argument("-q", "--quiet", action='store_true', help="Only print errors")
+        watch_parser.add_argument("-v", "--verbose", action='store_true', help="Also print every copied file")
+        watch_parser.add_argument("--json", action='store_true',
+                                  help="Print a JSON summary on stdout when stopped (other messages go to stderr)")
+
+    # archive command for creating compressed archives
+    if wanted("archive"):
+        archive_parser = subparsers.add_parser("archive", help="Create an archive with ignore rules")
+        archive_parser.add_argument("src", type=str, help="Source directory to archive")
+        archive_parser.add_argument("output", type=str,
+                                    help="Output archive file path (with .zip/.tar/.tar.gz), or '-' for stdout")
+        archive_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        archive_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        archive_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        archive_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        archive_parser.add_argument("--no-nested", action='store_true',
+                                    help="Ignore .cp_ignore files found inside the source tree")
+        archive_parser.add_argument("--no-cache", action='store_true',
+                                    help="Do not read or update the directory scan cache (on by default, kept in "
+                                         "$JH_CP_CACHE_DIR or ~/.cache/jh_cp)")
+        archive_parser.add_argument("--jobs", type=int, default=1,
+                                    help="Number of compression threads for .zip, .tar.gz and .tar.zst (default 1)")
+        archive_parser.add_argument("--level", type=int, default=None,
+                                    help="Compression level (zip/gz 0-9, bz2 1-9, xz 0-9, zst 1-22)")
+        archive_parser.add_argument("--format", choices=ARCHIVE_FORMATS, default=None,
+                                    help="Archive format, instead of guessing from the output suffix "
+                                         "(required for '-')")
+        archive_parser.add_argument("--store-ext", nargs="+", default=None, metavar="EXT",
+                                    help="Extra extensions stored in zip archives without compression")
+        archive_parser.add_argument("--dedupe", action='store_true',
+                                    help="Store files with identical content once, as tar hardlink members")
+        archive_parser.add_argument("--resume", action='store_true',
+                                    help="Write through a temporary name and keep a journal; running the same "
+                                         "command again continues an interrupted .tar after its last member")
+        archive_parser.add_argument("--verify", action='store_true',
+                                    help="Read the finished archive back and compare every member with the SHA-256 "
+                                         "taken while archiving it; exit with status 1 if any member differs or "
+                                         "fails")
+        archive_parser.add_argument("--manifest", type=str, metavar="FILE",
+                                    help="Write the SHA-256 of every archived file to FILE, in sha256sum format "
+                                         "with member paths (see 'verify')")
+        archive_parser.add_argument("--dry-run", action='store_true',
+                                    help="Write nothing; print the plan (see 'plan') as NDJSON instead")
+        archive_parser.add_argument("-q", "--quiet", action='store_true', help="Only print errors")
+        archive_parser.add_argument("-v", "--verbose", action='store_true',
+                                    help="Also print the rules and every archived file")
+        archive_parser.add_argument("--json", action='store_true',
+                                    help="Print a JSON summary on stdout (stderr when streaming to '-')")
+
+    # verify command: check a copy or an archive against a --manifest
+    if wanted("verify"):
+        verify_parser = subparsers.add_parser("verify", help="Check a directory or archive against a manifest",
+                                               description="Check a directory or archive against a manifest; exit "
+                                                           "with status 1 if any file differs, is missing or fails")
+        verify_parser.add_argument("manifest", type=str, help="Manifest written by --manifest (or sha256sum)")
+        verify_parser.add_argument("target", type=str, help="Directory or archive the manifest describes")
+        verify_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                                   help="Processes hashing files or zip members (default: one per CPU)")
+        verify_parser.add_argument("--format", choices=ARCHIVE_FORMATS, default=None,
+                                   help="Archive format when the target's name does not tell")
+        verify_parser.add_argument("-q", "--quiet", action='store_true', help="Only print errors")
+        verify_parser.add_argument("--json", action='store_true',
+                                   help="Print a JSON summary with every mismatch on stdout "
+                                        "(other messages go to stderr)")
+
+    # extract / ls commands: the members of an archive that pass the rules
+    if wanted("extract"):
+        extract_parser = subparsers.add_parser("extract", help="Extract the members of an archive that pass the rules")
+        extract_parser.add_argument("archive", type=str, help="Archive to extract (.zip/.tar/.tar.gz/...)")
+        extract_parser.add_argument("target", type=str, help="Directory to extract into (created if missing)")
+        extract_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        extract_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        extract_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        extract_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        extract_parser.add_argument("--jobs", type=int, default=1,
+                                    help="Number of zip members written concurrently (default 1; tar archives "
+                                         "are always read in one pass)")
+        extract_parser.add_argument("--format", choices=ARCHIVE_FORMATS, default=None,
+                                    help="Archive format when the archive's name does not tell")
+        extract_parser.add_argument("-q", "--quiet", action='store_true', help="Only print errors")
+        extract_parser.add_argument("-v", "--verbose", action='store_true', help="Also print every extracted file")
+        extract_parser.add_argument("--json", action='store_true',
+                                    help="Print a JSON summary on stdout (other messages go to stderr)")
+
+    if wanted("ls"):
+        ls_parser = subparsers.add_parser("ls", help="List the members of an archive that pass the rules")
+        ls_parser.add_argument("archive", type=str, help="Archive to list (.zip/.tar/.tar.gz/...)")
+        ls_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        ls_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        ls_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        ls_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        ls_parser.add_argument("--format", choices=ARCHIVE_FORMATS, default=None,
+                               help="Archive format when the archive's name does not tell")
+        ls_parser.add_argument("-l", "--long", action='store_true', help="Also print sizes, mtimes and link targets")
+        ls_parser.add_argument("--json", action='store_true', help="Print one JSON record per member (NDJSON)")
+
+    # snapshot / restore commands for the deduplicating chunk store
+    if wanted("snapshot"):
+        snapshot_parser = subparsers.add_parser("snapshot", help="Save a deduplicated snapshot into a chunk store")
+        snapshot_parser.add_argument("src", type=str, help="Source directory to snapshot")
+        snapshot_parser.add_argument("store", type=str, help="Chunk store directory (created if missing)")
+        snapshot_parser.add_argument("--name", type=str, default=None,
+                                     help="Snapshot name (default: the current time, YYYYmmdd-HHMMSS)")
+        snapshot_parser.add_argument("--chunk-size", type=int, default=SNAPSHOT_CHUNK_SIZE,
+                                     help="Chunk size in bytes (the average one with --cdc)")
+        snapshot_parser.add_argument("--cdc", action='store_true',
+                                     help="Content-defined chunk boundaries (dedupes shifted data, slower)")
+        snapshot_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        snapshot_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        snapshot_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        snapshot_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        snapshot_parser.add_argument("--no-nested", action='store_true',
+                                     help="Ignore .cp_ignore files found inside the source tree")
+        snapshot_parser.add_argument("--no-cache", action='store_true',
+                                     help="Do not read or update the directory scan cache (on by default, kept in "
+                                          "$JH_CP_CACHE_DIR or ~/.cache/jh_cp)")
+        snapshot_parser.add_argument("-q", "--quiet", action='store_true', help="Only print errors")
+        snapshot_parser.add_argument("-v", "--verbose", action='store_true', help="Also print every file read")
+        snapshot_parser.add_argument("--json", action='store_true',
+                                     help="Print a JSON summary on stdout (other messages go to stderr)")
+
+    if wanted("restore"):
+        restore_parser = subparsers.add_parser("restore", help="Rebuild a directory from a snapshot")
+        restore_parser.add_argument("store", type=str, help="Chunk store directory")
+        restore_parser.add_argument("name", type=str, help="Snapshot name, or 'latest'")
+        restore_parser.add_argument("target", type=str, help="Directory to restore into")
+        restore_parser.add_argument("-q", "--quiet", action='store_true', help="Only print errors")
+        restore_parser.add_argument("-v", "--verbose", action='store_true', help="Also print every file written")
+        restore_parser.add_argument("--json", action='store_true',
+                                    help="Print a JSON summary on stdout (other messages go to stderr)")
+
+    # cp_ignore subcommand for managing .cp_ignore
+    if wanted("cp_ignore"):
+        cp_ignore_parser = subparsers.add_parser("cp_ignore", help="Manage .cp_ignore rules")
+        cp_ignore_parser.add_argument("-register", nargs="+", help="Register pattern(s) to include")
+        cp_ignore_parser.add_argument("-ignore", nargs="+", help="Ignore pattern(s)")
+        cp_ignore_parser.add_argument("-export", type=str, help="Export current ignore rules to file")
+        cp_ignore_parser.add_argument("-reset", action='store_true', help="Reset to default ignore rules")
+        cp_ignore_parser.add_argument("-nano", action='store_true', help="Open .cp_ignore with nano editor")
+
+    # plan command: dry run with counts, sizes and rule hits as NDJSON
+    if wanted("plan"):
+        plan_parser = subparsers.add_parser("plan", help="Preview what would be copied, as NDJSON records")
+        plan_parser.add_argument("src", type=str, help="Source directory to plan")
+        plan_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        plan_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        plan_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        plan_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        plan_parser.add_argument("--no-nested", action='store_true',
+                                 help="Ignore .cp_ignore files found inside the source tree")
+        plan_parser.add_argument("--summary-only", action='store_true',
+                                 help="Omit the per-file and per-directory records")
+        plan_parser.add_argument("--top", type=int, default=PLAN_TOP_DIRS,
+                                 help=f"Number of largest directories reported (default {PLAN_TOP_DIRS})")
+        plan_parser.add_argument("--no-follow", action='store_true',
+                                 help="Do not follow symlinks (as 'archive' does)")
+
+    # filter command: the paths read on stdin that the rules keep, without touching the filesystem
+    if wanted("filter"):
+        filter_parser = subparsers.add_parser("filter", help="Print the paths read on stdin that pass the rules")
+        filter_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        filter_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        filter_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        filter_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        filter_parser.add_argument("--invert", action='store_true', help="Print the ignored paths instead")
+        filter_parser.add_argument("--lines", action='store_true',
+                                   help="Paths are separated by newlines instead of NUL bytes (input and output)")
+
+    # tree command for displaying directory structure
+    if wanted("tree"):
+        tree_parser = subparsers.add_parser("tree", help="Display directory structure with ignore rules")
+        tree_parser.add_argument("src", type=str, help="Source directory, or archive, to visualize")
+        tree_parser.add_argument("-ignore", type=str, help="Custom ignore file path")
+        tree_parser.add_argument("--exclude-zip", action='store_true', help="Exclude zip-related patterns")
+        tree_parser.add_argument("--exclude-log", action='store_true', help="Exclude log-related patterns")
+        tree_parser.add_argument("--exclude-db", action='store_true', help="Exclude db-related patterns")
+        tree_parser.add_argument("--no-nested", action='store_true',
+                                 help="Ignore .cp_ignore files found inside the source tree")
+        tree_parser.add_argument("--no-cache", action='store_true',
+                                 help="Do not read or update the directory scan cache (on by default, kept in "
+                                      "$JH_CP_CACHE_DIR or ~/.cache/jh_cp)")
+        tree_parser.add_argument("--max-depth", type=int, default=None, help="Optional maximum depth to traverse")
+        tree_parser.add_argument("--no-sort", action='store_true',
+                                 help="Print entries in directory order as they are read, without holding a listing")
+        tree_parser.add_argument("--max-entries", type=int, default=None, metavar="N",
+                                 help="Show at most N entries per directory, then a '... M more' line")
+        tree_parser.add_argument("--du", action='store_true',
+                                 help="Show file sizes and the total files and bytes of every directory")
+        tree_parser.add_argument("--format", choices=ARCHIVE_FORMATS, default=None,
+                                 help="Archive format when src is an archive whose name does not tell")
+
+    args = parser.parse_args(argv)
+    if args.profile or args.profile_memory:
+        _profile_run(args.profile, args.profile_memory, lambda: jh_cp_main(rest))
+        return
+
+    if args.command in ("cp", "watch", "archive", "extract", "snapshot", "restore"):
+        if args.quiet:
+            host.level = Host.QUIET
+        elif args.verbose:
+            host.level = Host.VERBOSE
+        if args.json:
+            host.mk_stderr()
+
+    if args.command == "cp":
+        # cp SRC... TARGET, or cp SRC... --to DIR [--to DIR ...]
+        if args.to:
+            sources, targets = args.paths, args.to
+        elif len(args.paths) > 1:
+            sources, targets = args.paths[:-1], args.paths[-1:]
+        else:
+            host.print("cp needs a target directory, or one or more --to DIR", True)
+            return
+        for target in targets:
+            if os.path.isfile(target):
+                host.print(f"FileExistsError: {target} is a File instead of a Directory", True)
+                return
+        # Several sources each get their own subdirectory in every target, like cp(1)
+        create_subdir = args.create_subdir or len(sources) > 1
+        cli_rules = _cli_rules(args)
+        digests: dict[str, str] = {}
+        failed = False
+        for src in sources:
+            rules = cli_rules
+            if args.dry_run:
+                src_path = Path(src).resolve()
+                for target in targets:
+                    # The real run never reads its own target
+                    target_path = Path(target).resolve() / (src_path.name if create_subdir else "")
+                    if target_path.is_relative_to(src_path) and target_path != src_path:
+                        rules = rules + [(target_path.relative_to(src_path).as_posix() + "/", False)]
+                _print_plan(plan_with_ignore(src_path, rules))
+                continue
+            rules = rules + [(str(Path(target).resolve()) + '/', False) for target in targets]
+            stats = copytree_with_ignore(src, targets, rules, create_subdir, args.jobs, args.sync, args.checksum,
+                                         args.delete, not args.no_cache, args.copy_mode, args.dedupe, args.resume,
+                                         args.verify, args.manifest if len(sources) == 1 else bool(args.manifest))
+            if stats is not None and stats.digests is not None and len(sources) > 1:
+                digests.update(stats.digests)
+            if args.json and stats is not None:
+                host.summary(stats)
+            failed = failed or _verify_failed(stats)
+        if args.manifest and len(sources) > 1 and not args.dry_run:
+            # One manifest for all sources; each copy's paths already start with its subdirectory
+            _write_manifest(args.manifest, digests)
+            host.print(f"Manifest of {len(digests)} files written to {args.manifest}")
+        if args.verify and failed:
+            sys.exit(1)
+    elif args.command == "watch":
+        ignore_path, groups = _cli_rule_files(args)
+        exclude_rules = load_exclude_rules() if groups else {}
+        additional_rules = [pattern for group in groups for pattern in exclude_rules.get(group, [])]
+        stats = watch_with_ignore(args.src, args.target, _cli_rules(args), ignore_path, additional_rules,
+                                  args.delete, args.debounce, args.poll, args.copy_mode, not args.no_cache)
+        if args.json and stats is not None:
+            host.summary(stats)
+    elif args.command == "archive":
+        if args.output == "-":
+            host.mk_stderr()
+        if args.format is None and (args.output == "-" or _archive_format(args.output) is None):
+            host.print("Output must end with .zip, .tar, .tar.gz/.tgz, .tar.bz2, .tar.xz or .tar.zst, "
+                       "or use --format", True)
+            return
+        rules = _cli_rules(args)
+        if args.dry_run:
+            src = Path(args.src).resolve()
+            output = None if args.output == "-" else Path(args.output).resolve()
+            # The real run never reads its own output archive
+            if output is not None and output.is_relative_to(src):
+                rules = rules + [(output.relative_to(src).as_posix(), False)]
+            _print_plan(plan_with_ignore(src, rules, follow_symlinks=False))
+            return
+        if args.output == "-":
+            output = sys.stdout.buffer
+        else:
+            output = args.output
+            rules = rules + [(str(Path(args.output).resolve()), False)]  # Ensure the output archive is ignored
+        stats = create_archive_with_ignore(args.src, output, rules, args.jobs, args.level, args.store_ext,
+                                           args.format, not args.no_cache, args.dedupe, args.resume, args.verify,
+                                           args.manifest)
+        if args.json and stats is not None:
+            host.summary(stats, sys.stderr if args.output == "-" else sys.stdout)
+        if args.verify and _verify_failed(stats):
+            sys.exit(1)
+    elif args.command == "verify":
+        if args.quiet:
+            host.level = Host.QUIET
+        if args.json:
+            host.mk_stderr()
+        stats = verify_manifest(args.manifest, args.target, args.jobs, args.format)
+        if args.json and stats is not None:
+            host.summary(stats)
+        if _verify_failed(stats):
+            sys.exit(1)
+    elif args.command == "extract":
+        stats = extract_archive_with_ignore(args.archive, args.target, _cli_rule_list(args), args.jobs, args.format)
+        if args.json and stats is not None:
+            host.summary(stats)
+    elif args.command == "ls":
+        try:
+            for record in list_archive_with_ignore(args.archive, _cli_rule_list(args), args.format):
+                if args.json:
+                    line = json.dumps(record, ensure_ascii=False)
+                elif args.long:
+                    mtime = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["mtime"]))
+                    line = f"{record['size']:>12}  {mtime}  {record['path']}" + ("/" if record["type"] == "dir" else "")
+                    if "link" in record:
+                        line += f" {'->' if record['type'] == 'symlink' else 'link to'} {record['link']}"
+                else:
+                    line = record["path"] + ("/" if record["type"] == "dir" else "")
+                sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader (e.g. `head`) is gone; keep Python from reporting it again at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    elif args.command == "snapshot":
+        rules = _cli_rules(args)
+        stats = create_snapshot(args.src, args.store, rules, args.name, args.chunk_size, args.cdc, not args.no_cache)
+        if args.json and stats is not None:
+            host.summary(stats)
+
+    elif args.command == "restore":
+        stats = restore_snapshot(args.store, args.name, args.target)
+        if args.json and stats is not None:
+            host.summary(stats)
+
+    elif args.command == "cp_ignore":
+        handle_cp_ignore(args)
+
+    elif args.command == "plan":
+        _print_plan(plan_with_ignore(args.src, _cli_rules(args), not args.no_follow, not args.summary_only, args.top))
+
+    elif args.command == "filter":
+        # Nested .cp_ignore files are never read: the paths need not exist here
+        ruleset = RuleSet(_cli_rule_list(args), nested=None)
+        try:
+            _filter_stream(sys.stdin.buffer, sys.stdout.buffer, ruleset, b"\n" if args.lines else b"\0", args.invert)
+            sys.stdout.buffer.flush()
+        except BrokenPipeError:
+            # The reader (e.g. `head`) is gone; keep Python from reporting it again at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+    elif args.command == "tree":
+        src_path = Path(args.src).resolve()
+        rules = _cli_rules(args)
+        draw_tree_with_ignore(src_path, rules, args.max_depth, not args.no_cache, not args.no_sort,
+                              args.max_entries, args.du, args.format)
 
     elif not argv:
         host.print("Hello from JeongHan's Copying Tool.")
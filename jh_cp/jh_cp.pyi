@@ -13,21 +13,42 @@
 # limitations under the License.
 
 import argparse
+import os
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, BinaryIO, Callable, Iterable, Iterator
 
-__all__ = ['Host', 'host', 'load_ignore_rules', 'load_exclude_rules', 'should_ignore',
-           'copytree_with_ignore', 'create_archive_with_ignore', 'handle_cp_ignore', 'draw_tree_with_ignore',
-           'jh_cp_main']
+__all__ = ['Host', 'host', 'RunStats', 'load_ignore_rules', 'load_exclude_rules', 'RuleSet', 'should_ignore', 'ScanCache',
+           'classify', 'walk_with_ignore', 'copytree_with_ignore', 'watch_with_ignore', 'create_archive_with_ignore',
+           'verify_manifest', 'extract_archive_with_ignore', 'list_archive_with_ignore', 'create_snapshot',
+           'restore_snapshot', 'plan_with_ignore', 'AsyncRun',
+           'async_copytree', 'async_archive', 'async_walk', 'handle_cp_ignore',
+           'draw_tree_with_ignore', 'jh_cp_main']
 
 
 class Host:
-    """the Host object based on the platform system."""
-    _print_unix: callable = None
-    _print_windows: callable = None
+    """
+    Console output of jh_cp: ANSI-colored lines written straight to the (buffered) standard streams,
+    a rate-limited progress line and an optional JSON summary. No subprocess is ever spawned; on
+    Windows the console's virtual terminal mode is enabled once so the same escape codes work.
+    Colors are only used on terminals and are turned off by the `NO_COLOR` environment variable.
+    """
+    QUIET: int = 0
+    """Only errors (and an explicitly requested JSON summary) are printed."""
+    NORMAL: int = 1
+    """Messages, errors and the progress line (default)."""
+    VERBOSE: int = 2
+    """Also the effective rules and every copied or archived file."""
+    PROGRESS_INTERVAL: float = 0.25
+    """Minimum number of seconds between two redraws of the progress line."""
+
+    level: int
+    """One of `Host.QUIET`, `Host.NORMAL` or `Host.VERBOSE`."""
 
     def print(self, message: str, is_error: bool = False):
         """
-        Prints the message with colors on Terminal (via PowerShell or Shell depending on the system).
+        Prints the message in yellow (red for errors on stderr) when the stream is a terminal.
 
         :param message: The message to print
         :param is_error: Whether the message is an error (default is False)
@@ -35,12 +56,55 @@ class Host:
         """
         ...
 
+    def debug(self, message: str):
+        """
+        Prints the message only at the `Host.VERBOSE` level.
+
+        :param message: The message to print
+        :return: None
+        """
+        ...
+
+    def progress(self, stats: RunStats):
+        """
+        Redraws the progress line (files, bytes, files/s, bytes/s and an ETA when
+        `stats.expected_files` is known) on stderr. Only at the `Host.NORMAL` level, only when stderr
+        is a terminal, and at most once every `PROGRESS_INTERVAL` seconds; `RunStats.add` calls it.
+
+        :param stats: The counters of the running operation
+        :return: None
+        """
+        ...
+
+    def end_progress(self):
+        """
+        Clears the progress line, if one is shown.
+        :return: None
+        """
+        ...
+
+    def summary(self, stats: RunStats, stream=None):
+        """
+        Writes `stats.as_dict()` as a single JSON line.
+
+        :param stats: The counters of a finished operation
+        :param stream: Text stream to write to (default stdout)
+        :return: None
+        """
+        ...
+
     def mk_silent(self):
         """
         Forbid the host object from printing the output.
         :return: None
         """
 
+    def mk_stderr(self):
+        """
+        Send all output to stderr, keeping stdout free for data (e.g. an archive streamed to '-').
+        :return: None
+        """
+
 
 host: Host
 """
@@ -48,6 +112,99 @@ The module level host object use for printing.
 """
 
 
+class RunStats:
+    """
+    Counters of one `cp`, `archive` or `verify` run, returned by `copytree_with_ignore`,
+    `create_archive_with_ignore` and `verify_manifest`. `add` and `fail` may be called from worker threads.
+    """
+    command: str
+    """'cp', 'watch', 'archive', 'verify', 'snapshot' or 'restore'."""
+    src: str
+    target: str | list[str]
+    """Target directory, archive path or stream name; the list of targets of a fan-out copy."""
+    files: int
+    """Files copied, archived or (verify) checked."""
+    bytes: int
+    """Bytes of the files copied, archived or (verify) read."""
+    unchanged: int
+    """Files skipped by `sync` because the target copy is up to date, or by `resume` as already finished."""
+    skipped: int
+    """Entries excluded by the rules. An excluded directory counts once, whatever it holds."""
+    removed: int
+    """Stale target entries removed by `delete`."""
+    errors: int
+    """Number of entries (or whole operations) that failed."""
+    failures: list[tuple[str, str]]
+    """(path, reason) of every error, in the order they happened."""
+    output_bytes: int | None
+    """Size of the written archive (when written to a path), or the new data a snapshot added to its store."""
+    expected_files: int | None
+    """File count estimate for the ETA; the scan cache remembers the previous run's."""
+    backends: dict[str, int]
+    """cp: files copied by each backend ('reflink', 'copy_file_range', 'sendfile', 'buffered', 'shutil',
+    'fanout', 'hardlink')."""
+    target_errors: dict[str, int] | None
+    """cp to several targets: errors per target directory."""
+    digests: dict[str, str] | None
+    """`verify` / `manifest`: path relative to the target (or archive member) -> `MANIFEST_ALGORITHM`
+    digest of every file written, taken while it was copied or archived."""
+    verified: int | None
+    """`verify`: files read back and compared with their digest (per target for a fan-out copy)."""
+    mismatches: list[dict]
+    """`verify`: one record per file that did not read back the same: path, status ('mismatch',
+    'missing' or 'unreadable'), expected and actual digest, target, and error for unreadable files."""
+    elapsed: float
+    """Wall-clock seconds of the run, once finished."""
+    on_progress: Callable[[RunStats], None] | None
+    """Called with the counters after every `add` and `fail`, on the thread that made it (see the
+    `progress` parameter of `copytree_with_ignore`)."""
+
+    def __init__(self, command: str, src: Path | str, target: Path | str | list[Path | str]): ...
+
+    def add(self, files: int = 0, nbytes: int = 0, unchanged: int = 0, backend: str | None = None,
+            skipped: int = 0) -> None:
+        """
+        Counts finished work and refreshes the progress line. Thread-safe.
+
+        :param files: Files copied or archived
+        :param nbytes: Their size in bytes
+        :param unchanged: Files found up to date
+        :param backend: Copy backend that copied the files
+        :param skipped: Entries excluded by the rules
+        :return: None
+        """
+        ...
+
+    def fail(self, path: str, reason: str) -> None:
+        """
+        Counts an error and records it in `failures`. Thread-safe; printing it is up to the caller.
+
+        :param path: The file or directory that failed
+        :param reason: What went wrong, usually str() of the OSError
+        :return: None
+        """
+        ...
+
+    def finish(self) -> RunStats:
+        """
+        Stops the clock (once) and clears the progress line.
+        :return: self
+        """
+        ...
+
+    def as_dict(self) -> dict:
+        """
+        The JSON summary: command, src, target, ok, files, bytes, unchanged, skipped, removed, errors, seconds,
+        files_per_second, bytes_per_second, for archives written to a path output_bytes, for cp
+        the per-backend file counts as backends, and after a verification verified and mismatches.
+        """
+        ...
+
+
+NESTED_IGNORE_FILE: str
+"""Name of the per-directory ignore files a walk picks up by default ('.cp_ignore', see `RuleSet`)."""
+
+
 def load_ignore_rules(ignore_path: Path, additional_patterns: list[str] = None) -> list[tuple[str, bool]]:
     """
     Loads the ignore rules from the given path. If the path does not exist, default rules are used.
@@ -59,39 +216,649 @@ def load_ignore_rules(ignore_path: Path, additional_patterns: list[str] = None)
     ...
 
 
-def should_ignore(file_path: Path, rules: list[tuple[str, bool]], is_dir: bool = False) -> bool:
+class RuleSet:
+    """
+    Compiled, immutable form of the rules returned by `load_ignore_rules`.
+
+    Rules are split once into literal names, basename (`**/name`) and suffix (`*.ext`) tables,
+    and a single combined regex for the remaining globs, so each lookup costs a handful of
+    dictionary probes instead of one `fnmatch` call per rule.
+    Answers are identical to `should_ignore` with the plain list (last matching rule wins).
+
+    While walking, each directory only consults the rules that can still match below it: rules
+    anchored to another literal prefix (`docs/*.md` under `src/`) are dropped, and when the last
+    rule that can fire covers everything below a directory, its contents are decided without
+    matching — or not listed at all if that rule excludes them (see `prunes`).
+
+    Walks (`walk_with_ignore` and every command built on it) also read a `nested` ignore file in each
+    directory they list, like nested `.gitignore` files. Its rules apply to the paths below that
+    directory, relative to it, and take precedence over the rules of outer files and of this set;
+    each file is compiled once and reparsed only when it changes. Directories without one match
+    exactly as before. `is_ignored`, `match` and `prunes` only know this set's own rules.
+    """
+    rules: tuple[tuple[str, bool], ...]
+    """The (pattern, is_include) rules this set was compiled from, in order."""
+    nested: str | None
+    """Name of the per-directory ignore files walks pick up, or None to use this set's rules only."""
+
+    def __init__(self, rules: list[tuple[str, bool]] | RuleSet, nested: str | None = NESTED_IGNORE_FILE):
+        """
+        :param rules: List of rules (pattern, is_include) or another RuleSet (copied with its `nested`)
+        :param nested: Name of the per-directory ignore files, or None to not look for them
+        """
+        ...
+
+    def __len__(self) -> int: ...
+
+    def __add__(self, other: list[tuple[str, bool]]) -> RuleSet:
+        """
+        :param other: Rules appended after this set's, as when adding to a rule list
+        :return: A new RuleSet with the same `nested` setting
+        """
+        ...
+
+    @property
+    def digest(self) -> str:
+        """
+        SHA-256 hex digest of the rules and the `nested` setting. It changes whenever `.cp_ignore`, the
+        `exclude-rules.ini` groups or any extra rule change, which is what keys (and invalidates) a `ScanCache`.
+        """
+        ...
+
+    def is_ignored(self, relpath: str, is_dir: bool = False) -> bool:
+        """
+        Determines whether a path should be ignored.
+
+        :param relpath: POSIX-style path relative to the source root, without a trailing slash
+        :param is_dir: Whether the path is a directory (only rules ending with '/' apply)
+        :return: True if the path should be ignored, False otherwise
+        """
+        ...
+
+    def match(self, relpath: str, is_dir: bool = False) -> int:
+        """
+        Finds the rule that decides a path: the last one matching it, as with `is_ignored`.
+
+        :param relpath: POSIX-style path relative to the source root, without a trailing slash
+        :param is_dir: Whether the path is a directory
+        :return: Index of the deciding rule in `rules`, or -1 if no rule matches
+        """
+        ...
+
+    def prunes(self, reldir: str) -> bool:
+        """
+        Determines whether everything below a directory is excluded, so it need not be listed.
+        True for `app/node_modules` under `**/node_modules/*` and `**/node_modules/*/` unless a later
+        include rule can still match inside it. The directory itself is judged by `is_ignored`.
+
+        :param reldir: POSIX-style directory path relative to the source root ("" for the root)
+        :return: True if no file or directory below `reldir` can pass the rules
+        """
+        ...
+
+
+def should_ignore(file_path: Path, rules: list[tuple[str, bool]] | RuleSet, is_dir: bool = False) -> bool:
     """
     Determines whether a file or directory should be ignored based on the rules.
 
     :param file_path: Path to the file or directory to check
-    :param rules: List of rules to apply (pattern, is_include)
+    :param rules: List of rules to apply (pattern, is_include), or a compiled RuleSet (faster for many paths)
     :param is_dir: Whether the path is a directory (affects pattern matching)
     :return: True if the file should be ignored, False otherwise
     """
     ...
 
 
-def copytree_with_ignore(src: Path, target: Path, rules: list[tuple[str, bool]]) -> None:
+FILTER_READ_SIZE: int
+"""Bytes of stdin `jh_cp filter` reads at a time."""
+
+
+def classify(paths: Iterable[str | os.PathLike], rules: list[tuple[str, bool]] | RuleSet) -> list[bool]:
+    """
+    Bulk `should_ignore` for path lists that already exist, e.g. from `git ls-files`, a database or a manifest.
+
+    The answer is the one a walk of the tree would give: a path is ignored when the rules exclude it
+    or any directory above it, so `node_modules/x.js` is ignored by `node_modules/`. Paths are grouped
+    by their directory: each directory is judged once, and when a rule decides everything below it,
+    its paths are not matched one by one. The filesystem is never touched, so nested `.cp_ignore`
+    files do not apply.
+
+    :param paths: Relative paths, with '/' (or os.sep) separators; a trailing '/' marks a directory,
+                  a leading './' is dropped, and '' or '.' is the root (never ignored)
+    :param rules: List of rules (pattern, is_include), or a compiled RuleSet
+    :return: One bool per path, in order: True if it is ignored
+    """
+    ...
+
+
+class ScanCache:
+    """
+    Persistent directory-scan cache for one source root and one RuleSet.
+
+    For every scanned directory it stores the directory's mtime and the entries kept by the rules.
+    On a later run, a directory whose mtime is unchanged is replayed from the cache instead of being
+    listed and matched again; only changed directories are re-scanned. Directories modified within
+    the last two seconds are never cached, since they may still change within the same mtime tick.
+
+    Cache files live in `$JH_CP_CACHE_DIR`, else `$XDG_CACHE_HOME/jh_cp` (`~/.cache/jh_cp`),
+    or `%LOCALAPPDATA%\\jh_cp\\Cache` on Windows. The file name is derived from the source path and
+    `RuleSet.digest`, so editing `.cp_ignore` or choosing other exclude groups never reuses stale decisions.
+    Each directory record also remembers the content of the nested ignore files above it, so editing
+    one of those rescans its subtree only.
+    Files unused for `SCAN_CACHE_MAX_AGE` seconds are removed.
+    """
+    path: Path
+    """Location of the cache file."""
+
+    def __init__(self, src: Path | str, ruleset: RuleSet, cache_dir: Path | str | None = None):
+        """
+        :param src: Source root the cache describes
+        :param ruleset: Compiled rules the stored decisions were made with
+        :param cache_dir: Optional directory for the cache file (default: see above)
+        """
+        ...
+
+    def save(self) -> None:
+        """
+        Writes the cache atomically if anything changed. Errors are ignored (the cache is best effort).
+        :return: None
+        """
+        ...
+
+
+def walk_with_ignore(src: Path | str, rules: list[tuple[str, bool]] | RuleSet, follow_symlinks: bool = True,
+                     onerror: Callable[[OSError], None] | None = None,
+                     cache: ScanCache | None = None,
+                     on_rule: Callable[[str, str, int | tuple[str, RuleSet, int]], None] | None = None,
+                     on_skip: Callable[[int], None] | None = None) -> Iterator[tuple[str, os.DirEntry]]:
+    """
+    Walks a directory tree with `os.scandir`, yielding only the entries that pass the ignore rules.
+
+    This is the single traversal shared by `copytree_with_ignore`, `create_archive_with_ignore`
+    and `draw_tree_with_ignore`. Entry types come from the `DirEntry` (no extra `stat` on most
+    filesystems), relative paths are built as strings, and ignored directories are never listed,
+    nor are directories whose contents are all excluded (`RuleSet.prunes`).
+    A directory is always yielded before its contents. Nested ignore files are applied as described
+    in `RuleSet`; a directory whose nested file cannot be read is reported to `onerror` and skipped.
+
+    :param src: Root directory to walk
+    :param rules: List of ignore rules (pattern, is_include) or a compiled RuleSet
+    :param follow_symlinks: Descend into symlinked directories (default True)
+    :param onerror: Optional callback receiving the OSError of a directory that cannot be listed
+    :param cache: Optional ScanCache; unchanged directories then yield cached DirEntry look-alikes,
+        and the cache is saved when the walk ends
+    :param on_rule: Optional callback `(relpath, kind, rule_index)` for every entry a rule decided,
+        kept or ignored; kind is 'file', 'dir', or 'pruned' for a directory left unlisted. A rule of a
+        nested ignore file is passed as `(source, rules, index)`: the file's relpath, its compiled
+        RuleSet and the index in its `rules`. The cache is bypassed while it is set
+    :param on_skip: Optional callback receiving, for every listed directory, the number of its entries
+        the rules excluded (also replayed from the cache)
+    :return: Iterator of (relpath, entry) with POSIX-style relpath relative to src
+    """
+    ...
+
+
+RESUME_PART_SUFFIX: str
+"""Suffix of the hidden part files (`.name.jh_cp-part`) a `resume` run writes before renaming them."""
+
+RESUME_FLUSH_INTERVAL: float
+"""Seconds between two writes of a resume journal; at most this much finished work is redone after a crash."""
+
+RESUME_PARTIAL_MIN: int
+"""Files of at least this many bytes continue a resumed copy from their part file instead of starting over."""
+
+
+def copytree_with_ignore(src: Path, target: Path | list[Path], rules: list[tuple[str, bool]],
+                         create_subdir: bool = False, jobs: int = 1, sync: bool = False, checksum: bool = False,
+                         delete: bool = False, cache: bool = False, copy_mode: str = "auto",
+                         dedupe: bool = False, resume: bool = False, verify: bool = False,
+                         manifest: Path | str | bool | None = None,
+                         progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
     """
     Copies the directory tree from src to target, ignoring files based on the provided rules.
     May print the errors {shutil.Error, PermissionError} through Host.
 
+    With `jobs > 1` the filtered tree is walked first, every target directory is created up front,
+    and files are then copied by a bounded pool of `jobs` threads. This helps most on latency-bound
+    targets (NFS, USB) holding many small files.
+
+    With `sync`, files whose target copy has the same size and mtime (within `SYNC_MTIME_WINDOW`)
+    are skipped; `checksum` compares SHA-256 content hashes instead of mtimes and implies `sync`.
+    With `delete`, target entries that are gone from src or ignored there are removed first.
+
+    `copy_mode` (one of `COPY_MODES`) picks how file data is copied on Linux:
+    'auto' tries a FICLONE reflink (instant copy-on-write clone on btrfs, xfs, bcachefs), then
+    `os.copy_file_range`, then `os.sendfile`, then a buffered read/write loop. 'reflink' only
+    clones and reports files it cannot clone as errors, 'kernel' skips the reflink and 'buffered'
+    always copies in userspace. A backend that fails between two filesystems is not retried
+    for them. On other platforms 'auto' and 'kernel' use shutil's native copy.
+    `RunStats.backends` counts the files each backend copied.
+
+    Files that are hardlinks of each other in src (same `st_dev`, `st_ino`) stay hardlinks in
+    target. With `dedupe`, files with identical content also become hardlinks of the first
+    copy: sizes are compared first and only files sharing a size are hashed (SHA-256), so
+    unique files are never read twice. Empty files are left alone; linked files count as
+    `RunStats.backends['hardlink']`. Edits through one link show in all of them.
+
+    Given a list of targets, src is walked and filtered once and every file is read once: each
+    target that cannot reflink it is written from the same read buffers (`RunStats.backends['fanout']`),
+    concurrently for files of `FANOUT_CONCURRENT_MIN` bytes and more. Counters add up the writes
+    to all targets. A failing target does not stop the others; `RunStats.target_errors` counts
+    the errors of each one, and a target that cannot be created is skipped.
+
+    With `resume`, every file is written to a hidden part name (`.name.jh_cp-part`) and renamed over
+    the target once complete, so an interrupted run never leaves a truncated file under its real
+    name. A journal next to the scan caches records the finished files; running the same copy
+    (same src, targets and rules) again skips the ones it lists whose target still has their size
+    and mtime, counted as `RunStats.unchanged`. Files of `RESUME_PARTIAL_MIN` bytes and more continue
+    from the last whole MiB of their part file (`RunStats.backends['resumed']`). The journal is
+    written every `RESUME_FLUSH_INTERVAL` seconds and removed when a run ends without errors;
+    `delete` keeps the part files of files still in src.
+
+    With `verify` or `manifest`, every file is hashed (`MANIFEST_ALGORITHM`) in the read that copies
+    it, so data goes through user space instead of `os.copy_file_range` (reflinks still clone, next
+    to that read); files that are not written (unchanged, hardlinked) are read once for their digest.
+    The digests end up in `RunStats.digests`, keyed by the path relative to `target` (so they start
+    with src's name under `create_subdir`). `verify` then reads every copied file back from each
+    target and records the ones that differ in `RunStats.mismatches` (and as errors);
+    `manifest` writes the digests to a file in `sha256sum` format, which `verify_manifest` or
+    `sha256sum -c` (run in target) check later. `manifest=True` only fills `RunStats.digests`.
+
     :param src: Source directory path (can be a Directory or a File)
-    :param target: Target directory path (MUST be a Directory)
+    :param target: Target directory path (MUST be a Directory), or a list of them
     :param rules: List of ignore rules
-    :return: None
+    :param create_subdir: Place the contents inside a subdirectory named after src
+    :param jobs: Number of files copied concurrently (default 1, sequential)
+    :param sync: Only copy new or changed files
+    :param checksum: Detect changes by content hash instead of size and mtime (implies sync)
+    :param delete: Remove target entries that are gone or ignored in src
+    :param cache: Reuse and update the persistent `ScanCache` for src
+    :param copy_mode: 'auto', 'reflink', 'kernel' or 'buffered'
+    :param dedupe: Hardlink files with identical content in target
+    :param resume: Copy through part files and keep a journal; pick up an interrupted run of the same copy
+    :param verify: Read the copied files back and compare them with the digests taken while copying
+    :param manifest: File to write the digests to in `sha256sum` format, or True to only collect them
+    :param progress: Called with the live `RunStats` after every file and listed directory, from the
+        copying threads. A `BaseException` that is not an `Exception` raised there aborts the run
+        (this is how `async_copytree` is cancelled)
+    :return: The counters of the run, or None if it could not start (e.g. the target is a file)
+    """
+    ...
+
+
+WATCH_DEBOUNCE: float
+"""Seconds without new events before `watch_with_ignore` applies the pending changes."""
+WATCH_MAX_DELAY: float
+"""Seconds after which pending changes are applied even while events keep arriving."""
+WATCH_POLL_INTERVAL: float
+"""Seconds between two scans when `watch_with_ignore` polls instead of using inotify."""
+
+
+def watch_with_ignore(src: Path, target: Path, rules: list[tuple[str, bool]], ignore_file: Path | None = None,
+                      additional_patterns: list[str] | None = None, delete: bool = False,
+                      debounce: float = WATCH_DEBOUNCE, poll_interval: float | None = None,
+                      copy_mode: str = "auto", cache: bool = False,
+                      stop: threading.Event | None = None) -> RunStats | None:
+    """
+    Mirrors src into target and keeps it up to date until stopped (Ctrl+C, or `stop` being set).
+
+    Starts with a `copytree_with_ignore(sync=True)` of the whole tree, then follows filesystem
+    events instead of rescanning: on Linux through inotify (via ctypes, one watch per kept
+    directory, so ignored directories such as `node_modules/` cost nothing), elsewhere, or with
+    `poll_interval`, by rescanning the kept tree every `poll_interval` seconds and comparing
+    sizes and mtimes.
+
+    Events are debounced: changes are applied once no event arrived for `debounce` seconds (and
+    at the latest after `WATCH_MAX_DELAY`), as one batch in which every path is handled once,
+    parents first. Created and modified files are copied, new or moved-in directories with their
+    kept subtree, and deleted or moved-away paths are removed from target. Paths are filtered by
+    the same rules as `cp`. A target inside src is excluded automatically.
+
+    When `ignore_file` is edited, the rules are reloaded from it (plus `additional_patterns`),
+    the watches are rebuilt and the whole tree is synced again, as it is after an inotify queue
+    overflow. `delete` prunes stale or newly ignored target entries during these full syncs.
+
+    :param src: Source directory
+    :param target: Target directory (created if missing)
+    :param rules: List of ignore rules
+    :param ignore_file: Ignore file whose edits reload the rules, e.g. `.cp_ignore`
+    :param additional_patterns: Extra ignore patterns added on reload (the `--exclude-*` groups)
+    :param delete: Remove target entries that are gone or ignored in src on full syncs
+    :param debounce: Quiet time in seconds before a batch of changes is applied
+    :param poll_interval: Poll every so many seconds instead of using inotify
+    :param copy_mode: 'auto', 'reflink', 'kernel' or 'buffered' (see `copytree_with_ignore`)
+    :param cache: Reuse and update the persistent `ScanCache` for the full syncs
+    :param stop: Event that ends the watch when set (checked at least every second)
+    :return: The counters of the whole watch, or None if it could not start
     """
     ...
 
 
-def create_archive_with_ignore(src: Path, output: Path, rules: list[tuple[str, bool]]) -> None:
+def create_archive_with_ignore(src: Path, output: Path | BinaryIO, rules: list[tuple[str, bool]], jobs: int = 1,
+                               level: int | None = None, store_ext: list[str] | None = None,
+                               archive_format: str | None = None, cache: bool = False,
+                               dedupe: bool = False, resume: bool = False, verify: bool = False,
+                               manifest: Path | str | bool | None = None,
+                               progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
     """
     Creates a ZIP or TAR archive from the source directory, ignoring files based on the provided rules.
+    The format follows the output suffix: .zip, .tar, .tar.gz/.tgz, .tar.bz2, .tar.xz,
+    or .tar.zst (only when the optional `zstandard` module, or Python 3.14+, is available).
+
+    `output` may also be any writable binary stream (stdout, a pipe, a socket file, BytesIO);
+    `archive_format` is then required. Tar formats are always written in stream mode, and zip
+    members written to an unseekable stream use data descriptors, so nothing is staged on disk.
+
+    `level` is interpreted per format (`ARCHIVE_LEVELS`): zip and gz 0-9, bz2 1-9, xz 0-9, zst 1-22.
+    Zip members that cannot shrink are stored with ZIP_STORED instead of deflated: files with a
+    `STORE_EXTENSIONS` extension (plus `store_ext`), and files whose first 64 KiB deflate by less than 5 %.
+
+    With `jobs > 1`, compression runs on a pool of `jobs` threads in 1 MiB blocks:
+    zip members are deflated concurrently and still written (with the central directory) in order,
+    and `.tar.gz` becomes a pigz-style block-parallel gzip stream that stock `gzip`/`tar` read as usual.
+
+    With `resume`, the archive is written to a hidden part name (`.name.jh_cp-part`) and renamed once
+    complete. A plain tar of a directory also keeps a journal of the members written and where they
+    end, synced to disk with the archive: running the same command again truncates the part file
+    after the last member that still reads back intact and appends the rest, skipping the members
+    whose file is unchanged (`RunStats.unchanged`). A file that changed in between is appended again;
+    the later member wins on extraction. Compressed and zip archives are written again from the start.
+
+    With `verify` or `manifest`, every regular file is hashed (`MANIFEST_ALGORITHM`) in the read that
+    archives it; `RunStats.digests` maps member names to digests (symlink members have none).
+    `verify` then reads the finished archive back, which needs an output path rather than a stream,
+    and records every member that differs in `RunStats.mismatches`; `manifest` writes the digests
+    to a `sha256sum` file, valid for the extracted tree as well.
 
     :param src: Source directory to archive (can be a Directory or a File)
-    :param output: Output archive path (.zip, .tar, or .tar.gz)
+    :param output: Output archive path (.zip, .tar, or .tar.gz), or a writable binary stream
     :param rules: List of ignore rules
-    :return: None
+    :param jobs: Number of compression threads (default 1)
+    :param level: Compression level, default per format (zip 6, gz 9, bz2 9, xz 6, zst 3)
+    :param store_ext: Extra extensions (e.g. ['.iso', '.dmg']) always stored without compression in zip
+    :param archive_format: One of `ARCHIVE_FORMATS` ('zip', 'tar', 'tgz', 'tbz2', 'txz', 'tzst'),
+        overriding the output suffix
+    :param cache: Reuse and update the persistent `ScanCache` for src
+    :param dedupe: Tar only: store files with identical content once, later copies as hardlink members
+    :param resume: Write through a part file; continue an interrupted plain tar of the same source
+    :param verify: Read the archive back and compare its members with the digests taken while archiving
+    :param manifest: File to write the digests to in `sha256sum` format, or True to only collect them
+    :param progress: Called with the live `RunStats` after every member and listed directory, like the
+        `progress` parameter of `copytree_with_ignore`
+    :return: The counters of the run, or None if the arguments were rejected (format, level)
+    """
+    ...
+
+
+MANIFEST_ALGORITHM: str
+"""hashlib name of the digests taken by `verify` / `manifest` ('sha256'), so manifests check with `sha256sum -c`."""
+VERIFY_READ_SIZE: int
+"""Bytes per read when files or archive members are read back for verification."""
+VERIFY_BATCH: int
+"""Files (or zip members) per task of the `verify_manifest` process pool."""
+
+
+def verify_manifest(manifest: Path | str, target: Path | str, jobs: int = 1, archive_format: str | None = None,
+                    progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
+    """
+    Checks a directory or an archive against a manifest written by `manifest=` (or by `sha256sum`).
+
+    Every listed file is read with large reads (`VERIFY_READ_SIZE`) and hashed; files of a directory
+    and members of a zip are checked in batches of `VERIFY_BATCH` on a pool of `jobs` processes. A tar
+    archive, compressed or not, is read once from start to end. Files the target holds beyond the
+    manifest are not reported. Each file that differs, is missing or cannot be read becomes an error
+    and a record in `RunStats.mismatches`; `RunStats.as_dict()` (`jh_cp verify --json`) lists them.
+
+    :param manifest: `sha256sum` file; paths are relative to target
+    :param target: Directory or archive (.zip, .tar, .tar.gz, .tar.bz2, .tar.xz, .tar.zst)
+    :param jobs: Processes hashing files or zip members (default 1, in this process)
+    :param archive_format: One of `ARCHIVE_FORMATS` when the archive name does not tell; zip is
+        otherwise recognized by its content and anything else is read as a tar
+    :param progress: Called with the live `RunStats` after every batch
+    :return: The counters of the check, or None if the manifest or target could not be opened
+    """
+    ...
+
+
+def extract_archive_with_ignore(archive: Path | str, target: Path | str, rules: list[tuple[str, bool]] | RuleSet,
+                                jobs: int = 1, archive_format: str | None = None,
+                                progress: Callable[[RunStats], None] | None = None) -> RunStats | None:
+    """
+    Extracts the members of an archive that pass the ignore rules into target.
+
+    Member names are matched like the relative paths of a walk (a member below an excluded
+    directory is excluded with it), straight from the archive, so no excluded member is ever
+    written. Nested `.cp_ignore` files are not read: members do not exist on disk before they
+    are extracted. Excluded members count as `skipped`.
+
+    A tar archive, compressed or not, is read once as a stream: its members are handled one at a
+    time and never collected into a list, so memory does not grow with the member count. Zip
+    members are written by a bounded pool of `jobs` threads reading through one shared `ZipFile`;
+    decompression and writes then overlap. Files and directories get their mode (without setuid
+    bits or group/other write) and mtime; directory attributes are applied last, deepest first.
+
+    Members with absolute names, `..` components, or links leading out of target are refused
+    and become errors, as are paths that would leave target through a symlink already there.
+    Existing files are replaced; a member is never written through a link.
+
+    :param archive: Archive path (.zip, .tar, .tar.gz, .tar.bz2, .tar.xz, .tar.zst)
+    :param target: Directory to extract into (created if missing)
+    :param rules: List of ignore rules (pattern, is_include)
+    :param jobs: Threads writing zip members (default 1); tar archives are always read in one pass
+    :param archive_format: One of `ARCHIVE_FORMATS` when the archive name does not tell; zip is
+        otherwise recognized by its content and anything else is read as a tar
+    :param progress: Called with the live `RunStats` after every extracted file
+    :return: The counters of the run, or None if it could not start
+    """
+    ...
+
+
+def list_archive_with_ignore(archive: Path | str, rules: list[tuple[str, bool]] | RuleSet,
+                             archive_format: str | None = None) -> Iterator[dict]:
+    """
+    Yields the members of an archive that pass the ignore rules, in archive order, without extracting them.
+
+    The rules apply as in `extract_archive_with_ignore`; tar archives are streamed, one member at
+    a time. Each record has "path" (relative, no trailing slash), "type" ("dir", "file",
+    "symlink", "hardlink" or "other"), "size" and "mtime"; links add their "link" target.
+    A hardlink member (e.g. from `archive --dedupe`) has the size of the file it links to, so
+    `--du` totals match those of the directory the archive was made from; for that, the size of
+    every file member read so far is remembered.
+    A truncated or corrupt archive is reported through `host` after the members read so far.
+    `draw_tree_with_ignore` draws these records as a tree when given an archive.
+
+    :param archive: Archive path
+    :param rules: List of ignore rules (pattern, is_include)
+    :param archive_format: One of `ARCHIVE_FORMATS` when the archive name does not tell
+    :return: Iterator of record dicts
+    """
+    ...
+
+
+def create_snapshot(src: Path, store: Path, rules: list[tuple[str, bool]], name: str | None = None,
+                    chunk_size: int = 1 << 20, cdc: bool = False, cache: bool = False) -> RunStats | None:
+    """
+    Saves the filtered tree of src as a deduplicated snapshot in a content-addressed chunk store.
+
+    Files are split into chunks stored once under `store/chunks/<sha256>`; the snapshot itself is
+    a small JSON manifest `store/snapshots/<name>.json` listing every directory, symlink and file
+    (mode, mtime and chunk hashes). Files whose size and mtime match the previous snapshot of the
+    same source are not read again, so a snapshot of a mostly unchanged tree costs the walk plus
+    the changed files, and the store only grows by their new chunks. When the previous snapshot
+    used another `chunk_size` or `cdc` setting, every file is read and chunked again.
+
+    Chunks have a fixed `chunk_size` by default. With `cdc`, boundaries are content-defined
+    (a gear rolling hash, FastCDC-style, with `chunk_size` as the average): data inserted into a
+    file then only changes the chunks around the insertion. The chunker is pure Python (about
+    5-10 MB/s), so it pays off for large files that are edited in place, not for every tree.
+
+    :param src: Source directory
+    :param store: Chunk store directory (created if missing; ignored if inside src)
+    :param rules: List of ignore rules
+    :param name: Snapshot name (letters, digits, '.', '_', '-'); default the current time
+    :param chunk_size: Fixed chunk size in bytes, or the average one with `cdc`
+    :param cdc: Use content-defined chunk boundaries
+    :param cache: Reuse and update the persistent `ScanCache` for src
+    :return: The counters of the run (`unchanged` files reused, `output_bytes` of new chunks),
+             or None if it could not start
+    """
+    ...
+
+
+def restore_snapshot(store: Path, name: str, target: Path) -> RunStats | None:
+    """
+    Rebuilds the tree of a snapshot into target: directories, symlinks and files with their
+    modes and mtimes. Every chunk is checked against its SHA-256 while reading. Files already in
+    target with the recorded size and mtime (within `SYNC_MTIME_WINDOW`) are left alone, so
+    restoring over a previous restore only writes what changed.
+
+    :param store: Chunk store directory
+    :param name: Snapshot name, or 'latest' for the most recent one
+    :param target: Directory to restore into (created if missing)
+    :return: The counters of the run, or None if the manifest cannot be read
+    """
+    ...
+
+
+PLAN_TOP_DIRS: int
+"""Number of largest directories `plan_with_ignore` reports by default."""
+
+
+def plan_with_ignore(src: Path, rules: list[tuple[str, bool]], follow_symlinks: bool = True,
+                     entries: bool = True, top: int = PLAN_TOP_DIRS) -> Iterator[dict]:
+    """
+    Dry run: walks src with the rules like `cp` / `archive` would, and yields JSON-ready records.
+
+    Records, in this order (each has a "type"):
+      - "dir" {path} and "file" {path, size} for every kept entry (skipped when entries is False)
+      - "error" {path, error} for entries that could not be listed or stat'ed
+      - "largest_dir" {path, files, bytes}: the `top` directories holding the most kept bytes
+      - "rule" {rule, include, files, dirs, pruned}: one per `.cp_ignore` line, busiest first;
+        `pruned` counts directories skipped unlisted because the rule excluded all of their content.
+        Lines of nested ignore files that decided something add their "source" (e.g. "app/.cp_ignore")
+      - "summary" {src, files, dirs, bytes, ignored_files, ignored_dirs, pruned_dirs, errors, seconds}
+
+    The scan cache is not used. `jh_cp plan` and `--dry-run` print these records as NDJSON.
+
+    :param src: Source directory
+    :param rules: List of ignore rules (pattern, is_include)
+    :param follow_symlinks: Descend into symlinked directories and report target sizes, like `cp`
+        (False behaves like `archive`)
+    :param entries: Yield a record per kept file and directory
+    :param top: Number of "largest_dir" records
+    :return: Iterator of record dicts
+    """
+    ...
+
+
+ASYNC_WORKERS: int
+"""Threads of the shared executor the async API runs on when none is given."""
+ASYNC_WALK_BATCH: int
+"""Entries `async_walk` hands to the event loop at once."""
+ASYNC_WALK_BACKLOG: int
+"""Batches `async_walk` reads ahead of its consumer before the walking thread waits."""
+
+
+class AsyncRun:
+    """
+    A copy or archive running on an executor thread, as returned by `async_copytree` and `async_archive`.
+
+    `await run` returns its `RunStats` (or raises `ValueError` when the run could not start, the reason
+    having been printed through `host`); `async for event in run` yields dicts until it ends:
+      - {"type": "progress", files, bytes, unchanged, skipped, errors, seconds}, at most every
+        `Host.PROGRESS_INTERVAL` seconds, and always a last one with the totals `await run` returns
+      - {"type": "error", path, error}, for every failed entry
+
+    Cancelling the task awaiting it, or `cancel()`, stops the worker at its next file or directory;
+    awaiting it then raises `asyncio.CancelledError`. The event loop never blocks on the file system.
+    """
+
+    def cancel(self) -> None:
+        """Asks the worker to stop; returns at once."""
+        ...
+
+    def done(self) -> bool:
+        """Whether the worker has finished (completed, failed or cancelled)."""
+        ...
+
+    def __await__(self): ...
+
+    def __aiter__(self) -> AsyncRun: ...
+
+    async def __anext__(self) -> dict: ...
+
+
+def async_copytree(src: Path, target: Path | list[Path], rules: list[tuple[str, bool]],
+                   create_subdir: bool = False, jobs: int = 1, sync: bool = False, checksum: bool = False,
+                   delete: bool = False, cache: bool = False, copy_mode: str = "auto", dedupe: bool = False,
+                   resume: bool = False, verify: bool = False, manifest: Path | str | bool | None = None,
+                   executor: ThreadPoolExecutor | None = None) -> AsyncRun:
+    """
+    `copytree_with_ignore` for asyncio: starts the copy on an executor thread and returns at once.
+    Must be called from a running event loop. `host` still prints as usual; set `host.level = Host.QUIET`
+    to rely on the events alone.
+
+    :param src: Source directory (can be a Directory or a File)
+    :param target: Target directory, or a list of them
+    :param rules: List of ignore rules
+    :param create_subdir: Create a subdirectory with the name of the source directory in the target
+    :param jobs: Number of copy threads of this run
+    :param sync: Skip files whose target copy is up to date
+    :param checksum: With sync, compare content instead of size and mtime
+    :param delete: With sync, remove target entries absent from src or ignored
+    :param cache: Reuse and update the persistent `ScanCache` for src
+    :param copy_mode: One of `COPY_MODES`
+    :param dedupe: Hardlink files with identical content in target
+    :param resume: Copy through part files and keep a journal (see `copytree_with_ignore`)
+    :param verify: Read the copied files back and compare their digests
+    :param manifest: File to write the digests to, or True to only collect them in `RunStats.digests`
+    :param executor: Executor to run on, default a shared pool of `ASYNC_WORKERS` threads
+    :return: The running `AsyncRun`
+    """
+    ...
+
+
+def async_archive(src: Path, output: Path | BinaryIO, rules: list[tuple[str, bool]], jobs: int = 1,
+                  level: int | None = None, store_ext: list[str] | None = None, archive_format: str | None = None,
+                  cache: bool = False, dedupe: bool = False, resume: bool = False, verify: bool = False,
+                  manifest: Path | str | bool | None = None, executor: ThreadPoolExecutor | None = None) -> AsyncRun:
+    """
+    `create_archive_with_ignore` for asyncio, like `async_copytree`. A cancelled run removes the
+    partial archive when output is a path, unless `resume` keeps it to be continued.
+
+    :param src: Source directory to archive
+    :param output: Output archive path, or a writable binary stream
+    :param rules: List of ignore rules
+    :param jobs: Number of compression threads of this run
+    :param level: Compression level, default per format
+    :param store_ext: Extra extensions always stored without compression in zip
+    :param archive_format: One of `ARCHIVE_FORMATS`, overriding the output suffix
+    :param cache: Reuse and update the persistent `ScanCache` for src
+    :param dedupe: Tar only: store files with identical content once
+    :param resume: Write through a part file and continue an interrupted plain tar
+    :param verify: Read the archive back and compare its members' digests
+    :param manifest: File to write the digests to, or True to only collect them in `RunStats.digests`
+    :param executor: Executor to run on, default a shared pool of `ASYNC_WORKERS` threads
+    :return: The running `AsyncRun`
+    """
+    ...
+
+
+async def async_walk(src: Path | str, rules: list[tuple[str, bool]] | RuleSet, follow_symlinks: bool = True,
+                     onerror: Callable[[OSError], None] | None = None, cache: ScanCache | None = None,
+                     executor: ThreadPoolExecutor | None = None) -> AsyncIterator[tuple[str, os.DirEntry]]:
+    """
+    `walk_with_ignore` as an async generator. The directories are listed on an executor thread, in
+    batches of `ASYNC_WALK_BATCH` entries and at most `ASYNC_WALK_BACKLOG` batches ahead of the consumer.
+    Leaving the `async for` early stops the walk.
+
+    :param src: Source directory
+    :param rules: List of ignore rules, or a compiled RuleSet
+    :param follow_symlinks: Descend into symlinked directories
+    :param onerror: Called (on the walking thread) with the OSError of an unreadable directory
+    :param cache: Optional ScanCache
+    :param executor: Executor to run on, default a shared pool of `ASYNC_WORKERS` threads
+    :return: Async iterator of (relpath, entry)
     """
     ...
 
@@ -116,7 +883,14 @@ def handle_cp_ignore(args: argparse.Namespace) -> None:
     ...
 
 
-def draw_tree_with_ignore(src: Path, rules: list[tuple[str, bool]], max_depth: int | None = None) -> None:
+TREE_OPEN_LISTINGS: int
+"""Directories `draw_tree_with_ignore(sort=False)` streams at once; deeper levels are read ahead instead,
+so a very deep tree does not hold one open directory handle per level."""
+
+
+def draw_tree_with_ignore(src: Path, rules: list[tuple[str, bool]], max_depth: int | None = None,
+                          cache: bool = False, sort: bool = True, max_entries: int | None = None,
+                          du: bool = False, archive_format: str | None = None) -> None:
     """
     Draws the directory tree structure while applying ignore rules.
 
@@ -125,9 +899,27 @@ def draw_tree_with_ignore(src: Path, rules: list[tuple[str, bool]], max_depth: i
     The matching logic is identical to `copytree_with_ignore`, ensuring consistent results
     when previewing which files will be included or excluded before performing copy or archive.
 
-    :param src: Root directory path to display
+    The tree is drawn without recursion, so its depth is not limited by the interpreter's stack.
+    Sorted output (directories first, then by name) holds one directory's listing at a time per
+    level, at most `max_entries` entries of it; with `sort=False` entries are printed in directory
+    order as they are read. Symlinked directories are followed, except back into their own parents.
+
+    With `du`, files show their size and every drawn directory ends with a `[N files, SIZE]` line
+    totalling its kept content; directories cut off by `max_depth` or `max_entries` are walked
+    (not drawn) in the same pass to count them.
+
+    When src is an archive, the members `list_archive_with_ignore` keeps are drawn the same way,
+    without extracting anything. Their names are gathered into a tree first, since archives list
+    members in any order; with `sort=False` entries keep the order they first appear in.
+
+    :param src: Root directory path to display, or an archive
     :param rules: List of ignore rules (pattern, is_include)
     :param max_depth: Optional maximum recursion depth limit
+    :param cache: Reuse and update the persistent `ScanCache` for src
+    :param sort: Sort each directory; False streams it in listing order
+    :param max_entries: Draw at most this many entries per directory, then a "... N more" line
+    :param du: Show sizes and per-directory totals of files and bytes
+    :param archive_format: One of `ARCHIVE_FORMATS` when src is an archive whose name does not tell
     :return: None
     """
     ...
@@ -142,6 +934,10 @@ def load_exclude_rules() -> dict[str, list[str]]:
     ...
 
 
+PROFILE_TOP: int
+"""Entries printed by `jh_cp --profile` (functions, by cumulative time) and `--profile-memory` (allocation sites)."""
+
+
 def jh_cp_main(argv: list[str] = None) -> None:
     """
     Main entry point for the `jh_cp` command-line tool.
@@ -157,14 +953,37 @@ def jh_cp_main(argv: list[str] = None) -> None:
 
       * Arguments:
 
-        >> `src`               Source path (file or directory)
+        >> `src...`            Source path(s) (file or directory); several get a subdirectory each
 
-        >> `target`            Destination directory
+        >> `target`            Destination directory (omitted with `--to`)
 
       * Options:
 
+        >> `--to DIR`            Destination directory; repeat to write every file to several targets from one read
+
         >> `--create-subdir`     Place contents inside a subdirectory named after source
 
+        >> `--jobs N`            Copy N files concurrently (default 1)
+
+        >> `--sync`              Only copy files whose size or mtime changed
+
+        >> `--checksum`          With `--sync`, compare SHA-256 hashes instead of mtimes
+
+        >> `--delete`            Remove target files that are gone or ignored in the source
+
+        >> `--copy-mode MODE`    auto (default), reflink, kernel or buffered data copy
+
+        >> `--dedupe`            Hardlink files with identical content (size, then SHA-256)
+
+        >> `--resume`            Copy through part files with a journal; rerun to skip the finished files
+
+        >> `--verify`            Read the copied files back and compare them with their SHA-256;
+                                 exit with status 1 if any differs or fails
+
+        >> `--manifest FILE`     Write the SHA-256 of every copied file to FILE (sha256sum format)
+
+        >> `--dry-run`           Copy nothing; print the `plan` records as NDJSON
+
         >> `--exclude-zip`       Exclude archive files (*.zip, *.tar.gz, *.7z, etc.)
 
         >> `--exclude-log`       Exclude log files (*.log, *.err, *.out)
@@ -173,6 +992,42 @@ def jh_cp_main(argv: list[str] = None) -> None:
 
         >> `-ignore FILE`        Use custom ignore rule file (default is .cp_ignore)
 
+        >> `--no-nested`         Do not apply the .cp_ignore files found inside the source tree
+
+        >> `--no-cache`          Do not read or update the directory scan cache (on by default,
+                                 kept in `$JH_CP_CACHE_DIR` or `~/.cache/jh_cp`)
+
+        >> `-q`, `--quiet`       Only print errors
+
+        >> `-v`, `--verbose`     Also print every copied file
+
+        >> `--json`              Print a JSON summary on stdout; other messages go to stderr
+
+    - **watch**  
+      Copy a directory, then keep mirroring its changes (inotify on Linux, polling elsewhere).
+
+      * Arguments:
+
+        >> `src`               Source directory to watch
+
+        >> `target`            Target directory kept in sync
+
+      * Options:
+
+        >> `--debounce SECONDS`  Quiet time before a batch of changes is applied (default 0.5)
+
+        >> `--poll [SECONDS]`    Rescan every SECONDS (default 2) instead of using inotify
+
+        >> `--delete`            Also prune stale or ignored target files on full syncs (start, rule reload)
+
+        >> `--copy-mode MODE`    As for `cp`
+
+        >> `--exclude-zip`, `--exclude-log`, `--exclude-db`, `--no-nested`, `--no-cache` as for `cp`
+
+        >> `-ignore FILE`        Custom ignore rule file; edits to it (or to .cp_ignore) reload the rules
+
+        >> `-q`, `-v`, `--json`  As for `cp`; the JSON summary is printed when stopped
+
     - **archive**  
       Create a compressed archive from a directory while applying to-ignore and exclusion rules.
 
@@ -180,10 +1035,29 @@ def jh_cp_main(argv: list[str] = None) -> None:
 
         >> `src`               Source directory to archive
 
-        >> `output`            Output file path (.zip, .tar, .tar.gz, .tgz)
+        >> `output`            Output file path (.zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz, .tar.zst), or '-'
 
       * Options:
 
+        >> `--format FMT`        zip, tar, tgz, tbz2, txz or tzst (required when output is '-' for stdout)
+
+        >> `--jobs N`            Compress .zip / .tar.gz / .tar.zst with N threads (default 1)
+
+        >> `--level N`           Compression level (zip/gz 0-9, bz2 1-9, xz 0-9, zst 1-22)
+
+        >> `--store-ext EXT...`  Extra extensions stored without compression in zip archives
+
+        >> `--dedupe`            Store identical files once, as tar hardlink members
+
+        >> `--resume`            Write through a part file; rerun to continue an interrupted .tar
+
+        >> `--verify`            Read the archive back and compare every member with its SHA-256;
+                                 exit with status 1 if any differs or fails
+
+        >> `--manifest FILE`     Write the SHA-256 of every archived file to FILE (sha256sum format)
+
+        >> `--dry-run`           Write nothing; print the `plan` records as NDJSON
+
         >> `--exclude-zip`       Exclude archive files (*.zip, *.tar.gz, *.7z, etc.)
 
         >> `--exclude-log`       Exclude log files (*.log, *.err, *.out)
@@ -192,6 +1066,137 @@ def jh_cp_main(argv: list[str] = None) -> None:
 
         >> `-ignore FILE`        Use custom ignore rule file (default is .cp_ignore)
 
+        >> `--no-nested`         Do not apply the .cp_ignore files found inside the source tree
+
+        >> `--no-cache`          Do not read or update the directory scan cache (on by default,
+                                 kept in `$JH_CP_CACHE_DIR` or `~/.cache/jh_cp`)
+
+        >> `-q`, `--quiet`       Only print errors
+
+        >> `-v`, `--verbose`     Also print the rules and every archived file
+
+        >> `--json`              Print a JSON summary on stdout (stderr when streaming to '-')
+
+    - **verify**  
+      Check a directory or an archive against a manifest written by `--manifest` (or `sha256sum`).
+      Exits with status 1 if any file differs, is missing or cannot be read, or the check cannot run.
+
+      * Arguments:
+
+        >> `manifest`          Manifest file, paths relative to the target
+
+        >> `target`            Directory or archive to check
+
+      * Options:
+
+        >> `--jobs N`            Processes hashing files or zip members (default: one per CPU)
+
+        >> `--format FORMAT`     Archive format when the target's name does not tell
+
+        >> `-q`, `--quiet`       Only print errors
+
+        >> `--json`              Print a JSON summary listing every mismatch on stdout (other messages go to stderr)
+
+    - **extract**  
+      Extract the members of an archive that pass the ignore rules (tar streamed, zip members in parallel).
+
+      * Arguments:
+
+        >> `archive`           Archive to extract (.zip, .tar, .tar.gz, .tar.bz2, .tar.xz, .tar.zst)
+
+        >> `target`            Directory to extract into (created if missing)
+
+      * Options:
+
+        >> `--jobs N`            Zip members written concurrently (default 1; tar is read in one pass)
+
+        >> `--format FORMAT`     Archive format when the archive's name does not tell
+
+        >> `--exclude-zip`, `--exclude-log`, `--exclude-db`, `-ignore FILE` as for `cp`
+
+        >> `-q`, `-v`, `--json`  As for `cp`
+
+    - **ls**  
+      List the members of an archive that pass the ignore rules, without extracting it.
+
+      * Arguments:
+
+        >> `archive`           Archive to list
+
+      * Options:
+
+        >> `-l`, `--long`        Also print sizes, mtimes and link targets
+
+        >> `--json`              One JSON record per member (NDJSON)
+
+        >> `--format FORMAT`     Archive format when the archive's name does not tell
+
+        >> `--exclude-zip`, `--exclude-log`, `--exclude-db`, `-ignore FILE` as for `cp`
+
+    - **snapshot**  
+      Save a deduplicated snapshot of a directory into a content-addressed chunk store.
+
+      * Arguments:
+
+        >> `src`               Source directory
+
+        >> `store`             Chunk store directory
+
+      * Options:
+
+        >> `--name NAME`         Snapshot name (default: current time, YYYYmmdd-HHMMSS)
+
+        >> `--chunk-size N`      Chunk size in bytes (average size with `--cdc`, default 1 MiB)
+
+        >> `--cdc`               Content-defined chunk boundaries
+
+        >> `--exclude-zip`, `--exclude-log`, `--exclude-db`, `-ignore FILE`, `--no-nested`, `--no-cache` as for `cp`
+
+        >> `-q`, `-v`, `--json`  As for `cp`
+
+    - **restore**  
+      Rebuild a directory from a snapshot.
+
+      * Arguments:
+
+        >> `store`             Chunk store directory
+
+        >> `name`              Snapshot name, or 'latest'
+
+        >> `target`            Directory to restore into
+
+      * Options:
+
+        >> `-q`, `-v`, `--json`  As for `cp`
+
+    - **plan**  
+      Preview a copy as NDJSON: kept files and sizes, largest directories and per-rule hit counts.
+
+      * Arguments:
+
+        >> `src`               Source directory
+
+      * Options:
+
+        >> `--summary-only`      Omit the per-file and per-directory records
+
+        >> `--top N`             Number of largest directories reported (default 10)
+
+        >> `--no-follow`         Do not follow symlinks (as `archive`)
+
+        >> `--exclude-zip`, `--exclude-log`, `--exclude-db`, `-ignore FILE`, `--no-nested` as for `cp`
+
+    - **filter**  
+      Read NUL-separated paths on stdin and print those that pass the rules (see `classify`).
+
+      * Options:
+
+        >> `--invert`            Print the ignored paths instead
+
+        >> `--lines`             Paths are separated by newlines instead of NUL bytes
+
+        >> `--exclude-zip`, `--exclude-log`, `--exclude-db`, `-ignore FILE` as for `cp`
+
     - **cp_ignore**  
       Manage `.cp_ignore` rules and behaviors.
 
@@ -212,12 +1217,20 @@ def jh_cp_main(argv: list[str] = None) -> None:
 
       * Arguments:
 
-        >> `src`                 Source directory to visualize
+        >> `src`                 Source directory, or archive, to visualize
 
       * Options:
 
         >> `--max-depth N`       Limit traversal depth (optional)
 
+        >> `--no-sort`           Print entries in directory order as they are read
+
+        >> `--max-entries N`     Show at most N entries per directory, then "... M more"
+
+        >> `--du`                Show file sizes and per-directory file and byte totals
+
+        >> `--format FORMAT`     Archive format when `src` is an archive whose name does not tell
+
         >> `--exclude-zip`       Exclude archive files (*.zip, *.tar.gz, *.7z, etc.)
 
         >> `--exclude-log`       Exclude log files (*.log, *.err, *.out)
@@ -226,6 +1239,20 @@ def jh_cp_main(argv: list[str] = None) -> None:
 
         >> `-ignore FILE`        Use custom ignore rule file (default is .cp_ignore)
 
+        >> `--no-nested`         Do not apply the .cp_ignore files found inside the source tree
+
+        >> `--no-cache`          Do not read or update the directory scan cache (on by default,
+                                 kept in `$JH_CP_CACHE_DIR` or `~/.cache/jh_cp`)
+
+    Global Options (before the subcommand):
+    ---------------------------------------
+
+    >> `--profile FILE`      Run the command under cProfile; write the stats to FILE and print the
+    `PROFILE_TOP` costliest calls to stderr
+
+    >> `--profile-memory`    Trace allocations with tracemalloc; print the peak and the `PROFILE_TOP`
+    largest allocation sites to stderr
+
     Notes:
     ------
 
@@ -233,6 +1260,9 @@ def jh_cp_main(argv: list[str] = None) -> None:
 
     - Lines starting with '!' define inclusion exceptions.
 
+    - A `.cp_ignore` inside the source tree applies to its directory and below, taking precedence
+      over the outer rules (`--no-nested` turns this off).
+
     >> `exclude-rules.ini` allows external configuration of file-type-based exclusion.
 
     :param argv: Optional list of command-line arguments (default: sys.argv[1:])